@@ -0,0 +1,92 @@
+"""
+Measures broadcast throughput of `ConnectionManager` in events per second on a
+single core, for rooms with 2 and 50 recipients.
+
+Compares the old per-recipient `send_json(event.asdict())` path with the
+serialize-once `broadcast_event`.
+
+Run from the repository root:
+
+    python benchmarks/broadcast.py
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+sys.path[:0] = [str(SRC), str(SRC / "common")]
+
+from fastapi.websockets import WebSocketState  # noqa: E402
+
+from common.events import board_event, message_event  # noqa: E402
+from common.tic_tac_toe import Cell  # noqa: E402
+from server.conn_manager import ConnectionManager  # noqa: E402
+from server.utils import Player  # noqa: E402
+
+
+class NullWebSocket:
+    """Accepts frames and throws them away, like an infinitely fast client."""
+
+    application_state = WebSocketState.CONNECTED
+    client_state = WebSocketState.CONNECTED
+
+    async def send_text(self, data: str) -> None:
+        pass
+
+    async def send_bytes(self, data: bytes) -> None:
+        pass
+
+    async def send_json(self, data) -> None:
+        # what starlette does
+        import json
+
+        await self.send_text(json.dumps(data, separators=(",", ":")))
+
+
+def make_events():
+    board = [[Cell.EMPTY, Cell.PLAYER, Cell.COMPUTER] for _ in range(3)]
+    return [board_event(board), message_event("someone will be making the first move")]
+
+
+async def per_recipient(manager: ConnectionManager, room: str, n: int) -> float:
+    connections = manager.active_connections[room]
+    start = time.perf_counter()
+    for _ in range(n):
+        for event in make_events():
+            await asyncio.gather(
+                *(conn.ws.send_json(event.asdict()) for conn in connections)
+            )
+    return time.perf_counter() - start
+
+
+async def serialize_once(manager: ConnectionManager, room: str, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        for event in make_events():
+            await manager.broadcast_event(room, event)
+    return time.perf_counter() - start
+
+
+async def main():
+    iterations = 5000
+    for recipients in (2, 50):
+        manager = ConnectionManager()
+        room = f"room{recipients}"
+        manager.active_connections[room] = [
+            Player(f"p{i}", NullWebSocket()) for i in range(recipients)
+        ]
+        events = iterations * 2
+        old = await per_recipient(manager, room, iterations)
+        new = await serialize_once(manager, room, iterations)
+        print(
+            f"{recipients:>3} recipients: "
+            f"per-recipient {events / old:>10.0f} events/s, "
+            f"serialize-once {events / new:>10.0f} events/s "
+            f"({old / new:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
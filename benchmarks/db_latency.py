@@ -0,0 +1,121 @@
+"""
+Measures the latency of moves in games in progress while other players join rooms
+on a slow database, with the database calls made on the event loop, the way the
+server used to, and on the database threads of `crud.run_in_session`.
+
+Every game loop waits on a queue for its moves, and a player per room sends one
+every 50 ms on average, so a move's latency is how long it sat in the queue. The
+database is SQLite with `DB_LATENCY` added to every statement.
+
+Run from the repository root:
+
+    python benchmarks/db_latency.py
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+sys.path[:0] = [str(SRC), str(SRC / "common")]
+
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from server.models import crud  # noqa: E402
+from server.models.database import Base  # noqa: E402
+
+ROOMS = 200
+# seconds added to every statement
+DB_LATENCY = 0.02
+# rooms joined per second while the games go on
+JOIN_RATE = 100
+DURATION = 3
+
+
+def slow_database(path: str) -> sessionmaker:
+    engine = create_engine(
+        f"sqlite:///{path}", connect_args={"check_same_thread": False}
+    )
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _slow(*_) -> None:
+        time.sleep(DB_LATENCY)
+
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def join_on_loop(room_id: str) -> None:
+    with crud.db_session() as db:
+        crud.get_room_by_id(room_id, db)
+
+
+async def join_on_thread(room_id: str) -> None:
+    await crud.run_in_session(partial(crud.get_room_by_id, room_id))
+
+
+async def measure(mode: str) -> list[float]:
+    latencies: list[float] = []
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    async def game(queue: asyncio.Queue[float]) -> None:
+        while True:
+            sent = await queue.get()
+            latencies.append(loop.time() - sent)
+
+    async def player(queue: asyncio.Queue[float]) -> None:
+        while not stop.is_set():
+            await asyncio.sleep(random.expovariate(20))
+            queue.put_nowait(loop.time())
+
+    async def joins() -> None:
+        while not stop.is_set():
+            await asyncio.sleep(random.expovariate(JOIN_RATE))
+            room_id = f"r{random.randrange(ROOMS):05}"
+            if mode == "event loop":
+                join_on_loop(room_id)
+            elif mode == "db threads":
+                loop.create_task(join_on_thread(room_id))
+
+    queues = [asyncio.Queue() for _ in range(ROOMS)]
+    tasks = [loop.create_task(game(queue)) for queue in queues]
+    tasks += [loop.create_task(player(queue)) for queue in queues]
+    tasks.append(loop.create_task(joins()))
+    await asyncio.sleep(DURATION)
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return latencies
+
+
+def percentile(values: list[float], p: float) -> float:
+    return statistics.quantiles(values, n=100)[p - 1] if p < 100 else max(values)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        crud.SessionLocal = slow_database(os.path.join(tmp, "bench.db"))
+        print(
+            f"{ROOMS} games, {JOIN_RATE} joins/s, {DB_LATENCY * 1000:.0f} ms per"
+            " statement, move latency in ms"
+        )
+        for mode in ("no joins", "event loop", "db threads"):
+            latencies = [s * 1000 for s in asyncio.run(measure(mode))]
+            print(
+                f"  {mode + ':':<12} p50 {percentile(latencies, 50):>7.2f}"
+                f"  p99 {percentile(latencies, 99):>7.2f}"
+                f"  max {percentile(latencies, 100):>7.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
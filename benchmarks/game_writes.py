@@ -0,0 +1,110 @@
+"""
+Compares writing the state of every game after each move, the way
+`crud.update_room_game_state` would on its own, against the write-behind
+`GameStateWriter`, which writes each room's latest state once per flush.
+
+`ROOMS` games run at once, each player moving every 100 ms on average, for
+`DURATION` seconds. The database is a SQLite file in WAL mode. Reported are the
+database transactions and rows written, and how long a move waited on its write.
+
+Run from the repository root:
+
+    python benchmarks/game_writes.py
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+sys.path[:0] = [str(SRC), str(SRC / "common")]
+
+# sqlite gets a single database thread, set before the server reads its config
+os.environ["DB_BACKEND"] = "sqlite"
+
+from sqlalchemy import event  # noqa: E402
+
+from server.models import crud  # noqa: E402
+from server.models.crud import GameState  # noqa: E402
+from server.models.database import Base, SessionLocal, sqlite_engine  # noqa: E402
+from server.models.dbmodels import GameStatus  # noqa: E402
+from server.persistence import GameStateWriter  # noqa: E402
+
+ROOMS = 500
+DURATION = 3
+
+
+async def play(room_id: str, write, waits: list[float], stop: asyncio.Event) -> None:
+    cells = bytearray(9)
+    while not stop.is_set():
+        await asyncio.sleep(random.expovariate(10))
+        cells[random.randrange(9)] = random.randint(1, 2)
+        state = GameState(crud.pack_cells(cells), "alice", GameStatus.PLAYING)
+        start = time.perf_counter()
+        await write(room_id, state)
+        waits.append(time.perf_counter() - start)
+
+
+async def measure(mode: str, room_ids: list[str]) -> list[float]:
+    waits: list[float] = []
+    stop = asyncio.Event()
+    writer = GameStateWriter(0.25, 10_000)
+    if mode == "write-behind":
+        writer.start()
+        write = writer.put
+    else:
+
+        async def write(room_id: str, state: GameState) -> None:
+            await crud.run_in_session(
+                partial(crud.update_room_game_states, {room_id: state})
+            )
+
+    tasks = [asyncio.create_task(play(r, write, waits, stop)) for r in room_ids]
+    await asyncio.sleep(DURATION)
+    stop.set()
+    await asyncio.gather(*tasks)
+    await writer.stop()
+    return waits
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = sqlite_engine(str(Path(tmp) / "bench.db"))
+        Base.metadata.create_all(bind=engine)
+        SessionLocal.configure(bind=engine)
+        counts = {"commit": 0, "rows": 0}
+
+        @event.listens_for(engine, "commit")
+        def _commit(*_) -> None:
+            counts["commit"] += 1
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _rows(conn, cursor, statement, parameters, context, executemany) -> None:
+            if statement.startswith("UPDATE"):
+                counts["rows"] += len(parameters) if executemany else 1
+
+        room_ids = []
+        with crud.db_session() as db:
+            for i in range(ROOMS):
+                room_ids.append(crud.create_room(f"r{i:05}", db).room_id)
+
+        print(f"{ROOMS} games for {DURATION}s, each player moving every 100 ms")
+        for mode in ("per move", "write-behind"):
+            counts.update(commit=0, rows=0)
+            waits = [s * 1000 for s in asyncio.run(measure(mode, room_ids))]
+            print(
+                f"  {mode + ':':<14} {len(waits)} moves, {counts['commit']} transactions,"
+                f" {counts['rows']} rows written,"
+                f" wait p50 {statistics.median(waits):.3f} ms"
+                f" p99 {statistics.quantiles(waits, n=100)[98]:.3f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
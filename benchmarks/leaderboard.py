@@ -0,0 +1,124 @@
+"""
+Times reading a leaderboard page, with ranks, at the top, the middle and the bottom
+of `PLAYERS` rated players, and rating a game.
+
+Compared are an OFFSET query ranking each player with a count of the players rated
+above them, `crud.leaderboard_page` reading off the rating index and the rating
+counts, and the `Leaderboard` kept in memory. The database is a SQLite file.
+
+Run from the repository root:
+
+    python benchmarks/leaderboard.py
+"""
+
+import os
+import random
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+sys.path[:0] = [str(SRC), str(SRC / "common")]
+
+# sqlite gets a single database thread, set before the server reads its config
+os.environ["DB_BACKEND"] = "sqlite"
+
+from sqlalchemy import func, insert  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from server.models import crud  # noqa: E402
+from server.models.database import Base, sqlite_engine  # noqa: E402
+from server.models.dbmodels import RatedPlayer, RatingCount  # noqa: E402
+from server.ratings import Leaderboard  # noqa: E402
+
+PLAYERS = 200_000
+PAGE = 20
+
+
+def fill(db: Session) -> None:
+    rows = [
+        {
+            "name": f"player{i:07}",
+            "rating": round(random.gauss(1200, 200)),
+            "games": 50,
+            "wins": 20,
+            "draws": 10,
+            "losses": 20,
+        }
+        for i in range(PLAYERS)
+    ]
+    db.execute(insert(RatedPlayer), rows)
+    db.execute(
+        insert(RatingCount).from_select(
+            ["rating", "players"],
+            db.query(RatedPlayer.rating, func.count()).group_by(RatedPlayer.rating),
+        )
+    )
+    db.commit()
+
+
+def offset_page(db: Session, offset: int) -> list[tuple[str, int]]:
+    """Paging the way a leaderboard is often first written."""
+    rows = (
+        db.query(RatedPlayer)
+        .order_by(RatedPlayer.rating.desc(), RatedPlayer.name.desc())
+        .offset(offset)
+        .limit(PAGE)
+        .all()
+    )
+    return [
+        (
+            row.name,
+            1
+            + db.query(func.count())
+            .select_from(RatedPlayer)
+            .filter(RatedPlayer.rating > row.rating)
+            .scalar(),
+        )
+        for row in rows
+    ]
+
+
+def timed(work, number: int = 20) -> float:
+    return min(timeit.repeat(work, number=number, repeat=3)) / number * 1000
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = sqlite_engine(str(Path(tmp) / "bench.db"))
+        Base.metadata.create_all(bind=engine)
+        with Session(engine) as db:
+            fill(db)
+            print(f"{PLAYERS} players, {PAGE} per page, ms per page")
+            for where, offset in (
+                ("top", 0),
+                ("middle", PLAYERS // 2),
+                ("bottom", PLAYERS - PAGE),
+            ):
+                after = None
+                if offset:
+                    before = offset_page(db, offset - 1)[0][0]
+                    rating = db.get(RatedPlayer, before).rating
+                    after = (rating, before)
+                old = timed(lambda: offset_page(db, offset), number=2)
+                new = timed(lambda: crud.leaderboard_page(db, PAGE, after))
+                print(
+                    f"  {where + ':':<8} offset {old:>8.2f}  rating index {new:>6.2f}"
+                )
+
+            leaderboard = Leaderboard(100, 60)
+            leaderboard.load(crud.leaderboard_page(db, 100))
+            cached = timed(lambda: leaderboard.page(PAGE, None), number=10_000)
+            print(f"  top, in memory: {cached:.4f}")
+
+            names = [f"player{i:07}" for i in range(PLAYERS)]
+            rate = timed(
+                lambda: crud.rate_game(tuple(random.sample(names, 2)), "", db),
+                number=200,
+            )
+            print(f"rating a game: {rate:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
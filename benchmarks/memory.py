@@ -0,0 +1,130 @@
+"""
+Measures the memory the server holds per room, for 10k and 100k rooms.
+
+An idle room is one created and waiting for its players. An active room has
+both players seated, each with a session reading their websocket, the game loop
+waiting on a move and a game a few moves in, which is the steady state of a
+busy server. Websockets are stand-ins which never receive anything, so only
+the server's own state is counted.
+
+Run from the repository root:
+
+    python benchmarks/memory.py
+"""
+
+import asyncio
+import gc
+import random
+import sys
+import tracemalloc
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+sys.path[:0] = [str(SRC), str(SRC / "common")]
+
+from server.conn_manager import ConnectionManager  # noqa: E402
+from server.game import RoomGame  # noqa: E402
+
+COUNTS = (10_000, 100_000)
+
+
+class IdleWebSocket:
+    """A websocket whose client never sends anything."""
+
+    def __init__(self) -> None:
+        self._closed = asyncio.get_running_loop().create_future()
+
+    async def receive(self) -> dict:
+        await self._closed
+        return {"type": "websocket.disconnect"}
+
+
+async def game_loop(manager: ConnectionManager, room_id: str, game: RoomGame):
+    player = manager.find_player_by_name(room_id, game.player1)
+    await manager.receive_event(room_id, player.ws)
+
+
+def measured(fill) -> int:
+    """Bytes still allocated after `fill` sets up the rooms."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    state = fill()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del state
+    return used
+
+
+def idle_rooms(count: int) -> int:
+    def fill():
+        manager = ConnectionManager()
+        for i in range(count):
+            manager.add_room(f"r{i:07}")
+        return manager
+
+    return measured(fill)
+
+
+async def active_rooms(count: int) -> int:
+    manager = ConnectionManager()
+    tasks = []
+
+    async def fill():
+        for i in range(count):
+            room_id = f"r{i:07}"
+            manager.add_room(room_id)
+            game = RoomGame(f"{room_id}-1", f"{room_id}-2", 3)
+            for name in (game.player1, game.player2):
+                ws = IdleWebSocket()
+                await manager.attach(room_id, ws, name, None)
+                tasks.append(asyncio.create_task(manager.read_events(room_id, ws)))
+            for j, pos in enumerate(random.sample(range(1, 10), 4)):
+                game.fill_player_cell((game.player1, game.player2)[j % 2], pos)
+            tasks.append(asyncio.create_task(game_loop(manager, room_id, game)))
+        # let every task reach the point where it waits
+        await asyncio.sleep(0)
+        return manager
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    await fill()
+    await asyncio.sleep(0)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return used
+
+
+def game_state(count: int) -> int:
+    def fill():
+        games = []
+        for i in range(count):
+            game = RoomGame(f"r{i:07}-1", f"r{i:07}-2", 3)
+            for j, pos in enumerate(random.sample(range(1, 10), 4)):
+                game.fill_player_cell((game.player1, game.player2)[j % 2], pos)
+            games.append(game)
+        return games
+
+    return measured(fill)
+
+
+def main():
+    for count in COUNTS:
+        idle = idle_rooms(count)
+        active = asyncio.run(active_rooms(count))
+        games = game_state(count)
+        print(f"{count} rooms")
+        print(f"  idle room:     {idle / count:>7.0f} bytes each, {idle >> 20} MiB")
+        print(f"  active room:   {active / count:>7.0f} bytes each, {active >> 20} MiB")
+        print(f"    game state:  {games / count:>7.0f} bytes each")
+
+
+if __name__ == "__main__":
+    main()
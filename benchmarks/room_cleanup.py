@@ -0,0 +1,99 @@
+"""
+Compares deleting expired rooms the way the server used to, loading every active
+room and deleting the old ones one at a time, against `crud.delete_expired_rooms`,
+which deletes them in batches off the `expires_on` index.
+
+The database is a SQLite file holding `ROOMS` rooms, `EXPIRED` of them expired, and
+each way runs on its own copy.
+
+Run from the repository root:
+
+    python benchmarks/room_cleanup.py
+"""
+
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+sys.path[:0] = [str(SRC), str(SRC / "common")]
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from server.models import crud  # noqa: E402
+from server.models.database import Base  # noqa: E402
+from server.models.dbmodels import Room  # noqa: E402
+
+ROOMS = 100_000
+EXPIRED = 5_000
+
+
+def fill(path: str) -> None:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    now = datetime.utcnow()
+    rows = []
+    for i in range(ROOMS):
+        age = timedelta(hours=3 if i < EXPIRED else 1)
+        rows.append(
+            {
+                "room_id": f"{i:06}",
+                "player1": "alice",
+                "player2": "bob",
+                "is_active": True,
+                "created_on": now - age,
+                "expires_on": now - age + timedelta(hours=2),
+            }
+        )
+    with engine.begin() as connection:
+        connection.execute(insert(Room), rows)
+    engine.dispose()
+
+
+def old_cleanup(db: Session) -> int:
+    """The cleanup the server used to have."""
+    deleted = 0
+    for room in db.query(Room).filter(Room.is_active):
+        age_seconds = (datetime.utcnow() - room.created_on).total_seconds()
+        if age_seconds > 60 * 60 * 2:
+            db.delete(room)
+            deleted += 1
+    db.commit()
+    return deleted
+
+
+def new_cleanup(db: Session) -> int:
+    return len(crud.delete_expired_rooms(db, [], max_duration=60))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        template = str(Path(tmp) / "template.db")
+        fill(template)
+        print(f"{ROOMS} rooms, {EXPIRED} of them expired")
+        for name, cleanup in (("one at a time", old_cleanup), ("batched", new_cleanup)):
+            path = str(Path(tmp) / f"{cleanup.__name__}.db")
+            shutil.copy(template, path)
+            engine = create_engine(f"sqlite:///{path}")
+            with Session(engine) as db:
+                start = time.perf_counter()
+                deleted = cleanup(db)
+                elapsed = time.perf_counter() - start
+            # expired rooms are gone, so another pass finds nothing to do
+            with Session(engine) as db:
+                start = time.perf_counter()
+                cleanup(db)
+                idle = time.perf_counter() - start
+            engine.dispose()
+            print(
+                f"  {name + ':':<15} deleted {deleted} in {elapsed * 1000:>7.1f} ms,"
+                f" pass with nothing expired {idle * 1000:>6.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
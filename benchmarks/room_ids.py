@@ -0,0 +1,93 @@
+"""
+Compares creating rooms the way the server used to, checking a random id is free
+before inserting it, against inserting under an id from `RoomIdPool` straight away.
+
+Also times generating the ids alone, one character at a time against the pool's
+batches. The database is SQLite in memory, with `ROOMS` rooms created each way.
+
+Run from the repository root:
+
+    python benchmarks/room_ids.py
+"""
+
+import secrets
+import string
+import sys
+import time
+import timeit
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+sys.path[:0] = [str(SRC), str(SRC / "common")]
+
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.orm import Session, sessionmaker  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+from server.models import crud  # noqa: E402
+from server.models.cache import TTLCache  # noqa: E402
+from server.models.database import Base  # noqa: E402
+from server.room_ids import RoomIdPool  # noqa: E402
+
+ROOMS = 5000
+
+
+def random_room_id() -> str:
+    """The id generation the server used to have."""
+    usable = string.ascii_letters + string.digits
+    return "".join(secrets.choice(usable) for _ in range(6))
+
+
+def checked_create(db: Session) -> str:
+    room_id = random_room_id()
+    while crud.get_room_by_id(room_id, db):
+        room_id = random_room_id()
+    crud.create_room(room_id, db)
+    return room_id
+
+
+def main():
+    pool = RoomIdPool(1024)
+    old = min(timeit.repeat(random_room_id, number=20_000, repeat=3)) / 20_000
+    new = min(timeit.repeat(pool.take, number=20_000, repeat=3)) / 20_000
+    print("generating ids, us per id")
+    print(f"  one character at a time: {old * 1e6:>6.2f}")
+    print(f"  pooled batches:          {new * 1e6:>6.2f}")
+
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    crud.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    # rooms that don't exist are never cached, so the cache only skews the joins
+    crud.room_cache = TTLCache(0, 0)
+    statements = [0]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(*_) -> None:
+        statements[0] += 1
+
+    print(f"creating {ROOMS} rooms")
+    for name, create in (
+        ("check, then insert", checked_create),
+        (
+            "optimistic insert",
+            lambda db: pool.insert(lambda ids: crud.create_room(ids[0], db)).room_id,
+        ),
+    ):
+        statements[0] = 0
+        start = time.perf_counter()
+        for _ in range(ROOMS):
+            with crud.db_session() as db:
+                create(db)
+        elapsed = time.perf_counter() - start
+        print(
+            f"  {name + ':':<20} {elapsed / ROOMS * 1e6:>6.0f} us per room,"
+            f" {statements[0] / ROOMS:.1f} statements per room"
+        )
+
+
+if __name__ == "__main__":
+    main()
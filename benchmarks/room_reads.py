@@ -0,0 +1,83 @@
+"""
+Counts the database reads of a game between two players, from creating the room to
+its game loop looking it up, with and without the room cache.
+
+A game is `/rooms/create`, a `/rooms/join` for each player, the game loop reading
+the room and a player reconnecting after a restart, which looks the room up again.
+
+Run from the repository root:
+
+    python benchmarks/room_reads.py
+"""
+
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+sys.path[:0] = [str(SRC), str(SRC / "common")]
+
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+from server.models import crud  # noqa: E402
+from server.models.cache import TTLCache  # noqa: E402
+from server.models.database import Base  # noqa: E402
+from server.room_ids import RoomIdPool  # noqa: E402
+
+GAMES = 1000
+
+
+def play_games(count: int) -> None:
+    pool = RoomIdPool(count)
+    for i in range(count):
+        with crud.db_session() as db:
+            room_id = pool.insert(lambda ids: crud.create_room(ids[0], db)).room_id
+        for name in ("alice", "bob"):
+            with crud.db_session() as db:
+                room = crud.get_room_by_id(room_id, db)
+                assert room is not None and room.is_active
+                ok, message = crud.add_player_to_room(room_id, name, db)
+                assert ok, message
+        # the game loop, then a reconnect after a restart
+        for _ in range(2):
+            with crud.db_session() as db:
+                crud.get_room_by_id(room_id, db)
+
+
+def main():
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    crud.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    statements = {"SELECT": 0, "INSERT": 0, "UPDATE": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(conn, cursor, statement, *_) -> None:
+        kind = statement.lstrip().split(None, 1)[0].upper()
+        if kind in statements:
+            statements[kind] += 1
+
+    print(f"database statements per game, over {GAMES} games")
+    for name, cache in (
+        ("no cache", TTLCache(0, 0)),
+        ("room cache", TTLCache(10_000, 60)),
+    ):
+        crud.room_cache = cache
+        for kind in statements:
+            statements[kind] = 0
+        play_games(GAMES)
+        counts = "  ".join(
+            f"{k.lower()} {v / GAMES:.1f}" for k, v in statements.items()
+        )
+        print(
+            f"  {name + ':':<12} {counts}  (hits {cache.hits}, misses {cache.misses})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Measures how long a move takes to reach the two players of a room as the number
+of spectators watching it grows.
+
+Spectators are slow clients, every frame sent to them takes a few milliseconds,
+while players are infinitely fast. A move is made every 10 milliseconds, and its
+latency is the time from the move arriving to the last player getting the board.
+
+Run from the repository root:
+
+    python benchmarks/spectators.py
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+sys.path[:0] = [str(SRC), str(SRC / "common")]
+
+from fastapi.websockets import WebSocketState  # noqa: E402
+
+from common.events import board_event, delta_event  # noqa: E402
+from common.tic_tac_toe import Cell  # noqa: E402
+from server.conn_manager import ConnectionManager  # noqa: E402
+from server.utils import Player  # noqa: E402
+
+MOVES = 500
+MOVE_INTERVAL = 0.01
+SPECTATOR_SEND_TIME = 0.025
+
+
+class PlayerWebSocket:
+    """Records when the last frame arrived."""
+
+    application_state = WebSocketState.CONNECTED
+    client_state = WebSocketState.CONNECTED
+
+    def __init__(self) -> None:
+        self.received_at = 0.0
+
+    async def send_text(self, data: str) -> None:
+        self.received_at = time.perf_counter()
+
+    async def send_bytes(self, data: bytes) -> None:
+        self.received_at = time.perf_counter()
+
+
+class SpectatorWebSocket:
+    """A client on a slow link, each send blocks for a while."""
+
+    def __init__(self) -> None:
+        self.application_state = WebSocketState.CONNECTING
+        self.client_state = WebSocketState.CONNECTED
+        self.scope = {"type": "websocket", "subprotocols": []}
+        self.frames = 0
+        self._gone = asyncio.Event()
+
+    async def accept(self, subprotocol: str | None = None) -> None:
+        self.application_state = WebSocketState.CONNECTED
+
+    async def close(self, code: int = 1000, reason: str | None = None) -> None:
+        self.application_state = WebSocketState.DISCONNECTED
+        self._gone.set()
+
+    async def receive(self) -> dict:
+        await self._gone.wait()
+        return {"type": "websocket.disconnect", "code": 1000}
+
+    async def send_text(self, data: str) -> None:
+        await asyncio.sleep(SPECTATOR_SEND_TIME)
+        self.frames += 1
+
+    async def send_bytes(self, data: bytes) -> None:
+        await self.send_text("")
+
+
+async def run(spectator_count: int) -> tuple[list[float], float]:
+    manager = ConnectionManager()
+    room = "bench"
+    players = [PlayerWebSocket(), PlayerWebSocket()]
+    manager.add_room(room)
+    manager.active_connections[room] = [
+        Player("a", players[0], deltas=True),
+        Player("b", players[1]),
+    ]
+
+    spectators = [SpectatorWebSocket() for _ in range(spectator_count)]
+    watchers = [asyncio.create_task(manager.watch(room, ws)) for ws in spectators]
+    await asyncio.sleep(0)
+
+    board = [[Cell.EMPTY] * 3 for _ in range(3)]
+    moves: asyncio.Queue[float] = asyncio.Queue()
+
+    async def game_loop() -> list[float]:
+        latencies = []
+        for seq in range(1, MOVES + 1):
+            arrived = await moves.get()
+            pos = seq % 9 + 1
+            await manager.broadcast_event(
+                room,
+                delta_event(pos, Cell.PLAYER, seq),
+                fallback=lambda: board_event(board, seq),
+            )
+            done = max(ws.received_at for ws in players)
+            latencies.append(done - arrived)
+        return latencies
+
+    game = asyncio.create_task(game_loop())
+    for _ in range(MOVES):
+        moves.put_nowait(time.perf_counter())
+        await asyncio.sleep(MOVE_INTERVAL)
+    latencies = await game
+
+    frames = sum(ws.frames for ws in spectators)
+    await manager.delete_room(room)
+    await asyncio.gather(*watchers)
+    return latencies, frames / max(spectator_count, 1)
+
+
+async def main():
+    for spectator_count in (0, 10, 100, 500, 1000):
+        latencies, frames = await run(spectator_count)
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1e6
+        p99 = latencies[int(len(latencies) * 0.99)] * 1e6
+        print(
+            f"{spectator_count:>5} spectators: "
+            f"p50 {p50:>8.0f} us, p99 {p99:>8.0f} us, "
+            f"{frames:>6.0f} of {MOVES} boards sent to each spectator"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
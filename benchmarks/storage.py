@@ -0,0 +1,108 @@
+"""
+Measures the latency of `/rooms/create` and `/rooms/join` under each storage backend:
+SQLite in a WAL mode file, SQLite in memory, and MySQL when one is configured with the
+`MYSQL_*` variables, like for the server.
+
+Each backend runs in a process of its own, through the whole app with its lifespan,
+creating `ROOMS` rooms one at a time and then joining both players to each of them.
+
+Run from the repository root:
+
+    python benchmarks/storage.py
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+sys.path[:0] = [str(SRC), str(SRC / "common")]
+
+ROOMS = 500
+
+# rate limits and load shedding would turn the benchmark away
+LIMITS = {
+    "ROOM_CREATE_RATE": "1000000",
+    "ROOM_CREATE_BURST": "1000000",
+    "ROOM_JOIN_RATE": "1000000",
+    "ROOM_JOIN_BURST": "1000000",
+    "ADMISSION_MAX_LOOP_LAG": "0",
+    "COMPUTER_WORKERS": "1",
+}
+
+
+def percentile(values: list[float], p: float) -> float:
+    return statistics.quantiles(values, n=100)[p - 1]
+
+
+def measure() -> dict[str, list[float]]:
+    """Runs in the child process, with the backend set in its environment."""
+    from fastapi.testclient import TestClient
+
+    from server.app import app
+
+    timings: dict[str, list[float]] = {"create": [], "join": []}
+    with TestClient(app) as client:
+        room_ids = []
+        for _ in range(ROOMS):
+            start = time.perf_counter()
+            response = client.post("/rooms/create").json()
+            timings["create"].append(time.perf_counter() - start)
+            room_ids.append(response["room_id"])
+
+        for room_id in room_ids:
+            for name in ("alice", "bob"):
+                start = time.perf_counter()
+                response = client.post(
+                    "/rooms/join", json={"room_id": room_id, "player_name": name}
+                ).json()
+                timings["join"].append(time.perf_counter() - start)
+                assert response["success"], response
+    return timings
+
+
+def run(backend: str, env: dict[str, str]) -> dict[str, list[float]]:
+    result = subprocess.run(
+        [sys.executable, __file__, "--child"],
+        env={**os.environ, **LIMITS, "DB_BACKEND": backend, **env},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    if sys.argv[1:] == ["--child"]:
+        print(json.dumps(measure()))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            "sqlite file": ("sqlite", {"SQLITE_PATH": os.path.join(tmp, "bench.db")}),
+            "sqlite memory": ("sqlite", {"SQLITE_PATH": ":memory:"}),
+        }
+        if "MYSQL_HOST" in os.environ:
+            backends["mysql"] = ("mysql", {})
+
+        print(f"{ROOMS} rooms created, then joined by two players, latency in ms")
+        for name, (backend, env) in backends.items():
+            timings = run(backend, env)
+            for route, seconds in timings.items():
+                ms = [s * 1000 for s in seconds]
+                print(
+                    f"  {name + ':':<15} {route:<7}"
+                    f" p50 {percentile(ms, 50):>6.2f}"
+                    f"  p99 {percentile(ms, 99):>6.2f}"
+                )
+        if "mysql" not in backends:
+            print("  mysql: skipped, set the MYSQL_* variables to include it")
+
+
+if __name__ == "__main__":
+    main()
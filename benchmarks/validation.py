@@ -0,0 +1,109 @@
+"""
+Measures the cost of validating inbound events, per event.
+
+Compares building a move out of a decoded JSON frame the way the server used
+to, with no checks (`EventType(...)`, then `Move(**data)`), against the
+validated `Event.from_dict` followed by `Move(pos, marker)`, and the written
+out check of move data against the same schema compiled like those of the
+other events. Also times rejecting malformed events, and decoding whole frames.
+
+Run from the repository root:
+
+    python benchmarks/validation.py
+"""
+
+import json
+import sys
+import timeit
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+sys.path[:0] = [str(SRC), str(SRC / "common")]
+
+from common.events import (  # noqa: E402
+    _POSITION_RANGE,
+    Event,
+    EventType,
+    InvalidStructureException,
+    _check_move,
+    _compile_schema,
+    decode_event,
+    resync_event,
+)
+from common.tic_tac_toe import Move  # noqa: E402
+
+
+def unchecked_from_dict(d: dict) -> Event:
+    """`Event.from_dict` before validation."""
+    t = d.get("type_")
+    d_ = d.get("data")
+    if t is None or d is None or not isinstance(d_, dict):
+        raise InvalidStructureException("missing fields")
+    try:
+        t_ = EventType(t)
+    except ValueError:
+        raise InvalidStructureException(f"event type {t} is unknown")
+    return Event(t_, d_)
+
+
+def unchecked_move(d: dict) -> Move:
+    return Move.from_dict(unchecked_from_dict(d).data["move"])
+
+
+def validated_move(d: dict) -> Move:
+    move = Event.from_dict(d).data["move"]
+    return Move(move["pos"], move["marker"])
+
+
+def rejected(d: dict) -> None:
+    try:
+        Event.from_dict(d)
+    except InvalidStructureException:
+        pass
+
+
+def per_call_ns(fn, number: int = 200_000) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e9
+
+
+def main():
+    move = {"type_": "move", "data": {"move": {"pos": 5, "marker": "alice"}}}
+    resync = {"type_": "resync", "data": {"seq": 12}}
+    invalid = {
+        "off the board": {"type_": "move", "data": {"move": {"pos": 99}}},
+        "wrong type": {"type_": "move", "data": {"move": {"pos": "5"}}},
+        "unknown type": {"type_": "teleport", "data": {}},
+    }
+
+    print("building events out of decoded JSON, ns per event")
+    print(f"  move, unchecked:   {per_call_ns(lambda: unchecked_move(move)):>7.0f}")
+    print(f"  move, validated:   {per_call_ns(lambda: validated_move(move)):>7.0f}")
+    unchecked = per_call_ns(lambda: unchecked_from_dict(resync))
+    validated = per_call_ns(lambda: Event.from_dict(resync))
+    print(f"  resync, unchecked: {unchecked:>7.0f}")
+    print(f"  resync, validated: {validated:>7.0f}")
+
+    compiled = _compile_schema(
+        {"move": {"pos": _POSITION_RANGE, "marker": (str, type(None))}}
+    )
+    data = move["data"]
+    print("checking move data, ns per event")
+    print(f"  compiled schema:   {per_call_ns(lambda: compiled(data)):>7.0f}")
+    print(f"  written out:       {per_call_ns(lambda: _check_move(data)):>7.0f}")
+
+    print("rejecting invalid events, ns per event")
+    for name, d in invalid.items():
+        print(f"  {name + ':':<18} {per_call_ns(lambda: rejected(d)):>7.0f}")
+
+    text = json.dumps(move)
+    binary = Event(EventType.MOVE, move["data"]).encode_binary()
+    resync_binary = resync_event(12).encode_binary()
+    print("decoding whole frames, validation included, ns per frame")
+    print(f"  move, json:        {per_call_ns(lambda: decode_event(text)):>7.0f}")
+    print(f"  move, binary:      {per_call_ns(lambda: decode_event(binary)):>7.0f}")
+    resync_ns = per_call_ns(lambda: decode_event(resync_binary))
+    print(f"  resync, binary:    {resync_ns:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Measures how long saving and restoring the games in progress takes around a
+restart, for a server with 50k rooms mid game.
+
+Restoring is reading the checkpoint and setting up the rooms in the connection
+manager, which is what the server does on startup before accepting connections.
+
+Run from the repository root:
+
+    python benchmarks/warm_restart.py
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+sys.path[:0] = [str(SRC), str(SRC / "common")]
+
+from server.checkpoint import (  # noqa: E402
+    RoomCheckpoint,
+    load_checkpoint,
+    save_checkpoint,
+)
+from server.conn_manager import ConnectionManager  # noqa: E402
+from server.room_ids import RoomIdPool  # noqa: E402
+
+ROOMS = 50_000
+
+
+def make_rooms(count: int) -> list[RoomCheckpoint]:
+    rooms = {}
+    pool = RoomIdPool(count)
+    while len(rooms) < count:
+        room_id = pool.take()[0]
+        grid_size = random.choice((3, 3, 3, 4, 5))
+        cells = grid_size * grid_size
+        moves = random.sample(range(1, cells + 1), random.randrange(cells))
+        rooms[room_id] = RoomCheckpoint(
+            room_id,
+            grid_size,
+            "",
+            f"player-{room_id}-1",
+            f"player-{room_id}-2",
+            f"player-{room_id}-1",
+            bytes(moves),
+            random.uniform(0, 1800),
+        )
+    return list(rooms.values())
+
+
+def main():
+    rooms = make_rooms(ROOMS)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "rooms.json")
+
+        start = time.perf_counter()
+        save_checkpoint(path, rooms)
+        saved = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        manager = ConnectionManager()
+        restored = {}
+        for room in load_checkpoint(path):
+            manager.add_room(room.room_id)
+            restored[room.room_id] = room
+        loaded = time.perf_counter() - start
+
+    assert len(restored) == ROOMS
+    print(f"{ROOMS} rooms, {size / 1024:.0f} KiB checkpoint")
+    print(f"save:    {saved * 1000:>6.0f} ms")
+    print(f"restore: {loaded * 1000:>6.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
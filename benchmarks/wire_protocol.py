@@ -0,0 +1,68 @@
+"""
+Compares the JSON and binary wire formats of `common.events`: frame size in
+bytes and encode/decode time per event.
+
+Run from the repository root:
+
+    python benchmarks/wire_protocol.py
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+sys.path[:0] = [str(SRC), str(SRC / "common")]
+
+from common.events import (  # noqa: E402
+    Event,
+    EventType,
+    ask_move_event,
+    board_event,
+    decode_event,
+    message_event,
+    result_event,
+)
+from common.tic_tac_toe import Cell  # noqa: E402
+
+
+def sample_events() -> dict[str, Event]:
+    board = [
+        [Cell.COMPUTER, Cell.COMPUTER, Cell.COMPUTER],
+        [Cell.PLAYER, Cell.PLAYER, Cell.EMPTY],
+        [Cell.EMPTY, Cell.EMPTY, Cell.EMPTY],
+    ]
+    result = {"victory": True, "winner": "alice", "coordinates": [(0, 0), (0, 1)]}
+    return {
+        "message": message_event("bob will be making the first move"),
+        "board": board_event(board),
+        "move": Event(EventType.MOVE, {"move": {"pos": 5, "marker": "alice"}}),
+        "ask_move": ask_move_event("alice"),
+        "result": result_event(board, result, "alice wins the game."),
+    }
+
+
+def per_call_us(fn, number: int = 20000) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    print(
+        f"{'event':<10}{'json B':>8}{'bin B':>8}"
+        f"{'json enc us':>13}{'bin enc us':>12}{'json dec us':>13}{'bin dec us':>12}"
+    )
+    for name, event in sample_events().items():
+        text, binary = event.encode(), event.encode_binary()
+        # encode on a fresh event each time, encodings are cached per event
+        json_enc = per_call_us(lambda: Event(event.type_, event.data).encode())
+        bin_enc = per_call_us(lambda: Event(event.type_, event.data).encode_binary())
+        json_dec = per_call_us(lambda: decode_event(text))
+        bin_dec = per_call_us(lambda: decode_event(binary))
+        print(
+            f"{name:<10}{len(text.encode()):>8}{len(binary):>8}"
+            f"{json_enc:>13.2f}{bin_enc:>12.2f}{json_dec:>13.2f}{bin_dec:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
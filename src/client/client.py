@@ -1,7 +1,8 @@
 import argparse
 import asyncio
-import json
+import random
 import re
+from urllib.parse import urlencode
 
 import requests
 import websockets
@@ -9,10 +10,13 @@ from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Prompt
 
-from common.events import Event, EventType
+from common.events import Event, EventType, Subprotocol, decode_event, resync_event
 from common.tic_tac_toe import Cell, CheckWinResult, Difficulty, Move, TicTacToe
 
 DEFAULT_SERVER_IP = "104.248.22.239"
+# reconnects tried after the connection drops, waiting about twice as long each time
+RECONNECT_ATTEMPTS = 6
+RECONNECT_BACKOFF = 0.5
 
 console = Console()
 
@@ -20,9 +24,31 @@ console = Console()
 # todo commas and symbols not allowed in player name
 
 
-def create_room(base_server_url):
+def ask_grid_size() -> int:
+    grid_size = Prompt.ask(
+        "[bold]Choose the grid size[/bold]", choices=["3", "4", "5"], default="3"
+    )
+    return int(grid_size)
+
+
+# responses asking to try again after `Retry-After` seconds: rate limited or busy
+RETRY_LATER = (429, 503)
+
+
+def print_retry_later(resp: requests.Response):
+    retry_after = resp.headers.get("Retry-After", "a few")
+    console.print(f"[bold red]{resp.json()['detail']}[/bold red]")
+    console.print(f"[bold red]Try again in {retry_after} seconds.[/bold red]")
+
+
+def create_room(base_server_url, grid_size: int, computer: Difficulty | None = None):
     console.print("[bold green]Creating a new room...[/bold green]")
-    resp = requests.post(f"{base_server_url}/rooms/create")
+    payload = {"grid_size": grid_size, "computer": computer}
+    resp = requests.post(f"{base_server_url}/rooms/create", json=payload)
+
+    if resp.status_code in RETRY_LATER:
+        print_retry_later(resp)
+        quit(1)
 
     if resp.status_code != 200:
         console.print("[bold red]Unable to request the server![/bold red]")
@@ -46,12 +72,23 @@ async def main(server_ip):
     console.print(
         Panel.fit("[bold]Welcome to Tic-Tac-Toe![/bold]", border_style="blue")
     )
-    prompt_text = "What do you want to do? \n1. Create a room \n2. Join a room\n"
-    choice = Prompt.ask(prompt_text, choices=["1", "2"])
+    prompt_text = (
+        "What do you want to do? \n1. Create a room \n2. Join a room\n"
+        "3. Quick play against anyone\n4. Play against the computer\n"
+    )
+    choice = Prompt.ask(prompt_text, choices=["1", "2", "3", "4"])
 
     if choice == "1":
-        room_id = create_room(base_server_url)
-    else:
+        room_id = create_room(base_server_url, ask_grid_size())
+    elif choice == "4":
+        grid_size = ask_grid_size()
+        difficulty = Prompt.ask(
+            "[bold]Choose the difficulty[/bold]",
+            choices=[d.value for d in Difficulty],
+            default=Difficulty.MEDIUM.value,
+        )
+        room_id = create_room(base_server_url, grid_size, Difficulty(difficulty))
+    elif choice == "2":
         room_id_regex = re.compile(r"[\dA-Za-z]{6}")
         while True:
             room_id = Prompt.ask("[bold]Enter the six-digit room id[/bold]")
@@ -62,65 +99,145 @@ async def main(server_ip):
             break
 
     player_name = Prompt.ask("[bold]Enter a nickname[/bold]")
-    payload = {"room_id": room_id, "player_name": player_name}
-    join_resp = requests.post(f"{base_server_url}/rooms/join", json=payload).json()
+    if choice == "3":
+        # the server picks the room, `MATCHED` says which one
+        query = urlencode({"name": player_name, "grid_size": ask_grid_size()})
+        websocket_url = f"{base_server_ws}/quickplay?{query}"
+    else:
+        payload = {"room_id": room_id, "player_name": player_name}
+        join_resp = requests.post(f"{base_server_url}/rooms/join", json=payload)
+        if join_resp.status_code in RETRY_LATER:
+            print_retry_later(join_resp)
+            quit(1)
 
-    if not join_resp["success"]:
-        console.print("[bold red]Unable to join the room.[/bold red]")
-        console.print(join_resp["message"])
-        quit(1)
+        join_resp = join_resp.json()
+
+        if not join_resp["success"]:
+            console.print("[bold red]Unable to join the room.[/bold red]")
+            console.print(join_resp["message"])
+            quit(1)
+
+        console.print("[bold green]Successfully joined the room![/bold green]")
+        redirect = join_resp["websocket_redirect"]
+        token = join_resp["token"]
+        websocket_url = f"{base_server_ws}{redirect}?token={token}"
 
-    console.print("[bold green]Successfully joined the room![/bold green]")
-    redirect = join_resp["websocket_redirect"]
-    token = join_resp["token"]
-    websocket_url = f"{base_server_ws}{redirect}?token={token}"
+    subprotocols = [Subprotocol.DELTA_BINARY, Subprotocol.DELTA_JSON]
+    # rebuilt to the size of the first board the server sends
+    game = TicTacToe(Difficulty.EASY, 3)
 
-    async with websockets.connect(websocket_url) as ws:
+    def load_board(board: list[list[int]]):
+        nonlocal game
+        if len(board) != game.grid_size:
+            game = TicTacToe(Difficulty.EASY, len(board))
+        game.board = [[Cell(x) for x in row] for row in board]
+
+    # number of moves reflected by the local board
+    seq = 0
+    attempt = 0
+    while True:
         try:
-            game = TicTacToe(Difficulty.EASY, 3)
-            while True:
-                data = json.loads(await ws.recv())
-                event = Event.from_dict(data)
-                match event.type_:
-                    case EventType.BOARD:
-                        game.board = [
-                            list(map(lambda x: Cell(x), row))
-                            for row in event.data["board"]
-                        ]
-                        game.display_board()
-
-                    case EventType.ASK_MOVE:
-                        if event.data["player"] != player_name:
-                            continue
-                        console.print("[bold]Your turn![/bold]")
-                        pos = game.position_input()
-                        move = Move(pos, player_name)
-                        move_event = Event(EventType.MOVE, {"move": move.asdict()})
-                        await ws.send(json.dumps(move_event.asdict()))
-
-                    case EventType.RESULT:
-                        game.board = game.board = [
-                            list(map(lambda x: Cell(x), row))
-                            for row in event.data["board"]
-                        ]
-                        game.display_board(
-                            CheckWinResult.from_dict(event.data["result"])
-                        )
-                        console.print(f"[bold]{event.data['message']}[/bold]")
-                        return
-
-                    case EventType.MESSAGE:
-                        console.print(
-                            f"[bold yellow]server> {event.data['message']}[/bold yellow]"
-                        )
-
-                    case _:
-                        raise Exception(f"unknown {event=} recieved from server")
+            async with websockets.connect(
+                websocket_url, subprotocols=subprotocols
+            ) as ws:
+                attempt = 0
+                binary = ws.subprotocol == Subprotocol.DELTA_BINARY
+
+                async def send(event: Event):
+                    await ws.send(event.encode_binary() if binary else event.encode())
+
+                while True:
+                    event = decode_event(await ws.recv())
+                    match event.type_:
+                        case EventType.BOARD:
+                            load_board(event.data["board"])
+                            seq = event.data.get("seq", seq)
+                            game.display_board()
+
+                        case EventType.DELTA:
+                            if event.data["seq"] != seq + 1:
+                                # missed an update, ask for a snapshot
+                                await send(resync_event(seq))
+                                continue
+                            row, col = game.position_to_coordinates[event.data["pos"]]
+                            game.board[row][col] = Cell(event.data["cell"])
+                            seq = event.data["seq"]
+                            game.display_board()
+
+                        case EventType.ASK_MOVE:
+                            if event.data["player"] != player_name:
+                                continue
+                            console.print("[bold]Your turn![/bold]")
+                            pos = game.position_input()
+                            move = Move(pos, player_name)
+                            await send(Event(EventType.MOVE, {"move": move.asdict()}))
+
+                        case EventType.RESULT:
+                            if "board" in event.data:
+                                load_board(event.data["board"])
+                            game.display_board(
+                                CheckWinResult.from_dict(event.data["result"])
+                            )
+                            console.print(f"[bold]{event.data['message']}[/bold]")
+                            return
+
+                        case EventType.MATCHED:
+                            player_name = event.data["player"]
+                            # reconnects go straight to the room
+                            websocket_url = (
+                                f"{base_server_ws}/game/{event.data['room_id']}"
+                                f"?token={event.data['token']}"
+                            )
+                            console.print(
+                                f"[bold green]Matched with {event.data['opponent']}!"
+                                "[/bold green]"
+                            )
+
+                        case EventType.MESSAGE:
+                            console.print(
+                                f"[bold yellow]server> {event.data['message']}[/bold yellow]"
+                            )
+
+                        case EventType.ERROR:
+                            console.print(
+                                f"[bold red]server> {event.data['message']}[/bold red]"
+                            )
+
+                        case _:
+                            raise Exception(f"unknown {event=} recieved from server")
 
         except KeyboardInterrupt:
             console.print("[bold red]Game interrupted.[/bold red]")
             quit(1)
 
+        except websockets.exceptions.ConnectionClosedOK:
+            # the server closed the room
+            return
+
+        except websockets.exceptions.InvalidStatus as e:
+            # turned away, a busy server says when to try again
+            if e.response.status_code != 503 or attempt == RECONNECT_ATTEMPTS:
+                console.print("[bold red]Unable to connect to the server.[/bold red]")
+                quit(1)
+            delay = float(e.response.headers.get("Retry-After", RECONNECT_BACKOFF))
+            attempt += 1
+            console.print(
+                f"[bold red]The server is busy, retrying in {delay:.0f}s...[/bold red]"
+            )
+            await asyncio.sleep(delay)
+
+        except (websockets.exceptions.ConnectionClosedError, OSError):
+            # the server keeps our seat for a while, so reconnect with the same token
+            if attempt == RECONNECT_ATTEMPTS:
+                console.print("[bold red]Lost connection to the server.[/bold red]")
+                quit(1)
+            delay = min(RECONNECT_BACKOFF * 2**attempt, 10) * random.uniform(0.5, 1)
+            attempt += 1
+            console.print(
+                f"[bold red]Connection lost, reconnecting in {delay:.1f}s...[/bold red]"
+            )
+            await asyncio.sleep(delay)
+
 
 def parse_args():
     parser = argparse.ArgumentParser()
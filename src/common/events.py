@@ -1,9 +1,17 @@
-from dataclasses import asdict, dataclass
+import json
+import struct
+from copy import deepcopy
+from dataclasses import dataclass, field
 from enum import StrEnum, auto
-from typing import Any
+from typing import Any, Callable
 
 from tic_tac_toe import Cell
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class InvalidStructureException(Exception):
     """
@@ -24,12 +32,55 @@ class EventType(StrEnum):
     ASK_MOVE = auto()
     ROOM_STATUS = auto()
     REMATCH_VOTE = auto()
+    DELTA = auto()
+    RESYNC = auto()
+    MATCHED = auto()
+    ERROR = auto()
 
     def __repr__(self) -> str:
         # overrides default enum repr
         return self.value
 
 
+# events a client may send, the server rejects any other
+CLIENT_EVENTS = frozenset((EventType.MOVE, EventType.QUIT, EventType.RESYNC))
+
+# largest grid played on, its cells fit the 32 bit masks of packed boards
+MAX_GRID_SIZE = 5
+
+
+class Subprotocol(StrEnum):
+    """
+    Websocket subprotocols spoken by the server, in order of preference.
+
+    Clients which don't ask for any subprotocol get JSON text frames. The v2
+    protocols send `DELTA` events during play instead of the full board.
+    """
+
+    DELTA_BINARY = "ttt.binary.v2"
+    DELTA_JSON = "ttt.json.v2"
+    BINARY = "ttt.binary.v1"
+    JSON = "ttt.json.v1"
+
+    @property
+    def binary(self) -> bool:
+        return self in (Subprotocol.BINARY, Subprotocol.DELTA_BINARY)
+
+    @property
+    def deltas(self) -> bool:
+        return self in (Subprotocol.DELTA_JSON, Subprotocol.DELTA_BINARY)
+
+
+def negotiate_subprotocol(offered: list[str]) -> Subprotocol | None:
+    """
+    Picks the subprotocol to accept out of the ones offered by a client.
+    """
+    for subprotocol in Subprotocol:
+        if subprotocol in offered:
+            return subprotocol
+    return None
+
+
 @dataclass(frozen=True, slots=True)
 class Event:
     """
@@ -38,27 +89,182 @@ class Event:
 
     type_: EventType
     data: dict[str, Any]
+    # the encoded frame, filled in by the first `encode` call
+    _frame: str | None = field(default=None, compare=False, repr=False)
+    _binary_frame: bytes | None = field(default=None, compare=False, repr=False)
 
     def asdict(self):
-        return asdict(self)
+        return {"type_": self.type_, "data": deepcopy(self.data)}
+
+    def encode(self) -> str:
+        """
+        Returns the JSON frame sent over the websocket.
+
+        The frame is computed once and cached, so broadcasting an event to any
+        number of sockets serializes it only once. Uses `orjson` when available.
+        """
+        if self._frame is None:
+            d = {"type_": self.type_.value, "data": self.data}
+            if orjson is not None:
+                frame = orjson.dumps(d).decode()
+            else:
+                frame = json.dumps(d, separators=(",", ":"))
+            object.__setattr__(self, "_frame", frame)
+        return self._frame
+
+    def encode_binary(self) -> bytes:
+        """
+        Returns the compact binary frame sent to clients which negotiated
+        `Subprotocol.BINARY`. Cached like `encode`.
+        """
+        if self._binary_frame is None:
+            object.__setattr__(self, "_binary_frame", _encode_binary(self))
+        return self._binary_frame
 
     @classmethod
     def from_dict(cls, d: dict[str, str | dict[str, Any]]):
+        """
+        Builds an event out of a decoded JSON frame, checking its data against the
+        schema of its type. Raises `InvalidStructureException` otherwise.
+        """
         t = d.get("type_")
         d_ = d.get("data")
-        if t is None or d is None or not isinstance(d_, dict):
+        if t is None or not isinstance(d_, dict):
             raise InvalidStructureException(
                 f"missing fields to construct event class: {d}"
             )
 
-        try:
-            t_ = EventType(t)
-        except ValueError:
+        t_ = _EVENT_TYPES.get(t) if isinstance(t, str) else None
+        if t_ is None:
             raise InvalidStructureException(f"event type {t} is unknown")
 
+        error = _VALIDATORS[t_](d_)
+        if error is not None:
+            raise InvalidStructureException(f"invalid {t_} event: {error}")
+
         return cls(t_, d_)
 
 
+# Validation of decoded events. Each `EventType` has a schema mapping the required
+# fields of its data to either a type (or a tuple of types), an `IntRange` or the
+# schema of a nested dict. Schemas are compiled once into flat lists of checks.
+# `MOVE`, the event clients send all game long, has its checks written out instead.
+
+
+class IntRange:
+    """
+    An int field between `low` and `high`, both included. Bools aren't ints here.
+    """
+
+    __slots__ = ("low", "high")
+
+    def __init__(self, low: int, high: int) -> None:
+        self.low = low
+        self.high = high
+
+
+_SEQ_RANGE = IntRange(0, 2**32 - 1)
+_POSITION_RANGE = IntRange(1, MAX_GRID_SIZE * MAX_GRID_SIZE)
+_MISSING = object()
+
+
+def _check_move(data: dict[str, Any]) -> str | None:
+    """
+    The schema of `MOVE` events, `{"move": {"pos": position, "marker": str or
+    None}}`, checked without walking a compiled schema.
+    """
+    move = data.get("move", _MISSING)
+    if type(move) is not dict:
+        return "missing move" if move is _MISSING else "move must be an object"
+
+    pos = move.get("pos", _MISSING)
+    if type(pos) is not int or not _POSITION_RANGE.low <= pos <= _POSITION_RANGE.high:
+        if pos is _MISSING:
+            return "move.missing pos"
+        low, high = _POSITION_RANGE.low, _POSITION_RANGE.high
+        return f"move.pos must be an int from {low} to {high}"
+
+    marker = move.get("marker", _MISSING)
+    if marker is not None and type(marker) is not str:
+        if marker is _MISSING:
+            return "move.missing marker"
+        return "move.marker has the wrong type"
+    return None
+
+
+Validator = Callable[[dict[str, Any]], str | None]
+
+_SCHEMAS: dict[EventType, dict[str, Any] | Validator] = {
+    EventType.MESSAGE: {"message": str},
+    EventType.BOARD: {"board": list},
+    EventType.MOVE: _check_move,
+    EventType.RESULT: {"result": dict, "message": str},
+    EventType.QUIT: {},
+    EventType.ASK_MOVE: {"player": str},
+    EventType.ROOM_STATUS: {
+        "status": str,
+        "players": list,
+        "current_turn": str,
+        "winner": str,
+    },
+    EventType.REMATCH_VOTE: {"votes": dict, "all_voted": bool},
+    EventType.DELTA: {
+        "pos": _POSITION_RANGE,
+        "cell": IntRange(0, 2),
+        "seq": _SEQ_RANGE,
+    },
+    EventType.RESYNC: {"seq": _SEQ_RANGE},
+    EventType.MATCHED: {"room_id": str, "token": str, "player": str, "opponent": str},
+    EventType.ERROR: {"message": str},
+}
+
+_CHECK_TYPE, _CHECK_RANGE, _CHECK_NESTED = range(3)
+
+
+def _compile_schema(schema: dict[str, Any]) -> Validator:
+    """
+    Returns a function telling what's wrong with event data, or None if it matches
+    `schema`.
+    """
+    checks = []
+    for name, spec in schema.items():
+        if isinstance(spec, dict):
+            checks.append((name, _CHECK_NESTED, _compile_schema(spec), None))
+        elif isinstance(spec, IntRange):
+            checks.append((name, _CHECK_RANGE, spec.low, spec.high))
+        else:
+            checks.append((name, _CHECK_TYPE, spec, None))
+
+    def validate(data: dict[str, Any]) -> str | None:
+        for name, kind, a, b in checks:
+            value = data.get(name, _MISSING)
+            if value is _MISSING:
+                return f"missing {name}"
+            if kind == _CHECK_TYPE:
+                if not isinstance(value, a):
+                    return f"{name} has the wrong type"
+            elif kind == _CHECK_RANGE:
+                if type(value) is not int or not a <= value <= b:
+                    return f"{name} must be an int from {a} to {b}"
+            else:
+                if not isinstance(value, dict):
+                    return f"{name} must be an object"
+                error = a(value)
+                if error is not None:
+                    return f"{name}.{error}"
+        return None
+
+    return validate
+
+
+_VALIDATORS = {
+    t: schema if callable(schema) else _compile_schema(schema)
+    for t, schema in _SCHEMAS.items()
+}
+# `EventType(value)` goes through the enum machinery, a dict lookup doesn't
+_EVENT_TYPES = {t.value: t for t in EventType}
+
+
 def message_event(message: str):
     """
     A helper function to create an `Event` with `EventType.MESSAGE`.
@@ -66,15 +272,64 @@ def message_event(message: str):
     return Event(EventType.MESSAGE, {"message": message})
 
 
-def board_event(board: list[list[Cell]]):
+def board_event(board: list[list[Cell]], seq: int | None = None):
     """
     A helper function to create an `Event` with `EventType.BOARD`.
+
+    `seq` is the number of moves the board reflects, clients apply the `DELTA`s
+    following it.
+    """
+    data = {"board": board_values(board)}
+    if seq is not None:
+        data["seq"] = seq
+    return Event(EventType.BOARD, data)
+
+
+def delta_event(pos: int, cell: Cell, seq: int):
+    """
+    A helper function to create an `Event` with `EventType.DELTA`.
+
+    Tells clients that `cell` was placed at `pos` by move number `seq`.
+    """
+    return Event(EventType.DELTA, {"pos": pos, "cell": cell.value, "seq": seq})
+
+
+def resync_event(seq: int):
+    """
+    A helper function to create an `Event` with `EventType.RESYNC`.
+
+    Sent by clients which noticed a gap after move `seq`, the server replies with
+    a `BOARD` snapshot.
+    """
+    return Event(EventType.RESYNC, {"seq": seq})
+
+
+def matched_event(room_id: str, token: str, player: str, opponent: str):
+    """
+    Create an `Event` with `EventType.MATCHED`, telling a quick-play client the
+    room it was put in, its token to reconnect with and its name in the room.
     """
     return Event(
-        EventType.BOARD, {"board": [list(map(lambda x: x.value, row)) for row in board]}
+        EventType.MATCHED,
+        {"room_id": room_id, "token": token, "player": player, "opponent": opponent},
     )
 
 
+def error_event(message: str):
+    """
+    Create an `Event` with `EventType.ERROR`, telling a client its last event was
+    rejected and why.
+    """
+    return Event(EventType.ERROR, {"message": message})
+
+
+def board_values(board: list[list[Cell]]) -> list[list[int]]:
+    """
+    Converts a board of `Cell`s into the nested lists of ints sent to clients.
+    """
+    return [[cell.value for cell in row] for row in board]
+
+
 def ask_move_event(player_name: str):
     """
     A helper function to create an `Event` with `EventType.ASK_MOVE`.
@@ -101,22 +356,215 @@ def rematch_vote_event(votes: dict[str, bool], all_voted: bool):
     return Event(EventType.REMATCH_VOTE, {"votes": votes, "all_voted": all_voted})
 
 
-def result_event(board: list[list[Cell]], result: dict[str, Any], message: str):
+def result_event(board: list[list[Cell]] | None, result: dict[str, Any], message: str):
     """Create an `Event` with `EventType.RESULT`.
 
     The client expects:
-    - data.board: 2D list of ints (Cell enum values)
+    - data.board: 2D list of ints (Cell enum values), left out for clients
+      which track the board through `DELTA`s
     - data.result: dict compatible with `CheckWinResult.from_dict`
     - data.message: user-facing string
     """
-    return Event(
-        EventType.RESULT,
-        {
-            "board": [list(map(lambda x: x.value, row)) for row in board],
-            "result": result,
-            "message": message,
-        },
-    )
+    data = {"result": result, "message": message}
+    if board is not None:
+        data["board"] = board_values(board)
+    return Event(EventType.RESULT, data)
+
+
+# Binary wire format: one tag byte identifying the `EventType`, followed by a
+# type specific payload. New event types must be appended to `EventType` so the
+# tags of existing ones don't change.
+#
+#   MESSAGE   utf-8 message
+#   ERROR     utf-8 message
+#   BOARD     packed board, optional 32 bit seq
+#   MOVE      position byte, the marker is implied by the connection
+#   ASK_MOVE  utf-8 player name
+#   QUIT      nothing
+#   RESULT    packed board or a single zero byte when left out,
+#             flags byte (1 = victory, 2 = has winner), coordinate count byte,
+#             (row, col) byte pairs, winner length byte, utf-8 winner,
+#             utf-8 message
+#   DELTA     position byte, cell byte, 32 bit seq
+#   RESYNC    32 bit seq
+#   others    utf-8 JSON of the data
+#
+# A packed board is the grid size byte followed by two 32 bit masks of the cells
+# taken by the first and the second player, in row major order.
+
+_EVENT_TAGS = {t: i for i, t in enumerate(EventType, start=1)}
+_TAG_EVENTS = {i: t for t, i in _EVENT_TAGS.items()}
+_BOARD = struct.Struct("!BII")
+_SEQ = struct.Struct("!I")
+_DELTA = struct.Struct("!BBI")
+_RESULT_FLAG_VICTORY = 1
+_RESULT_FLAG_WINNER = 2
+
+
+def _pack_board(board: list[list[int]]) -> bytes:
+    first = second = 0
+    bit = 1
+    for row in board:
+        for value in row:
+            if value == 1:
+                first |= bit
+            elif value == 2:
+                second |= bit
+            bit <<= 1
+    return _BOARD.pack(len(board), first, second)
+
+
+def _unpack_board(frame: bytes, offset: int) -> list[list[int]]:
+    grid_size, first, second = _BOARD.unpack_from(frame, offset)
+    cells = [
+        1 if first >> i & 1 else 2 if second >> i & 1 else 0
+        for i in range(grid_size * grid_size)
+    ]
+    return [cells[i : i + grid_size] for i in range(0, len(cells), grid_size)]
+
+
+def _encode_binary(event: Event) -> bytes:
+    tag = bytes((_EVENT_TAGS[event.type_],))
+    data = event.data
+    match event.type_:
+        case EventType.MESSAGE | EventType.ERROR:
+            return tag + data["message"].encode()
+
+        case EventType.BOARD:
+            frame = tag + _pack_board(data["board"])
+            if "seq" in data:
+                frame += _SEQ.pack(data["seq"])
+            return frame
+
+        case EventType.DELTA:
+            return tag + _DELTA.pack(data["pos"], data["cell"], data["seq"])
+
+        case EventType.RESYNC:
+            return tag + _SEQ.pack(data["seq"])
+
+        case EventType.MOVE:
+            return tag + bytes((data["move"]["pos"],))
+
+        case EventType.ASK_MOVE:
+            return tag + data["player"].encode()
+
+        case EventType.QUIT:
+            return tag
+
+        case EventType.RESULT:
+            result = data["result"]
+            winner = (result.get("winner") or "").encode()
+            coordinates = result.get("coordinates") or []
+            flags = 0
+            if result.get("victory"):
+                flags |= _RESULT_FLAG_VICTORY
+            if result.get("winner") is not None:
+                flags |= _RESULT_FLAG_WINNER
+            board = _pack_board(data["board"]) if "board" in data else b"\x00"
+            return b"".join(
+                (
+                    tag,
+                    board,
+                    bytes((flags, len(coordinates))),
+                    bytes(v for coordinate in coordinates for v in coordinate),
+                    bytes((len(winner),)),
+                    winner,
+                    data["message"].encode(),
+                )
+            )
+
+        case _:
+            return tag + json.dumps(data, separators=(",", ":")).encode()
+
+
+def _decode_binary(frame: bytes) -> Event:
+    if not frame:
+        raise InvalidStructureException("empty binary frame")
+
+    type_ = _TAG_EVENTS.get(frame[0])
+    if type_ is None:
+        raise InvalidStructureException(f"unknown binary event tag {frame[0]}")
+
+    try:
+        match type_:
+            case EventType.MESSAGE | EventType.ERROR:
+                data = {"message": frame[1:].decode()}
+
+            case EventType.BOARD:
+                data = {"board": _unpack_board(frame, 1)}
+                if len(frame) == 1 + _BOARD.size + _SEQ.size:
+                    (data["seq"],) = _SEQ.unpack_from(frame, 1 + _BOARD.size)
+
+            case EventType.DELTA:
+                pos, cell, seq = _DELTA.unpack_from(frame, 1)
+                data = {"pos": pos, "cell": cell, "seq": seq}
+
+            case EventType.RESYNC:
+                (seq,) = _SEQ.unpack_from(frame, 1)
+                data = {"seq": seq}
+
+            case EventType.MOVE:
+                data = {"move": {"pos": frame[1], "marker": None}}
+
+            case EventType.ASK_MOVE:
+                data = {"player": frame[1:].decode()}
+
+            case EventType.QUIT:
+                data = {}
+
+            case EventType.RESULT:
+                data = {}
+                if frame[1]:
+                    data["board"] = _unpack_board(frame, 1)
+                    offset = 1 + _BOARD.size
+                else:
+                    offset = 2
+                flags, count = frame[offset], frame[offset + 1]
+                offset += 2
+                coordinates = [
+                    [frame[offset + 2 * i], frame[offset + 2 * i + 1]]
+                    for i in range(count)
+                ]
+                offset += 2 * count
+                winner_len = frame[offset]
+                winner = frame[offset + 1 : offset + 1 + winner_len].decode()
+                data["result"] = {
+                    "victory": bool(flags & _RESULT_FLAG_VICTORY),
+                    "winner": winner if flags & _RESULT_FLAG_WINNER else None,
+                    "coordinates": coordinates or None,
+                }
+                data["message"] = frame[offset + 1 + winner_len :].decode()
+
+            case _:
+                data = json.loads(frame[1:])
+
+    except (IndexError, struct.error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidStructureException(f"malformed binary {type_} event: {e}")
+
+    error = _VALIDATORS[type_](data)
+    if error is not None:
+        raise InvalidStructureException(f"invalid {type_} event: {error}")
+
+    return Event(type_, data, _binary_frame=bytes(frame))
+
+
+def decode_event(frame: str | bytes) -> Event:
+    """
+    Decodes a websocket frame into an `Event`. Text frames are JSON and binary
+    frames use the compact binary format.
+
+    Binary `MOVE` events don't carry a marker, the receiver fills it in.
+    """
+    if isinstance(frame, (bytes, bytearray)):
+        return _decode_binary(frame)
+
+    try:
+        d = orjson.loads(frame) if orjson is not None else json.loads(frame)
+    except ValueError:
+        raise InvalidStructureException(f"frame is not valid JSON: {frame[:100]}")
+    if not isinstance(d, dict):
+        raise InvalidStructureException(f"frame is not a JSON object: {frame[:100]}")
+    return Event.from_dict(d)
 
 
 if __name__ == "__main__":
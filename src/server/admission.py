@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from typing import Callable
+
+# weight of the newest event loop lag sample in the smoothed lag
+_LAG_SMOOTHING = 0.5
+
+
+class AdmissionController:
+    """
+    Turns away new rooms and connections while the server is overloaded, so the
+    games already in progress keep their latency.
+
+    The server is overloaded once any gauge goes over its limit, and stays so
+    until every gauge is back under `recover_at` times its limit, so it doesn't
+    flap around a limit. The event loop lag gauge is measured here, by how late a
+    sleep of `interval` seconds wakes up; other gauges are read every `interval`.
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, float],
+        gauges: dict[str, Callable[[], float]],
+        recover_at: float,
+        interval: float,
+    ) -> None:
+        # limits of 0 are turned off
+        self.limits = {name: limit for name, limit in limits.items() if limit > 0}
+        self.gauges = gauges
+        self.recover_at = recover_at
+        self.interval = interval
+        self.loop_lag = 0.0
+        self.overloaded = False
+        # gauges over their limit when the server last became overloaded
+        self.reasons: list[str] = []
+        self.rejected = 0
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def admit(self) -> bool:
+        """Whether a new room or connection may be let in, counting it if not."""
+        if self.overloaded:
+            self.rejected += 1
+            return False
+        return True
+
+    def readings(self) -> dict[str, float]:
+        readings = {"loop_lag": self.loop_lag}
+        for name, gauge in self.gauges.items():
+            readings[name] = gauge()
+        return readings
+
+    def update(self) -> None:
+        readings = self.readings()
+        if self.overloaded:
+            if all(
+                readings[name] < limit * self.recover_at
+                for name, limit in self.limits.items()
+            ):
+                self.overloaded = False
+                logging.info("load is back to normal, admitting new games")
+            return
+
+        over = [name for name, limit in self.limits.items() if readings[name] > limit]
+        if over:
+            self.overloaded = True
+            self.reasons = over
+            logging.warning(f"overloaded by {over}, turning new games away")
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self.loop_lag += (lag - self.loop_lag) * _LAG_SMOOTHING
+            try:
+                self.update()
+            except Exception as e:
+                logging.exception(e)
+
+    def stats(self) -> dict:
+        return {
+            "overloaded": self.overloaded,
+            "reasons": self.reasons if self.overloaded else [],
+            "rejected": self.rejected,
+            "readings": self.readings(),
+        }
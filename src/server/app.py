@@ -1,29 +1,118 @@
 import asyncio
 import json
 import logging
+import math
 import random
+import time
 from contextlib import asynccontextmanager, suppress
+from dataclasses import asdict
+from functools import partial
 from itertools import cycle
 from pathlib import Path
+from typing import Awaitable, Callable
 
 import websockets
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from fastapi import (
+    Depends,
+    FastAPI,
+    HTTPException,
+    Query,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
+from fastapi.responses import HTMLResponse, PlainTextResponse
+from sqlalchemy.orm import Session
 
 from common.events import (
+    Event,
     EventType,
     ask_move_event,
     board_event,
+    delta_event,
+    matched_event,
     message_event,
+    negotiate_subprotocol,
     result_event,
 )
-from common.tic_tac_toe import LMPTicTacToe, Move
+from common.tic_tac_toe import Difficulty, Move
+from server.admission import AdmissionController
+from server.broker import create_broker
+from server.checkpoint import (
+    RoomCheckpoint,
+    checkpoint_from_board,
+    load_checkpoint,
+    save_checkpoint,
+)
+from server.config import (
+    ADMISSION_INTERVAL,
+    ADMISSION_MAX_DB_POOL,
+    ADMISSION_MAX_LOOP_LAG,
+    ADMISSION_MAX_ROOMS,
+    ADMISSION_MAX_SOCKETS,
+    ADMISSION_RECOVER,
+    ADMISSION_RETRY_AFTER,
+    BROKER_URL,
+    CHECKPOINT_PATH,
+    CLEANUP_INTERVAL,
+    CLUSTER_WORKERS,
+    COMPUTER_MAX_JOBS,
+    COMPUTER_MOVE_TIMEOUT,
+    COMPUTER_WORKERS,
+    GAME_STATE_FLUSH_INTERVAL,
+    GAME_STATE_MAX_BACKLOG,
+    GAME_TIMEOUT,
+    IDLE_TIMEOUT,
+    LEADERBOARD_CACHE_SIZE,
+    LEADERBOARD_CACHE_TTL,
+    LEADERBOARD_MAX_PAGE,
+    RATE_LIMIT_KEYS,
+    RECONNECT_GRACE,
+    ROOM_CREATE_BURST,
+    ROOM_CREATE_RATE,
+    ROOM_ID_POOL_SIZE,
+    ROOM_JOIN_BURST,
+    ROOM_JOIN_RATE,
+    ROOM_JOIN_ROOM_BURST,
+    ROOM_JOIN_ROOM_RATE,
+    TOKEN_KEYS,
+    TOKEN_TTL,
+    TOURNAMENT_RESULTS_TTL,
+    TURN_TIMEOUT,
+    WORKER_ID,
+)
 from server.conn_manager import ConnectionManager
+from server.engine import COMPUTER_NAME, ComputerPlayer
+from server.game import RoomGame
+from server.matchmaking import Matchmaker, Ticket
 from server.models import crud
-from server.models.database import init_db
-from server.models.requests import JoinRoomRequest
-from server.models.responses import CreateRoomResponse, JoinRoomResponse
-from server.utils import generate_room_id, generate_url_token
+from server.models.crud import GameState
+from server.models.database import close_db, init_db
+from server.models.dbmodels import GameStatus
+from server.models.requests import (
+    MAX_GRID_SIZE,
+    MIN_GRID_SIZE,
+    CreateRoomRequest,
+    CreateTournamentRequest,
+    JoinRoomRequest,
+)
+from server.models.responses import (
+    CreateRoomResponse,
+    CreateTournamentResponse,
+    JoinRoomResponse,
+    LeaderboardResponse,
+    PlayerRatingResponse,
+)
+from server.persistence import GameStateWriter
+from server.ratelimit import RateLimiter
+from server.ratings import Leaderboard, PlayerRating
+from server.room_ids import RoomIdPool
+from server.routing import RoomRouter
+from server.timers import Expiry, Timer, TimerWheel
+from server.tokens import TokenSigner, parse_keys
+from server.tournaments import Pairing, Tournament, TournamentFormat
+from server.utils import Player
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -31,57 +120,307 @@ logging.basicConfig(level=logging.DEBUG)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
+    room_id_pool.start()
+    game_writer.start()
+    timer_wheel.start()
+    admission.start()
+    computer_player.start()
+    await router.start({"game": gameplay, "watch": watch})
+    await _restore_rooms()
 
     stop_event = asyncio.Event()
 
     async def room_cleaner_loop() -> None:
+        global last_cleanup
         while not stop_event.is_set():
             try:
-                with crud.db_session() as db:
-                    await crud.update_active_rooms(conn_manager=conn_manager, db=db)
+                last_cleanup = await crud.update_active_rooms(conn_manager)
+                logging.info(f"room cleanup: {last_cleanup}")
             except Exception as e:
                 logging.exception(e)
 
             try:
-                await asyncio.wait_for(stop_event.wait(), timeout=60)
+                await asyncio.wait_for(stop_event.wait(), timeout=CLEANUP_INTERVAL)
             except asyncio.TimeoutError:
                 continue
 
     cleaner_task = asyncio.create_task(room_cleaner_loop())
+    unclaimed_task = asyncio.create_task(_forget_unclaimed_rooms())
     try:
         yield
     finally:
         stop_event.set()
-        cleaner_task.cancel()
-        with suppress(asyncio.CancelledError):
-            await cleaner_task
+        for task in (cleaner_task, unclaimed_task):
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        _save_rooms()
+        # the game loops may be rating a game or writing its state, which has to
+        # be over before the engine is disposed of
+        game_tasks = list(room_game_tasks.values())
+        for task in game_tasks:
+            task.cancel()
+        await asyncio.gather(*game_tasks, return_exceptions=True)
+        await router.stop()
+        await timer_wheel.stop()
+        await admission.stop()
+        computer_player.close()
+        await game_writer.stop()
+        await asyncio.to_thread(crud.shutdown_db_threads)
+        close_db()
 
 
 app = FastAPI(lifespan=lifespan)
 
 conn_manager = ConnectionManager()
+timer_wheel = TimerWheel()
+router = RoomRouter(WORKER_ID, CLUSTER_WORKERS, create_broker(BROKER_URL))
 room_game_tasks: dict[str, asyncio.Task[None]] = {}
+# callbacks handed the winner of a room's game once it's over, see `room_game_loop`
+room_results: dict[str, Callable[[str | None], Awaitable[None]]] = {}
+tournaments: dict[str, Tournament] = {}
+room_id_pool = RoomIdPool(ROOM_ID_POOL_SIZE)
+# factories of the checkpoints of games in progress, saved on shutdown
+live_games: dict[str, Callable[[], RoomCheckpoint]] = {}
+# games saved before the last shutdown which nobody reconnected to yet
+restored_rooms: dict[str, RoomCheckpoint] = {}
+# writes the state of the games in progress, reloaded after a crash
+game_writer = GameStateWriter(GAME_STATE_FLUSH_INTERVAL, GAME_STATE_MAX_BACKLOG)
+leaderboard = Leaderboard(LEADERBOARD_CACHE_SIZE, LEADERBOARD_CACHE_TTL)
+# what the latest pass of the room cleaner did
+last_cleanup = crud.CleanupPass()
+matchmaker = Matchmaker()
+computer_player = ComputerPlayer(
+    COMPUTER_WORKERS, COMPUTER_MAX_JOBS, COMPUTER_MOVE_TIMEOUT
+)
+create_limiter = RateLimiter(ROOM_CREATE_RATE, ROOM_CREATE_BURST, RATE_LIMIT_KEYS)
+join_limiter = RateLimiter(ROOM_JOIN_RATE, ROOM_JOIN_BURST, RATE_LIMIT_KEYS)
+room_join_limiter = RateLimiter(
+    ROOM_JOIN_ROOM_RATE, ROOM_JOIN_ROOM_BURST, RATE_LIMIT_KEYS
+)
+admission = AdmissionController(
+    {
+        "loop_lag": ADMISSION_MAX_LOOP_LAG,
+        "rooms": ADMISSION_MAX_ROOMS,
+        "sockets": ADMISSION_MAX_SOCKETS,
+        "db_pool": ADMISSION_MAX_DB_POOL,
+    },
+    {
+        "rooms": lambda: len(conn_manager.active_connections),
+        "sockets": conn_manager.open_sockets,
+        "db_pool": crud.db_backlog,
+    },
+    ADMISSION_RECOVER,
+    ADMISSION_INTERVAL,
+)
+token_signer = TokenSigner(parse_keys(TOKEN_KEYS), TOKEN_TTL)
 
 TEMPLATES_DIR = Path(__file__).resolve().parent / "templates"
 LANDING_PAGE = (TEMPLATES_DIR / "landing.html").read_text()
 
 
-async def room_game_loop(room_id: str) -> None:
+async def _restore_rooms() -> None:
+    """Brings back the games in progress saved by `_save_rooms`, and those still
+    in progress in the database after a crash.
+
+    Only the rooms are set up here, each game is rebuilt by its game loop once a
+    player reconnects.
+    """
+    start = time.perf_counter()
+    saved = load_checkpoint(CHECKPOINT_PATH) if CHECKPOINT_PATH else []
+    for room in saved + await crud.run_in_session(_unsaved_games):
+        if (
+            not router.is_local(room.room_id)
+            or room.room_id in conn_manager.active_connections
+        ):
+            continue
+        conn_manager.add_room(room.room_id)
+        restored_rooms[room.room_id] = room
+    elapsed = time.perf_counter() - start
+    logging.info(f"restored {len(restored_rooms)} rooms in {elapsed:.3f}s")
+
+
+def _unsaved_games(db: Session) -> list[RoomCheckpoint]:
+    """
+    The games of this worker the database has in progress, from the last state
+    `game_writer` wrote. Their game clock starts over.
+    """
+    rooms = []
+    for row in crud.get_playing_rooms(db, router.is_local):
+        room = checkpoint_from_board(
+            str(row.room_id),
+            row.grid_size or 3,
+            row.computer or "",
+            row.player1 or "",
+            row.player2 or "",
+            crud.unpack_cells(row.board_state or ""),
+            row.current_turn or "",
+            GAME_TIMEOUT,
+        )
+        if room is None:
+            logging.warning(f"can't restore the game of room {row.room_id}")
+            continue
+        rooms.append(room)
+    return rooms
+
+
+def _save_rooms() -> None:
+    if not CHECKPOINT_PATH:
+        return
+
+    rooms = [*restored_rooms.values(), *(save() for save in live_games.values())]
+    try:
+        saved = save_checkpoint(CHECKPOINT_PATH, rooms)
+    except OSError as e:
+        logging.exception(e)
+        return
+    logging.info(f"saved {saved} rooms to {CHECKPOINT_PATH}")
+
+
+async def _forget_unclaimed_rooms() -> None:
+    """Closes the restored rooms nobody came back to within `IDLE_TIMEOUT`."""
+    if not restored_rooms:
+        return
+
+    await asyncio.sleep(IDLE_TIMEOUT)
+    for room_id in list(restored_rooms):
+        del restored_rooms[room_id]
+        await conn_manager.delete_room(room_id)
+        # not to be restored again after another crash
+        await game_writer.put(room_id, GameState(None, "", GameStatus.FINISHED))
+
+
+async def room_game_loop(room_id: str, grid_size: int | None = None) -> None:
     """Runs a single game loop per room.
 
     This avoids having both websocket endpoint coroutines attempting to
-    `receive_json()` from the same websocket.
+    `receive_json()` from the same websocket. The room is read from the database
+    unless `grid_size` is given, for rooms of two players created just before.
+    The state of the game is written to the database by `game_writer` as it
+    goes. Once the game is over its winner is handed to the room's `room_results`
+    callback, if there is one.
     """
+    timers: list[Timer] = []
+    winner = None
+    try:
+        winner = await _play_room(room_id, timers, grid_size)
+    except Exception as e:
+        logging.exception(e)
+        # closing the sockets ends the players' sessions
+        await conn_manager.delete_room(room_id)
+        await game_writer.finish(room_id, None)
+    else:
+        await game_writer.finish(room_id, winner)
+        on_result = room_results.pop(room_id, None)
+        if on_result is not None:
+            await on_result(winner)
+    finally:
+        live_games.pop(room_id, None)
+        for timer in timers:
+            timer.cancel()
+
+
+async def _forfeit(
+    room_id: str,
+    game: RoomGame,
+    loser: str,
+    reason: str,
+    computer: Difficulty | None,
+) -> str:
+    winner = game.player2 if loser == game.player1 else game.player1
+    result_dict = {"victory": True, "winner": winner, "coordinates": None}
+    message = f"{loser} {reason}. {winner} wins the game."
+    await conn_manager.broadcast_event(
+        room_id,
+        result_event(None, result_dict, message),
+        fallback=lambda: result_event(game.board, result_dict, message),
+    )
+    await conn_manager.delete_room(room_id)
+    await _rate_game(game, winner, computer)
+    return winner
+
+
+async def _rate_game(game: RoomGame, winner: str, computer: Difficulty | None) -> None:
+    """
+    Updates the ratings of the players of a game won by `winner`, or drawn if
+    it's empty, and the leaderboard if they're on it. Games against the computer,
+    played at the `computer` difficulty, aren't rated.
+    """
+    if computer:
+        return
+
+    def rate(db: Session) -> list[PlayerRating] | None:
+        changes = crud.rate_game((game.player1, game.player2), winner, db)
+        if not leaderboard.affected_by(changes):
+            return None
+        return crud.leaderboard_page(db, leaderboard.size)
+
+    try:
+        top = await crud.run_in_session(rate)
+    except Exception as e:
+        logging.exception(e)
+        return
+    if top is not None:
+        leaderboard.load(top)
+
+
+async def _wait_for_reconnect(room_id: str, player_name: str) -> Player | None:
+    """Waits up to `RECONNECT_GRACE` for a disconnected player to come back."""
+    waiter = conn_manager.reconnect_waiter(room_id, player_name)
+
+    def _give_up() -> None:
+        if not waiter.done():
+            waiter.set_result(None)
+
+    grace_timer = timer_wheel.schedule(RECONNECT_GRACE, _give_up)
+    try:
+        return await waiter
+    finally:
+        grace_timer.cancel()
+
+
+async def _play_room(
+    room_id: str, timers: list[Timer], grid_size: int | None
+) -> str | None:
+    """
+    Plays the game of a room. Returns the name of the winner, an empty string for
+    a draw, or `None` if the game ended without a result.
+    """
+    restored = restored_rooms.pop(room_id, None)
+    if restored is not None:
+        computer = Difficulty(restored.computer) if restored.computer else None
+        grid_size = restored.grid_size
+        # saved again if the server stops before the players are back
+        live_games[room_id] = lambda: restored
+    elif grid_size is not None:
+        computer = None
+    else:
+        room = await crud.run_in_session(partial(crud.get_room_by_id, room_id))
+        computer = Difficulty(room.computer) if room and room.computer else None
+        grid_size = room.grid_size if room and room.grid_size else 3
+    # players connected to the room, the computer doesn't have a connection
+    seats = 1 if computer else 2
+
     sent_waiting = False
+    idle_timer = timer_wheel.schedule(IDLE_TIMEOUT, lambda: None)
+    timers.append(idle_timer)
     while True:
         players = conn_manager.active_connections.get(room_id)
         if players is None:
-            return
+            return None
 
-        if len(players) == 2 and all(p.name for p in players):
+        if len(players) == seats and all(p.name for p in players):
             break
 
-        if len(players) == 1 and not sent_waiting:
+        if idle_timer.fired:
+            await conn_manager.broadcast_event(
+                room_id, message_event("nobody else joined the room in time.")
+            )
+            await conn_manager.delete_room(room_id)
+            # whoever showed up wins
+            return players[0].name if len(players) == 1 and seats == 2 else None
+
+        if len(players) == 1 and seats == 2 and not sent_waiting:
             sent_waiting = True
             await conn_manager.send_event(
                 message_event("waiting for the other player to join..."),
@@ -90,57 +429,182 @@ async def room_game_loop(room_id: str) -> None:
 
         await asyncio.sleep(0.1)
 
+    idle_timer.cancel()
     players = conn_manager.active_connections.get(room_id)
-    if not players or len(players) != 2:
-        return
+    if not players or len(players) != seats:
+        return None
+
+    if restored is not None:
+        game = RoomGame(restored.player1, restored.player2, grid_size)
+        names = restored.turn_order
+        for i, pos in enumerate(restored.moves):
+            game.fill_player_cell(names[i % 2], pos)
+        if len(restored.moves) % 2:
+            # the second player is on move
+            names.reverse()
+        game_time = restored.game_time_left
+        await conn_manager.broadcast_event(
+            room_id, message_event("resuming the game...")
+        )
 
-    await conn_manager.broadcast_event(room_id, message_event("starting the game..."))
+    else:
+        await conn_manager.broadcast_event(
+            room_id, message_event("starting the game...")
+        )
+        if computer:
+            # the engine plays `Cell.COMPUTER`, which is the mark of player1
+            names = [COMPUTER_NAME, players[0].name]
+        else:
+            names = [p.name for p in players]
+        game = RoomGame(names[0], names[1], grid_size)
+        random.shuffle(names)
+        game_time = GAME_TIMEOUT
+        await conn_manager.broadcast_event(
+            room_id, message_event(f"{names[0]} will be making the first move")
+        )
 
-    starter_player = random.choice(players)
-    other_player = players[0] if starter_player == players[1] else players[1]
-    player_cycle = cycle([starter_player.name, other_player.name])
-    game = LMPTicTacToe(starter_player.name, other_player.name, 3)
+    starter = names[len(game.moves) % 2]
+    player_cycle = cycle(names)
+    conn_manager.set_snapshot(room_id, lambda: board_event(game.board, len(game.moves)))
     await conn_manager.broadcast_event(
-        room_id, message_event(f"{starter_player.name} will be making the first move")
+        room_id, board_event(game.board, len(game.moves))
     )
-    await conn_manager.broadcast_event(room_id, board_event(game.board))
+
+    game_timer: Timer | None = None
+
+    def _expire_game() -> None:
+        conn_manager.expire_room(room_id, Expiry("ran out of game time", game_timer))
+
+    game_timer = timer_wheel.schedule(game_time, _expire_game)
+    timers.append(game_timer)
+
+    def _checkpoint() -> RoomCheckpoint:
+        return RoomCheckpoint(
+            room_id,
+            grid_size,
+            computer or "",
+            game.player1,
+            game.player2,
+            starter,
+            bytes(game.moves),
+            game_timer.deadline - asyncio.get_running_loop().time(),
+        )
+
+    live_games[room_id] = _checkpoint
 
     while True:
         current_player_name = next(player_cycle)
-        while True:
-            current_player = conn_manager.find_player_by_name(
-                room_id, current_player_name
-            )
-            if not current_player:
-                await conn_manager.delete_room(room_id)
-                return
+        await game_writer.put(
+            room_id,
+            GameState(
+                crud.pack_cells(game.cells), current_player_name, GameStatus.PLAYING
+            ),
+        )
+        turn_timer: Timer | None = None
 
-            await conn_manager.send_event(
-                ask_move_event(current_player_name),
-                current_player.ws,
+        def _expire_turn() -> None:
+            conn_manager.expire_player(
+                room_id,
+                current_player_name,
+                Expiry("took too long to move", turn_timer),
             )
 
-            incoming = await conn_manager.receive_event(room_id, current_player.ws)
-            if incoming is None:
-                await conn_manager.broadcast_event(
-                    room_id, message_event(f"{current_player_name} left the game.")
+        turn_timer = timer_wheel.schedule(TURN_TIMEOUT, _expire_turn)
+        timers.append(turn_timer)
+        while True:
+            # the engine plays the first seat, whatever the other player is named
+            if computer and current_player_name == game.player1:
+                pos = await computer_player.choose_move(game.values(), computer)
+                incoming = Event(
+                    EventType.MOVE, {"move": Move(pos, COMPUTER_NAME).asdict()}
+                )
+                current_player = None
+
+            else:
+                current_player = conn_manager.find_player_by_name(
+                    room_id, current_player_name
                 )
-                await conn_manager.delete_room(room_id)
-                return
+                if not current_player:
+                    await conn_manager.delete_room(room_id)
+                    return None
+
+                # moves sent before being asked are stale, except the ones
+                # answering an error
+                conn_manager.drop_stale_events(room_id, current_player.ws)
+                await conn_manager.send_event(
+                    ask_move_event(current_player_name),
+                    current_player.ws,
+                )
+
+                incoming = await conn_manager.receive_event(room_id, current_player.ws)
+                if incoming is None:
+                    if current_player.connected:
+                        # they reconnected, ask again on the new websocket
+                        continue
+                    await conn_manager.broadcast_event(
+                        room_id,
+                        message_event(
+                            f"{current_player_name} lost connection, waiting for them"
+                            " to reconnect..."
+                        ),
+                    )
+                    if await _wait_for_reconnect(room_id, current_player_name) is None:
+                        return await _forfeit(
+                            room_id,
+                            game,
+                            current_player_name,
+                            "didn't reconnect in time",
+                            computer,
+                        )
+                    continue
+
+                if isinstance(incoming, Expiry):
+                    if (
+                        incoming.timer is not turn_timer
+                        and incoming.timer is not game_timer
+                    ):
+                        # stale expiry of a deadline that was already met
+                        continue
+                    return await _forfeit(
+                        room_id, game, current_player_name, incoming.reason, computer
+                    )
 
             match incoming.type_:
                 case EventType.MOVE:
-                    move = Move.from_dict(incoming.data["move"])
+                    # the shape of the move was checked when it was decoded, what's
+                    # left is whether it can be played on this board
+                    move_data = incoming.data["move"]
+                    move = Move(move_data["pos"], move_data["marker"])
                     if move.marker != current_player_name:
-                        await conn_manager.send_event(
-                            message_event("youre not allowed to move yet"),
+                        await conn_manager.send_error(
+                            room_id, current_player.ws, "youre not allowed to move yet"
+                        )
+                        continue
+
+                    if not game.on_board(move.pos):
+                        await conn_manager.send_error(
+                            room_id,
                             current_player.ws,
+                            f"position {move.pos} is not on the board",
+                        )
+                        continue
+                    if game.is_taken(move.pos):
+                        await conn_manager.send_error(
+                            room_id,
+                            current_player.ws,
+                            f"position {move.pos} is already taken",
                         )
                         continue
 
-                    # todo validate this result
-                    game.fill_player_cell(move.marker, move.pos)
-                    await conn_manager.broadcast_event(room_id, board_event(game.board))
+                    mark = game.fill_player_cell(move.marker, move.pos)
+                    turn_timer.cancel()
+                    timers.remove(turn_timer)
+                    seq = len(game.moves)
+                    await conn_manager.broadcast_event(
+                        room_id,
+                        delta_event(move.pos, mark, seq),
+                        fallback=lambda: board_event(game.board, seq),
+                    )
 
                     over, result = game.game_outcome()
                     if over:
@@ -159,27 +623,40 @@ async def room_game_loop(room_id: str) -> None:
                             }
                             message = f"{result.winner} wins the game."
 
+                        # delta clients already have the final board
                         await conn_manager.broadcast_event(
                             room_id,
-                            result_event(game.board, result_dict, message),
+                            result_event(None, result_dict, message),
+                            fallback=lambda: result_event(
+                                game.board, result_dict, message
+                            ),
                         )
                         await conn_manager.delete_room(room_id)
-                        return
+                        winner = result.winner if result else ""
+                        await _rate_game(game, winner, computer)
+                        return winner
 
                     break
 
                 case EventType.QUIT:
                     await conn_manager.disconnect(room_id, current_player.ws)
-                    await conn_manager.broadcast_event(
-                        room_id, message_event(f"{current_player_name} left the game.")
+                    # rated like any other forfeit, quitting doesn't dodge a loss
+                    return await _forfeit(
+                        room_id, game, current_player_name, "left the game", computer
                     )
-                    await conn_manager.delete_room(room_id)
-                    return
+
+                case EventType.ERROR:
+                    # rejected when it was received
+                    await conn_manager.send_error(
+                        room_id, current_player.ws, incoming.data["message"]
+                    )
+                    continue
 
                 case _:
-                    await conn_manager.send_event(
-                        message_event(f"unknown {incoming=} recieved"),
+                    await conn_manager.send_error(
+                        room_id,
                         current_player.ws,
+                        f"{incoming.type_} events can't be sent during a game",
                     )
                     continue
 
@@ -189,12 +666,104 @@ def root():
     return HTMLResponse(LANDING_PAGE)
 
 
-@app.post("/rooms/create")
-def create_room() -> CreateRoomResponse:
+@app.get("/stats")
+def stats():
+    return {
+        **conn_manager.stats(),
+        "matchmaking": matchmaker.stats(),
+        "computer": computer_player.stats(),
+        "rate_limited": {
+            "create": create_limiter.limited,
+            "join": join_limiter.limited,
+            "room_join": room_join_limiter.limited,
+        },
+        "admission": admission.stats(),
+        "tournaments": len(tournaments),
+        "proxy_dropped_frames": router.dropped_frames,
+        "room_cache": crud.room_cache.stats(),
+        "room_ids": room_id_pool.stats(),
+        "cleanup": asdict(last_cleanup),
+        "game_state": game_writer.stats(),
+        "leaderboard": leaderboard.stats(),
+    }
+
+
+SERVER_BUSY = "The server is busy, try again later."
+
+
+def _throttle(limiter: RateLimiter, key: str) -> None:
+    retry_after = limiter.hit(key)
+    if retry_after:
+        raise HTTPException(
+            status.HTTP_429_TOO_MANY_REQUESTS,
+            "Too many requests, try again later.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+
+def _client_address(request: Request) -> str:
+    # behind the reverse proxy, uvicorn takes it from `X-Forwarded-For` for the
+    # addresses in `FORWARDED_ALLOW_IPS`
+    return request.client.host if request.client else ""
+
+
+# the limits are async so they run on the event loop, rejected requests never wait
+# for a threadpool worker or touch the database
+
+
+async def shed_load() -> None:
+    if not admission.admit():
+        raise HTTPException(
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            SERVER_BUSY,
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+        )
+
+
+async def _turn_away(websocket: WebSocket) -> None:
+    """Rejects a websocket handshake while the server is overloaded."""
+    if "websocket.http.response" in websocket.scope.get("extensions", {}):
+        await websocket.send_denial_response(
+            PlainTextResponse(
+                SERVER_BUSY,
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+            )
+        )
+    else:
+        await websocket.close(code=1013)  # try again later
+
+
+async def limit_room_creates(request: Request) -> None:
+    _throttle(create_limiter, _client_address(request))
+
+
+async def limit_room_joins(request: Request, room_request: JoinRoomRequest) -> None:
+    _throttle(join_limiter, _client_address(request))
+    _throttle(room_join_limiter, room_request.room_id)
+
+
+@app.post(
+    "/rooms/create", dependencies=[Depends(shed_load), Depends(limit_room_creates)]
+)
+async def create_room(
+    room_request: CreateRoomRequest | None = None,
+) -> CreateRoomResponse:
+    room_request = room_request or CreateRoomRequest()
+    computer = room_request.computer
+    grid_size = room_request.grid_size
+
+    def create(db: Session) -> str:
+        room = room_id_pool.insert(
+            lambda ids: crud.create_room(
+                ids[0], db, computer=computer or "", grid_size=grid_size
+            )
+        )
+        return room.room_id
+
     try:
-        with crud.db_session() as db:
-            room_id = generate_room_id()
-            crud.create_room(room_id, db)
+        room_id = await crud.run_in_session(create)
+        if router.is_local(room_id):
             conn_manager.add_room(room_id)
 
         return CreateRoomResponse(
@@ -210,45 +779,129 @@ def create_room() -> CreateRoomResponse:
         )
 
 
-@app.post("/rooms/join")
-def join_room(room_request: JoinRoomRequest) -> JoinRoomResponse:
+@app.post("/rooms/join", dependencies=[Depends(shed_load), Depends(limit_room_joins)])
+async def join_room(room_request: JoinRoomRequest) -> JoinRoomResponse:
+    failure_response = JoinRoomResponse(
+        success=False, message="", websocket_redirect="", token=""
+    )
+    player_name = room_request.player_name[:50]
+
+    def join(db: Session) -> str:
+        """Seats the player, returns why they can't be if they can't."""
+        room = crud.get_room_by_id(room_request.room_id, db)
+
+        if not room:
+            return f"Room with room id `{room_request.room_id}` doesn't exist."
+
+        if not room.is_active:
+            return (
+                "This room is no longer active. Create a new room to continue playing."
+            )
+
+        ok, message = crud.add_player_to_room(room_request.room_id, player_name, db)
+        return "" if ok else message
+
     try:
-        failure_response = JoinRoomResponse(
-            success=False, message="", websocket_redirect="", token=""
+        message = await crud.run_in_session(join)
+    except Exception as e:
+        logging.exception(e)
+        failure_response.message = (
+            "An internal error occured in the server. Try again later."
         )
-        with crud.db_session() as db:
-            room = crud.get_room_by_id(room_request.room_id, db)
+        return failure_response
 
-            if not room:
-                failure_response.message = (
-                    f"Room with room id `{room_request.room_id}` doesn't exist."
-                )
-                return failure_response
-
-            if not room.is_active:
-                failure_response.message = "This room is no longer active. Create a new room to continue playing."
-                return failure_response
-
-            security_token = generate_url_token()
-            ok, message = crud.add_player_to_room(
-                room_request.room_id,
-                room_request.player_name[:50],
-                security_token,
-                db,
+    if message:
+        failure_response.message = message
+        return failure_response
+
+    security_token = token_signer.sign(room_request.room_id, player_name)
+    return JoinRoomResponse(
+        success=True,
+        message=f"Successfully added player `{room_request.player_name}` to room with id `{room_request.room_id}`.",
+        websocket_redirect=f"/game/{room_request.room_id}",
+        token=security_token,
+    )
+
+
+async def _start_round(tournament: Tournament) -> None:
+    """
+    Pairs the next round of `tournament` and creates the rooms of all its games in
+    a single database transaction, then starts their game loops.
+    """
+    games = tournament.next_round()
+    players = [(pairing.player1, pairing.player2) for pairing in games]
+
+    def create(db: Session) -> list[str]:
+        def write(ids: list[str]) -> list[str]:
+            crud.create_matched_rooms(
+                list(zip(ids, players)), db, grid_size=tournament.grid_size
             )
+            return ids
 
-            if ok:
-                return JoinRoomResponse(
-                    success=True,
-                    message=f"Successfully added player `{room_request.player_name}` to room with id `{room_request.room_id}`.",
-                    websocket_redirect=f"/game/{room_request.room_id}",
-                    token=security_token,
-                )
+        # results are collected by this worker, so it runs the games too
+        return room_id_pool.insert(write, len(games), accept=router.is_local)
 
-            else:
-                failure_response.message = message
-                return failure_response
+    room_ids = await crud.run_in_session(create)
+
+    for room_id, pairing in zip(room_ids, games):
+        pairing.room_id = room_id
+        conn_manager.add_room(room_id)
+        room_results[room_id] = partial(_tournament_result, tournament, pairing)
+        _start_game_loop(room_id, tournament.grid_size)
+
+
+async def _tournament_result(
+    tournament: Tournament, pairing: Pairing, winner: str | None
+) -> None:
+    if not tournament.record(pairing, winner):
+        return
+
+    tournament_id = tournament.tournament_id
+    if tournament.finished:
+        logging.info(f"{tournament.champion} won tournament {tournament_id}")
+        timer_wheel.schedule(
+            TOURNAMENT_RESULTS_TTL, lambda: tournaments.pop(tournament_id, None)
+        )
+        return
 
+    try:
+        await _start_round(tournament)
+    except Exception as e:
+        logging.exception(e)
+
+
+@app.post(
+    "/tournaments", dependencies=[Depends(shed_load), Depends(limit_room_creates)]
+)
+async def create_tournament(
+    tournament_request: CreateTournamentRequest,
+) -> CreateTournamentResponse:
+    failure_response = CreateTournamentResponse(
+        success=False, message="", tournament_id="", tokens={}
+    )
+    players = [name.strip()[:50] for name in tournament_request.players]
+    if not all(players) or any("," in name for name in players):
+        failure_response.message = "Player names can't be empty or contain commas."
+        return failure_response
+    if COMPUTER_NAME in players:
+        failure_response.message = f"`{COMPUTER_NAME}` is taken by the computer."
+        return failure_response
+    if len(set(players)) != len(players):
+        failure_response.message = "Every player needs a different name."
+        return failure_response
+
+    # one character longer than room ids, so tokens of one are never valid for another
+    tournament_id = f"t{room_id_pool.take()[0]}"
+    while tournament_id in tournaments:
+        tournament_id = f"t{room_id_pool.take()[0]}"
+    tournament = Tournament(
+        tournament_id,
+        tournament_request.format,
+        players,
+        tournament_request.grid_size,
+    )
+    try:
+        await _start_round(tournament)
     except Exception as e:
         logging.exception(e)
         failure_response.message = (
@@ -256,65 +909,184 @@ def join_room(room_request: JoinRoomRequest) -> JoinRoomResponse:
         )
         return failure_response
 
+    tournaments[tournament_id] = tournament
+    return CreateTournamentResponse(
+        success=True,
+        message=f"Round 1 of {tournament.total_rounds} has started.",
+        tournament_id=tournament_id,
+        tokens={name: token_signer.sign(tournament_id, name) for name in players},
+    )
+
+
+def _player_response(player: PlayerRating) -> PlayerRatingResponse:
+    return PlayerRatingResponse(
+        rank=player.rank,
+        name=player.name,
+        rating=player.rating,
+        games=player.games,
+        wins=player.wins,
+        draws=player.draws,
+        losses=player.losses,
+    )
+
+
+@app.get("/leaderboard")
+async def get_leaderboard(
+    limit: int = Query(20, ge=1, le=LEADERBOARD_MAX_PAGE), after: str = ""
+) -> LeaderboardResponse:
+    """
+    Players by rating, best first, `limit` at a time. `after` is the `next` of
+    the previous page; the first pages are served from memory.
+    """
+    cursor = None
+    if after:
+        rating, _, name = after.partition(",")
+        try:
+            cursor = (int(rating), name)
+        except ValueError:
+            raise HTTPException(
+                status.HTTP_400_BAD_REQUEST, "Invalid page cursor."
+            ) from None
+
+    if leaderboard.stale:
+        top = await crud.run_in_session(
+            partial(crud.leaderboard_page, limit=leaderboard.size)
+        )
+        leaderboard.load(top)
+    page = leaderboard.page(limit, cursor)
+    if page is None:
+        page = await crud.run_in_session(
+            partial(crud.leaderboard_page, limit=limit, after=cursor)
+        )
+
+    next_page = f"{page[-1].rating},{page[-1].name}" if len(page) == limit else ""
+    return LeaderboardResponse(
+        players=[_player_response(player) for player in page], next=next_page
+    )
+
+
+@app.get("/players/{player_name}")
+async def get_player(player_name: str) -> PlayerRatingResponse:
+    player = await crud.run_in_session(partial(crud.get_player_rating, player_name))
+    if player is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "No such player.")
+    return _player_response(player)
+
+
+@app.get("/tournaments/{tournament_id}")
+def tournament_standings(tournament_id: str) -> dict:
+    tournament = tournaments.get(tournament_id)
+    if tournament is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "No such tournament.")
+    return tournament.summary()
+
+
+@app.get("/tournaments/{tournament_id}/room")
+def tournament_room(tournament_id: str, token: str) -> JoinRoomResponse:
+    """
+    The room of the player's game in the current round, to connect to like a
+    joined room.
+    """
+    response = JoinRoomResponse(
+        success=False, message="", websocket_redirect="", token=""
+    )
+    tournament = tournaments.get(tournament_id)
+    player_name = token_signer.verify(token, tournament_id)
+    if tournament is None or player_name is None:
+        response.message = "cannot verify the player"
+        return response
+
+    if tournament.finished:
+        response.message = f"The tournament is over, {tournament.champion} won it."
+        return response
+
+    pairing = tournament.pairing_of(player_name)
+    if pairing is not None and not pairing.room_id:
+        response.message = "The rooms of this round are being created, try again."
+        return response
+    if pairing is None:
+        if (
+            tournament.format == TournamentFormat.SINGLE_ELIMINATION
+            and player_name not in tournament.alive
+        ):
+            response.message = "You are out of the tournament."
+        else:
+            response.message = "Waiting for the other games of this round to finish."
+        return response
+
+    opponent = pairing.player2 if player_name == pairing.player1 else pairing.player1
+    return JoinRoomResponse(
+        success=True,
+        message=f"Round {tournament.rounds_played}, playing against `{opponent}`.",
+        websocket_redirect=f"/game/{pairing.room_id}",
+        token=token_signer.sign(pairing.room_id, player_name),
+    )
+
+
+def _start_game_loop(room_id: str, grid_size: int | None = None) -> None:
+    task = asyncio.create_task(room_game_loop(room_id, grid_size))
+
+    def _cleanup(_: asyncio.Task) -> None:
+        room_game_tasks.pop(room_id, None)
+
+    task.add_done_callback(_cleanup)
+    room_game_tasks[room_id] = task
+
+
+async def _run_session(websocket: WebSocket, room_id: str) -> None:
+    """
+    Feeds a seated player's events to the room's game loop, starting the loop if
+    needed. Returns when the player's connection drops, which the game loop does
+    by closing it once the game ends; the game may also wait for the player to
+    reconnect.
+    """
+    if room_id not in room_game_tasks:
+        _start_game_loop(room_id)
+
+    # read on this task rather than a separate one, a task per socket adds up
+    await conn_manager.read_events(room_id, websocket)
+
 
 @app.websocket("/game/{room_id}")
 async def gameplay(websocket: WebSocket, room_id: str, token: str):
-    player_name: str = "unknown"
-    try:
-        connected = await conn_manager.connect(room_id, websocket)
-        if not connected:
-            # room must be full
-            return
+    if not router.is_local(room_id):
+        # another worker runs this room's game loop
+        await router.proxy(websocket, room_id, token)
+        return
 
-        with crud.db_session() as db:
-            room = crud.get_room_by_id(room_id, db)
-        if not room:
-            logging.debug("room not found in gameplay endpoint")
-            await conn_manager.disconnect(room_id, websocket)
-            return
+    # players of games in progress get back in, only new games are turned away
+    in_progress = room_id in room_game_tasks or room_id in restored_rooms
+    if not in_progress and not admission.admit():
+        await _turn_away(websocket)
+        return
 
-        with crud.db_session() as db:
-            verified, player_name = crud.verify_player(room_id, token, db)
-        if not verified:
+    try:
+        # verified before accepting, a known player may be resuming their session
+        player_name = token_signer.verify(token, room_id)
+        if player_name is None:
+            await websocket.accept()
             json_str = json.dumps({"message": "cannot verify the player"})
             await conn_manager.send_personal_message(json_str, websocket)
-            await conn_manager.disconnect(room_id, websocket)
+            await websocket.close()
             return
 
-        conn_manager.add_player_name(room_id, player_name, websocket)
+        connected = await conn_manager.connect(room_id, websocket, player_name)
+        if not connected:
+            # room must be full
+            return
 
         await conn_manager.send_event(
             message_event("connection established"), websocket
         )
 
-        reader_task = asyncio.create_task(conn_manager.read_events(room_id, websocket))
-        try:
-            if room_id not in room_game_tasks:
-                task = asyncio.create_task(room_game_loop(room_id))
-
-                def _cleanup(_: asyncio.Task) -> None:
-                    room_game_tasks.pop(room_id, None)
-
-                task.add_done_callback(_cleanup)
-                room_game_tasks[room_id] = task
-
-            await room_game_tasks[room_id]
-        finally:
-            reader_task.cancel()
-            with suppress(asyncio.CancelledError):
-                await reader_task
+        await _run_session(websocket, room_id)
 
     except (
         WebSocketDisconnect,
         websockets.exceptions.ConnectionClosed,
         asyncio.CancelledError,
     ):
-        # todo handle disconnects
-        if isinstance(websocket, WebSocket):
-            await conn_manager.disconnect(room_id, websocket)
-            await conn_manager.broadcast_event(
-                room_id, message_event(f"Client #{player_name} left the game.")
-            )
+        conn_manager.connection_lost(room_id, websocket)
 
     except Exception as e:
         logging.exception(e)
@@ -324,3 +1096,139 @@ async def gameplay(websocket: WebSocket, room_id: str, token: str):
         )
         await conn_manager.send_event(error_event, websocket)
         await conn_manager.disconnect(room_id, websocket)
+
+
+@app.websocket("/watch/{room_id}")
+async def watch(websocket: WebSocket, room_id: str, token: str = ""):
+    if not router.is_local(room_id):
+        await router.proxy(websocket, room_id, token, route="watch")
+        return
+
+    if room_id not in conn_manager.active_connections:
+        await websocket.close(code=1008)
+        return
+
+    if not admission.admit():
+        await _turn_away(websocket)
+        return
+
+    await conn_manager.watch(room_id, websocket)
+
+
+async def _create_match(grid_size: int, ticket: Ticket, opponent: Ticket) -> Event:
+    """
+    Puts two matched players in a new room, with a single database write, and
+    seats both of them. Returns the `MATCHED` event of `ticket`.
+    """
+    names = (opponent.name, ticket.name)
+    if names[0] == names[1]:
+        names = (names[0], f"{names[1][:49]}2")
+
+    def create(db: Session) -> str:
+        room = room_id_pool.insert(
+            lambda ids: crud.create_matched_room(ids[0], names, db, grid_size),
+            # keep the game on the worker already holding both sockets
+            accept=router.is_local,
+        )
+        return room.room_id
+
+    room_id = await crud.run_in_session(create)
+
+    tokens = [token_signer.sign(room_id, name) for name in names]
+    conn_manager.add_room(room_id)
+    await conn_manager.attach(
+        room_id, opponent.websocket, names[0], opponent.subprotocol
+    )
+    await conn_manager.attach(room_id, ticket.websocket, names[1], ticket.subprotocol)
+    if opponent.matched.done():
+        # left right after being paired, the game waits for them to reconnect
+        conn_manager.connection_lost(room_id, opponent.websocket)
+    else:
+        opponent.matched.set_result(matched_event(room_id, tokens[0], *names))
+    return matched_event(room_id, tokens[1], names[1], names[0])
+
+
+async def _wait_for_match(grid_size: int, ticket: Ticket) -> Event | None:
+    """
+    Waits in the matchmaking queue until paired, the player leaves or nobody
+    shows up within `IDLE_TIMEOUT`.
+    """
+    websocket = ticket.websocket
+    expiry = timer_wheel.schedule(IDLE_TIMEOUT, ticket.matched.cancel)
+    try:
+        while not ticket.matched.done():
+            receive_task = asyncio.ensure_future(websocket.receive())
+            await asyncio.wait(
+                (ticket.matched, receive_task), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not receive_task.done():
+                receive_task.cancel()
+            elif receive_task.result()["type"] == "websocket.disconnect":
+                # already matched players find out once their session starts
+                ticket.matched.cancel()
+    finally:
+        expiry.cancel()
+        matchmaker.cancel(grid_size, ticket)
+
+    if ticket.matched.cancelled():
+        return None
+    return ticket.matched.result()
+
+
+@app.websocket("/quickplay")
+async def quickplay(websocket: WebSocket, name: str, grid_size: int = 3):
+    name = name.strip()[:50]
+    if (
+        not name
+        or "," in name
+        or name == COMPUTER_NAME
+        or not MIN_GRID_SIZE <= grid_size <= MAX_GRID_SIZE
+    ):
+        await websocket.close(code=1008)
+        return
+
+    if not admission.admit():
+        await _turn_away(websocket)
+        return
+
+    subprotocol = negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=subprotocol)
+    binary = subprotocol is not None and subprotocol.binary
+
+    async def send(event: Event):
+        # not seated in a room yet, so the connection manager can't pick the format
+        await conn_manager.send_frame(
+            event.encode_binary() if binary else event.encode(), websocket
+        )
+
+    ticket = Ticket(name, websocket, subprotocol)
+    room_id = ""
+    try:
+        opponent = matchmaker.pair(grid_size, ticket)
+        while opponent is not None and opponent.matched.done():
+            # left the queue while it was being paired
+            opponent = matchmaker.pair(grid_size, ticket)
+
+        if opponent is not None:
+            matched = await _create_match(grid_size, ticket, opponent)
+        else:
+            await send(message_event("looking for an opponent..."))
+            matched = await _wait_for_match(grid_size, ticket)
+            if matched is None:
+                await send(message_event("nobody to play with right now, try later."))
+                with suppress(RuntimeError):
+                    await websocket.close()
+                return
+
+        room_id = matched.data["room_id"]
+        await conn_manager.send_event(matched, websocket)
+        await _run_session(websocket, room_id)
+
+    except (
+        WebSocketDisconnect,
+        websockets.exceptions.ConnectionClosed,
+        asyncio.CancelledError,
+    ):
+        matchmaker.cancel(grid_size, ticket)
+        if room_id:
+            conn_manager.connection_lost(room_id, websocket)
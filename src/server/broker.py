@@ -0,0 +1,262 @@
+import asyncio
+import fcntl
+import logging
+import struct
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable
+from urllib.parse import urlparse
+
+Handler = Callable[[bytes], Awaitable[None]]
+
+
+class Broker(ABC):
+    """
+    A minimal pub/sub interface used to forward room traffic between workers.
+
+    Messages published on a channel are delivered, in order, to the handler
+    subscribed to that channel in whichever worker subscribed to it.
+    """
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def publish(self, channel: str, message: bytes) -> None: ...
+
+    @abstractmethod
+    async def subscribe(self, channel: str, handler: Handler) -> None: ...
+
+    @abstractmethod
+    async def unsubscribe(self, channel: str) -> None: ...
+
+
+class InProcessBroker(Broker):
+    """
+    Delivers messages within a single process. This is the default and is only
+    useful when running a single worker.
+    """
+
+    def __init__(self) -> None:
+        self._handlers: dict[str, Handler] = {}
+
+    async def publish(self, channel: str, message: bytes) -> None:
+        handler = self._handlers.get(channel)
+        if handler is not None:
+            await handler(message)
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        self._handlers[channel] = handler
+
+    async def unsubscribe(self, channel: str) -> None:
+        self._handlers.pop(channel, None)
+
+
+_SUBSCRIBE = 1
+_UNSUBSCRIBE = 2
+_PUBLISH = 3
+_HEADER = struct.Struct("!BHI")
+
+
+def _pack_frame(op: int, channel: str, payload: bytes = b"") -> bytes:
+    channel_bytes = channel.encode()
+    return _HEADER.pack(op, len(channel_bytes), len(payload)) + channel_bytes + payload
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> tuple[int, str, bytes]:
+    op, channel_len, payload_len = _HEADER.unpack(
+        await reader.readexactly(_HEADER.size)
+    )
+    channel = (await reader.readexactly(channel_len)).decode()
+    payload = await reader.readexactly(payload_len)
+    return op, channel, payload
+
+
+class LocalSocketBroker(Broker):
+    """
+    A stand-in for a real broker when all workers live on the same machine.
+
+    The first worker to lock `path` becomes the hub, which binds the unix socket
+    and fans out published messages; every worker (the hub included) connects to
+    it as a client. If the hub worker goes away, the other workers lose the broker.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._handlers: dict[str, Handler] = {}
+        self._server: asyncio.AbstractServer | None = None
+        self._subscribers: dict[str, set[asyncio.StreamWriter]] = {}
+        self._writer: asyncio.StreamWriter | None = None
+        self._reader_task: asyncio.Task[None] | None = None
+        self._lock = None
+
+    async def start(self) -> None:
+        await self._bind_hub()
+        for attempt in range(50):
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # the hub worker hasn't bound the socket yet
+                if attempt == 49:
+                    raise
+                await asyncio.sleep(0.1)
+        self._reader_task = asyncio.create_task(self._read_loop(reader))
+
+    async def _bind_hub(self) -> None:
+        # whoever holds the lock file is the hub, the lock goes away with the process
+        lock = open(f"{self.path}.lock", "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return
+
+        self._lock = lock
+        # replaces any stale socket file left behind by a crashed hub
+        self._server = await asyncio.start_unix_server(
+            self._serve_client, path=self.path
+        )
+
+    async def close(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._lock is not None:
+            self._lock.close()
+
+    async def _serve_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        channels: set[str] = set()
+        try:
+            while True:
+                op, channel, payload = await _read_frame(reader)
+                if op == _SUBSCRIBE:
+                    channels.add(channel)
+                    self._subscribers.setdefault(channel, set()).add(writer)
+                elif op == _UNSUBSCRIBE:
+                    channels.discard(channel)
+                    self._subscribers.get(channel, set()).discard(writer)
+                elif op == _PUBLISH:
+                    frame = _pack_frame(_PUBLISH, channel, payload)
+                    for subscriber in self._subscribers.get(channel, ()):
+                        subscriber.write(frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for channel in channels:
+                self._subscribers.get(channel, set()).discard(writer)
+            writer.close()
+
+    async def _read_loop(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                _, channel, payload = await _read_frame(reader)
+                handler = self._handlers.get(channel)
+                if handler is None:
+                    continue
+                try:
+                    await handler(payload)
+                except Exception as e:
+                    logging.exception(e)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logging.error("lost connection to the local broker hub")
+
+    async def _send(self, frame: bytes) -> None:
+        if self._writer is None:
+            raise RuntimeError("broker is not started")
+        self._writer.write(frame)
+        await self._writer.drain()
+
+    async def publish(self, channel: str, message: bytes) -> None:
+        await self._send(_pack_frame(_PUBLISH, channel, message))
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        self._handlers[channel] = handler
+        await self._send(_pack_frame(_SUBSCRIBE, channel))
+
+    async def unsubscribe(self, channel: str) -> None:
+        self._handlers.pop(channel, None)
+        await self._send(_pack_frame(_UNSUBSCRIBE, channel))
+
+
+class RedisBroker(Broker):
+    """
+    Uses redis (or any server speaking its pub/sub protocol) to reach workers on
+    other machines. Requires the optional `redis` dependency.
+    """
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self._handlers: dict[str, Handler] = {}
+        self._client = None
+        self._pubsub = None
+        self._reader_task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        try:
+            from redis import asyncio as aioredis
+        except ImportError:
+            raise RuntimeError(
+                "the redis broker needs the `redis` package, install ttt-server[redis]"
+            )
+
+        self._client = aioredis.from_url(self.url)
+        self._pubsub = self._client.pubsub()
+
+    async def close(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def _read_loop(self) -> None:
+        async for message in self._pubsub.listen():
+            if message["type"] != "message":
+                continue
+            handler = self._handlers.get(message["channel"].decode())
+            if handler is None:
+                continue
+            try:
+                await handler(message["data"])
+            except Exception as e:
+                logging.exception(e)
+
+    async def publish(self, channel: str, message: bytes) -> None:
+        await self._client.publish(channel, message)
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        self._handlers[channel] = handler
+        await self._pubsub.subscribe(channel)
+        if self._reader_task is None:
+            self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def unsubscribe(self, channel: str) -> None:
+        self._handlers.pop(channel, None)
+        await self._pubsub.unsubscribe(channel)
+
+
+def create_broker(url: str) -> Broker:
+    """
+    Creates a broker from a url: `memory://`, `unix:///path/to/socket` or
+    `redis://host:port/db`.
+    """
+    parsed = urlparse(url)
+    match parsed.scheme:
+        case "memory":
+            return InProcessBroker()
+        case "unix":
+            return LocalSocketBroker(parsed.path)
+        case "redis" | "rediss":
+            return RedisBroker(url)
+        case _:
+            raise ValueError(f"unknown broker url {url}")
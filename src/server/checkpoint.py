@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Iterable
+
+# bumped whenever the layout of a saved room changes
+CHECKPOINT_VERSION = 1
+
+
+@dataclass(slots=True)
+class RoomCheckpoint:
+    """
+    Everything needed to pick a game back up after a restart. The board and whose
+    turn it is follow from replaying the moves. Tokens aren't saved, they're signed
+    and verified again when the players reconnect.
+    """
+
+    room_id: str
+    grid_size: int
+    # difficulty of the computer, empty for two human players
+    computer: str
+    # names in the first and second seat, the first one plays `Cell.COMPUTER`
+    player1: str
+    player2: str
+    # name of the player who made the first move
+    starter: str
+    # positions played so far, in order, the players taking turns
+    moves: bytes
+    # seconds left on the game clock
+    game_time_left: float
+
+    @property
+    def turn_order(self) -> list[str]:
+        other = self.player2 if self.starter == self.player1 else self.player1
+        return [self.starter, other]
+
+
+def checkpoint_from_board(
+    room_id: str,
+    grid_size: int,
+    computer: str,
+    player1: str,
+    player2: str,
+    cells: bytes,
+    current_turn: str,
+    game_time_left: float,
+) -> RoomCheckpoint | None:
+    """
+    Rebuilds the checkpoint of a game from its board, as `Cell` values, and the
+    player on move. The order of the moves is lost, they're replayed in one
+    that leads to the same board with the same player on move. Returns `None`
+    for a board no game could have reached.
+    """
+    if len(cells) != grid_size * grid_size or current_turn not in (player1, player2):
+        return None
+
+    marked = {
+        player1: [pos for pos, cell in enumerate(cells, 1) if cell == 1],
+        player2: [pos for pos, cell in enumerate(cells, 1) if cell == 2],
+    }
+    other = player2 if current_turn == player1 else player1
+    # whoever is on move has made as many moves as the other player, or one less
+    if len(marked[current_turn]) == len(marked[other]):
+        starter = current_turn
+    elif len(marked[current_turn]) == len(marked[other]) - 1:
+        starter = other
+    else:
+        return None
+
+    second = other if starter == current_turn else current_turn
+    moves = bytearray()
+    for i, pos in enumerate(marked[starter]):
+        moves.append(pos)
+        if i < len(marked[second]):
+            moves.append(marked[second][i])
+    return RoomCheckpoint(
+        room_id,
+        grid_size,
+        computer,
+        player1,
+        player2,
+        starter,
+        bytes(moves),
+        game_time_left,
+    )
+
+
+def save_checkpoint(path: str, rooms: Iterable[RoomCheckpoint]) -> int:
+    """
+    Writes `rooms` to `path`, replacing any previous checkpoint at once so a
+    crash never leaves half a file behind. Returns the number of rooms saved.
+    """
+    rows = [
+        [
+            room.room_id,
+            room.grid_size,
+            room.computer,
+            room.player1,
+            room.player2,
+            room.starter,
+            room.moves.hex(),
+            round(room.game_time_left, 1),
+        ]
+        for room in rooms
+    ]
+    data = {"version": CHECKPOINT_VERSION, "saved_at": time.time(), "rooms": rows}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    return len(rows)
+
+
+def load_checkpoint(path: str) -> list[RoomCheckpoint]:
+    """
+    Reads the rooms saved at `path` and removes the file, so the same games are
+    never restored twice. A missing or unreadable checkpoint restores nothing.
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        logging.exception(e)
+        return []
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+    if data.get("version") != CHECKPOINT_VERSION:
+        logging.warning(f"ignoring room checkpoint version {data.get('version')}")
+        return []
+
+    return [
+        RoomCheckpoint(
+            room_id,
+            grid_size,
+            computer,
+            player1,
+            player2,
+            starter,
+            bytes.fromhex(moves),
+            game_time_left,
+        )
+        for (
+            room_id,
+            grid_size,
+            computer,
+            player1,
+            player2,
+            starter,
+            moves,
+            game_time_left,
+        ) in data["rooms"]
+    ]
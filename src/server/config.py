@@ -0,0 +1,138 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# all durations are in seconds
+
+# time a player gets to make a single move before forfeiting the game
+TURN_TIMEOUT = float(os.environ.get("TURN_TIMEOUT", 60))
+# time an entire game may take, the player on move forfeits when it runs out
+GAME_TIMEOUT = float(os.environ.get("GAME_TIMEOUT", 60 * 30))
+# time a connected player may wait in a room for the opponent to show up
+IDLE_TIMEOUT = float(os.environ.get("IDLE_TIMEOUT", 60 * 5))
+# time a player whose connection dropped mid game has to reconnect before forfeiting
+RECONNECT_GRACE = float(os.environ.get("RECONNECT_GRACE", 30))
+
+# where rooms are stored: "mysql", a server reached with the MYSQL_* variables, or
+# "sqlite", a file next to the server that needs no database service; workers sharing
+# a sqlite file must run on the same machine
+DB_BACKEND = os.environ.get("DB_BACKEND", "mysql")
+# file of the sqlite database, ":memory:" keeps it in memory and loses it on restart
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "tictactoe.db")
+# connections kept open to mysql, and seconds after which one is reopened
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+
+# time a room lasts after being created, a room with players connected lasts as long as
+# they stay, and how often expired rooms are deleted; each pass deletes them in batches
+# of CLEANUP_BATCH_SIZE, and leaves the rest to the next pass after CLEANUP_MAX_DURATION
+ROOM_LIFETIME = float(os.environ.get("ROOM_LIFETIME", 60 * 60 * 2))
+CLEANUP_INTERVAL = float(os.environ.get("CLEANUP_INTERVAL", 60))
+CLEANUP_BATCH_SIZE = int(os.environ.get("CLEANUP_BATCH_SIZE", 500))
+CLEANUP_MAX_DURATION = float(os.environ.get("CLEANUP_MAX_DURATION", 1))
+
+# rooms kept in memory after being read from or written to the database, the least
+# recently used go first, and seconds each is kept for; other workers' writes to a
+# room may go unseen for that long
+ROOM_CACHE_SIZE = int(os.environ.get("ROOM_CACHE_SIZE", 10_000))
+ROOM_CACHE_TTL = float(os.environ.get("ROOM_CACHE_TTL", 60))
+
+# room ids generated ahead of time, in batches of this many
+ROOM_ID_POOL_SIZE = int(os.environ.get("ROOM_ID_POOL_SIZE", 1024))
+
+# keys player tokens are signed with, as comma separated `key_id:secret` pairs; the
+# first one signs, the rest only verify, so a new key goes first and an old one is
+# dropped once its tokens have expired; every worker needs the same keys
+TOKEN_KEYS = os.environ.get("TOKEN_KEYS", "")
+# time a player token stays valid after joining a room
+TOKEN_TTL = float(os.environ.get("TOKEN_TTL", 60 * 60 * 2))
+
+# the state of the games in progress is written to the database this often, every
+# room's moves since the last write making a single update, so a crash loses at most
+# that long of them; once this many rooms wait to be written, new ones wait for a write
+GAME_STATE_FLUSH_INTERVAL = float(os.environ.get("GAME_STATE_FLUSH_INTERVAL", 0.25))
+GAME_STATE_MAX_BACKLOG = int(os.environ.get("GAME_STATE_MAX_BACKLOG", 10_000))
+
+# file the games in progress are saved to on shutdown and restored from on startup,
+# empty to drop them on every restart; each worker needs a file of its own
+CHECKPOINT_PATH = os.environ.get("CHECKPOINT_PATH", "")
+
+# name of this worker, must be unique across the cluster
+WORKER_ID = os.environ.get("WORKER_ID", "local")
+# comma separated ids of every worker, rooms are spread over them by consistent hashing
+CLUSTER_WORKERS = [
+    w.strip() for w in os.environ.get("CLUSTER_WORKERS", WORKER_ID).split(",")
+]
+# broker used to forward room traffic between workers, see `server.broker.create_broker`
+BROKER_URL = os.environ.get("BROKER_URL", "memory://")
+
+# limits on frames sent by clients over the game websocket
+# largest accepted frame in bytes, bigger frames get the client disconnected
+MAX_FRAME_SIZE = int(os.environ.get("MAX_FRAME_SIZE", 1024))
+# average frames per second a client may send, and the burst allowed on top
+INBOUND_RATE = float(os.environ.get("INBOUND_RATE", 5))
+INBOUND_BURST = int(os.environ.get("INBOUND_BURST", 10))
+# events buffered per client until the game loop reads them
+INBOUND_QUEUE_SIZE = int(os.environ.get("INBOUND_QUEUE_SIZE", 8))
+# what happens to a client going over its rate or queue size: "drop" discards
+# the offending frames (the stalest ones for a full queue), "disconnect" closes it
+INBOUND_OVERFLOW = os.environ.get("INBOUND_OVERFLOW", "drop")
+
+# limits on the room http endpoints, going over them gets a 429 response
+# rooms a single client address may create per second on average, and the burst on top
+ROOM_CREATE_RATE = float(os.environ.get("ROOM_CREATE_RATE", 0.2))
+ROOM_CREATE_BURST = int(os.environ.get("ROOM_CREATE_BURST", 5))
+# joins a single client address may make per second, and the burst on top
+ROOM_JOIN_RATE = float(os.environ.get("ROOM_JOIN_RATE", 1))
+ROOM_JOIN_BURST = int(os.environ.get("ROOM_JOIN_BURST", 10))
+# joins a single room may get per second from everyone together, and the burst on top
+ROOM_JOIN_ROOM_RATE = float(os.environ.get("ROOM_JOIN_ROOM_RATE", 0.5))
+ROOM_JOIN_ROOM_BURST = int(os.environ.get("ROOM_JOIN_ROOM_BURST", 5))
+# client addresses and rooms each limit keeps track of, the least recently seen go first
+RATE_LIMIT_KEYS = int(os.environ.get("RATE_LIMIT_KEYS", 10_000))
+
+# new rooms and connections get turned away while any of these is over its limit, until
+# all of them are back under ADMISSION_RECOVER times their limit; 0 turns a limit off
+# event loop lag, smoothed
+ADMISSION_MAX_LOOP_LAG = float(os.environ.get("ADMISSION_MAX_LOOP_LAG", 0.1))
+# rooms in memory and websockets open, players and spectators
+ADMISSION_MAX_ROOMS = int(os.environ.get("ADMISSION_MAX_ROOMS", 0))
+ADMISSION_MAX_SOCKETS = int(os.environ.get("ADMISSION_MAX_SOCKETS", 0))
+# database work waiting for a database thread, per thread; every thread holds one of
+# the DB_POOL_SIZE connections, or the single sqlite one, see `crud.db_backlog`
+ADMISSION_MAX_DB_POOL = float(os.environ.get("ADMISSION_MAX_DB_POOL", 1))
+ADMISSION_RECOVER = float(os.environ.get("ADMISSION_RECOVER", 0.8))
+# how often the gauges are read
+ADMISSION_INTERVAL = float(os.environ.get("ADMISSION_INTERVAL", 0.5))
+# seconds turned away clients are told to wait before trying again
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", 5))
+
+# most players a tournament may have, all of them play at once in the first round
+MAX_TOURNAMENT_PLAYERS = int(os.environ.get("MAX_TOURNAMENT_PLAYERS", 512))
+# time a finished tournament's standings stay around
+TOURNAMENT_RESULTS_TTL = float(os.environ.get("TOURNAMENT_RESULTS_TTL", 60 * 60))
+
+# rating of a player's first game, and most points a single game can move it by; games
+# against the computer aren't rated
+RATING_START = int(os.environ.get("RATING_START", 1200))
+RATING_K = float(os.environ.get("RATING_K", 32))
+# best players kept in memory for the leaderboard, refreshed when a game changes them
+# and at least this often, for the games finished on other workers
+LEADERBOARD_CACHE_SIZE = int(os.environ.get("LEADERBOARD_CACHE_SIZE", 100))
+LEADERBOARD_CACHE_TTL = float(os.environ.get("LEADERBOARD_CACHE_TTL", 10))
+# most players a single leaderboard page may have
+LEADERBOARD_MAX_PAGE = int(os.environ.get("LEADERBOARD_MAX_PAGE", 100))
+
+# processes computing the computer's moves in rooms against the computer
+COMPUTER_WORKERS = int(os.environ.get("COMPUTER_WORKERS", 2))
+# moves computed at once, further ones wait for a slot
+COMPUTER_MAX_JOBS = int(os.environ.get("COMPUTER_MAX_JOBS", 16))
+# time the computer gets for a move, waiting included, before it moves at random
+COMPUTER_MOVE_TIMEOUT = float(os.environ.get("COMPUTER_MOVE_TIMEOUT", 2))
+
+# events kept for spectators of a room, ones further behind skip to the latest board
+SPECTATOR_BUFFER = int(os.environ.get("SPECTATOR_BUFFER", 16))
+# most spectators a single room may have
+MAX_SPECTATORS = int(os.environ.get("MAX_SPECTATORS", 1000))
@@ -1,26 +1,95 @@
 import asyncio
+import time
+from dataclasses import asdict
+from functools import partial
+from typing import Callable
 
 from fastapi import WebSocket
 from fastapi.websockets import WebSocketState
 
-from common.events import Event
-from server.models.crud import db_session, get_room_by_id
-from server.utils import Player
+from common.events import (
+    CLIENT_EVENTS,
+    Event,
+    EventType,
+    InvalidStructureException,
+    Subprotocol,
+    decode_event,
+    error_event,
+    message_event,
+    negotiate_subprotocol,
+)
+from server.config import (
+    INBOUND_BURST,
+    INBOUND_OVERFLOW,
+    INBOUND_QUEUE_SIZE,
+    INBOUND_RATE,
+    MAX_FRAME_SIZE,
+    MAX_SPECTATORS,
+    ROOM_LIFETIME,
+    SPECTATOR_BUFFER,
+)
+from server.expiry import ExpiryHeap
+from server.models.crud import get_room_by_id, run_in_session
+from server.ratelimit import TokenBucket
+from server.spectators import Spectators
+from server.timers import Expiry
+from server.utils import Player, RoomStats
+
+InboundQueue = asyncio.Queue[Event | Expiry | None]
+
+
+def _put_dropping_oldest(queue: InboundQueue, item: Event | Expiry | None) -> bool:
+    """Puts `item` in the queue, making room by dropping the oldest item if it's
+    full. Returns whether something was dropped."""
+    dropped = False
+    if queue.full():
+        queue.get_nowait()
+        dropped = True
+    queue.put_nowait(item)
+    return dropped
+
+
+def _queue(player: Player) -> InboundQueue:
+    """The incoming event queue of a player, created once something uses it."""
+    if player.queue is None:
+        player.queue = asyncio.Queue(maxsize=INBOUND_QUEUE_SIZE)
+    return player.queue
+
+
+def _add_stats(totals: RoomStats, stats: RoomStats) -> None:
+    totals.received += stats.received
+    totals.dropped += stats.dropped
+    totals.throttled += stats.throttled
+    totals.oversized += stats.oversized
+    totals.invalid += stats.invalid
 
 
 class ConnectionManager:
     def __init__(self):
         self.active_connections: dict[str, list[Player]] = {}
-        # Per-room, per-websocket incoming event queues.
-        # Keyed by id(websocket) to avoid relying on WebSocket hashing semantics.
-        self._incoming_events: dict[str, dict[int, asyncio.Queue[Event | None]]] = {}
+        # id()s of websockets which negotiated the binary subprotocol
+        self._binary_sockets: set[int] = set()
+        # per-room factories of `BOARD` snapshots, sent when a client resyncs
+        self._snapshots: dict[str, Callable[[], Event]] = {}
+        self.room_stats: dict[str, RoomStats] = {}
+        # counters of the deleted rooms, so the totals cover finished games too
+        self._finished_stats = RoomStats()
+        self.spectators = Spectators(SPECTATOR_BUFFER, MAX_SPECTATORS)
+        # rooms in memory by when they expire, see `crud.update_active_rooms`
+        self.room_expiry = ExpiryHeap()
+        # per-room futures of game loops waiting on a disconnected player
+        self._reconnect_waiters: dict[
+            str, dict[str, asyncio.Future[Player | None]]
+        ] = {}
 
-    def add_room(self, room: str):
+    def add_room(self, room: str, expires_at: float | None = None):
         if self.active_connections.get(room):
             raise Exception("this room already exists in the connections")
 
         self.active_connections[room] = []
-        self._incoming_events.setdefault(room, {})
+        if expires_at is None:
+            expires_at = time.time() + ROOM_LIFETIME
+        self.room_expiry.push(room, expires_at)
 
     def add_player_name(self, room_id: str, player_name: str, ws: WebSocket):
         for player in self.active_connections[room_id]:
@@ -36,6 +105,7 @@ class ConnectionManager:
             return
 
         for player in list(players):
+            self._binary_sockets.discard(id(player.ws))
             try:
                 await player.ws.close()
             except RuntimeError:
@@ -44,33 +114,137 @@ class ConnectionManager:
                 pass
 
         self.active_connections.pop(room, None)
-        self._incoming_events.pop(room, None)
+        self.room_expiry.discard(room)
+        self._snapshots.pop(room, None)
+        stats = self.room_stats.pop(room, None)
+        if stats is not None:
+            _add_stats(self._finished_stats, stats)
+        self.spectators.close_room(room)
+        for waiter in self._reconnect_waiters.pop(room, {}).values():
+            if not waiter.done():
+                waiter.set_result(None)
 
-    async def connect(self, room_id: str, websocket: WebSocket):
+    async def connect(self, room_id: str, websocket: WebSocket, player_name: str):
+        """Accepts the websocket of a verified player.
+
+        A player who is already in the room is reconnecting: their new websocket
+        takes over the old one along with its pending events, and it is sent a
+        snapshot of the board if a game is running.
+        """
         conns = self.__find_all_conn_by_room(room_id)
         if conns is None:
             # dont have the condition as `not conns` because that also checks for zero length
             # This can happen after a server restart: DB has the room but memory doesn't.
-            with db_session() as db:
-                room = get_room_by_id(room_id, db)
+            room = await run_in_session(partial(get_room_by_id, room_id))
             if room and getattr(room, "is_active", True):
-                self.active_connections[room_id] = []
-                self._incoming_events.setdefault(room_id, {})
-                conns = self.active_connections[room_id]
+                # the other player may have connected while the room was read
+                conns = self.active_connections.setdefault(room_id, [])
+                if room_id not in self.room_expiry:
+                    self.room_expiry.push(room_id, room.expires_at)
             else:
                 raise Exception(f"invalid {room_id=}")
 
-        if len(conns) >= 2:
+        existing = self.find_player_by_name(room_id, player_name)
+        if existing is None and len(conns) >= 2:
             await websocket.close()
             return False
 
-        await websocket.accept()
-        self.active_connections[room_id].append(Player("", websocket))
-        self._incoming_events.setdefault(room_id, {})[id(websocket)] = asyncio.Queue()
+        subprotocol = negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        await self.attach(room_id, websocket, player_name, subprotocol)
         return True
 
+    async def attach(
+        self,
+        room_id: str,
+        websocket: WebSocket,
+        player_name: str,
+        subprotocol: Subprotocol | None,
+    ):
+        """Seats `player_name` on an accepted websocket in a room known to be
+        in memory, see `connect`."""
+        binary = subprotocol is not None and subprotocol.binary
+        deltas = subprotocol is not None and subprotocol.deltas
+        if binary:
+            self._binary_sockets.add(id(websocket))
+
+        existing = self.find_player_by_name(room_id, player_name)
+        if existing is None:
+            self.active_connections[room_id].append(
+                Player(player_name, websocket, binary, deltas)
+            )
+        else:
+            await self._resume(room_id, existing, websocket, binary, deltas)
+
+    async def _resume(
+        self,
+        room_id: str,
+        player: Player,
+        websocket: WebSocket,
+        binary: bool,
+        deltas: bool,
+    ):
+        old_ws, old_queue = player.ws, player.queue
+        self._binary_sockets.discard(id(old_ws))
+        player.ws, player.binary, player.deltas = websocket, binary, deltas
+        player.queue = None
+        player.connected = True
+
+        snapshot = self._snapshots.get(room_id)
+        if snapshot is not None:
+            await self.send_event(snapshot(), websocket)
+
+        if old_queue is not None:
+            # pending expiries carry over, the disconnect marker doesn't
+            queue = _queue(player)
+            while not old_queue.empty():
+                item = old_queue.get_nowait()
+                if item is not None:
+                    _put_dropping_oldest(queue, item)
+            # wakes up a game loop still waiting on the old websocket
+            old_queue.put_nowait(None)
+
+        waiter = self._reconnect_waiters.get(room_id, {}).pop(player.name, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(player)
+
+        try:
+            await old_ws.close()
+        except Exception:
+            # the old connection is most likely dead already
+            pass
+
+    def reconnect_waiter(
+        self, room_id: str, player_name: str
+    ) -> asyncio.Future[Player | None]:
+        """Returns a future resolved with the player once they reconnect, or right
+        away if they already have.
+
+        Whoever waits on it resolves it with `None` when they stop waiting.
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        player = self.find_player_by_name(room_id, player_name)
+        if player is None:
+            waiter.set_result(None)
+        elif player.connected:
+            waiter.set_result(player)
+        else:
+            self._reconnect_waiters.setdefault(room_id, {})[player_name] = waiter
+        return waiter
+
+    async def watch(self, room_id: str, websocket: WebSocket):
+        """Streams the room to a read-only spectator until either goes away."""
+        snapshot = self._snapshots.get(room_id)
+        await self.spectators.watch(
+            room_id, websocket, snapshot() if snapshot is not None else None
+        )
+
+    def set_snapshot(self, room_id: str, snapshot: Callable[[], Event]):
+        """Registers the factory of `BOARD` snapshots sent to resyncing clients."""
+        self._snapshots[room_id] = snapshot
+
     def find_player_by_name(self, room_id: str, player_name: str):
-        for player in self.active_connections[room_id]:
+        for player in self.active_connections.get(room_id, []):
             if player.name == player_name:
                 return player
 
@@ -86,7 +260,7 @@ class ConnectionManager:
         player = self.__find_player_by_websocket(room_id, websocket)
         if player:
             self.active_connections[room_id].remove(player)
-            self._incoming_events.get(room_id, {}).pop(id(websocket), None)
+            self._binary_sockets.discard(id(websocket))
             try:
                 if (
                     websocket.application_state == WebSocketState.CONNECTED
@@ -98,36 +272,176 @@ class ConnectionManager:
                 return
 
     async def read_events(self, room_id: str, websocket: WebSocket):
-        """Continuously read incoming websocket messages into a per-socket queue.
+        """Continuously read incoming websocket messages into the player's queue,
+        until the connection drops or the player resumes on another websocket.
 
-        Exactly one task should call this per websocket.
+        Exactly one task should call this per websocket. Frames over
+        `MAX_FRAME_SIZE` get the client disconnected, frames over its token bucket
+        and events which don't fit in the bounded queue are dropped or get the
+        client disconnected depending on `INBOUND_OVERFLOW`. Malformed events and
+        events clients may not send are queued as `ERROR` events instead.
         """
-        queue = self._incoming_events.get(room_id, {}).get(id(websocket))
-        if queue is None:
+        player = self.__find_player_by_websocket(room_id, websocket)
+        if player is None:
             return
 
+        stats = self.room_stats.setdefault(room_id, RoomStats())
+        bucket = TokenBucket(INBOUND_RATE, INBOUND_BURST)
+        disconnect = INBOUND_OVERFLOW == "disconnect"
+        close_code = None
         try:
             while True:
-                data = await websocket.receive_json()
-                event = Event.from_dict(data)
-                await queue.put(event)
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if player.ws is not websocket:
+                    # they resumed elsewhere, this connection is being closed
+                    break
+                frame = message.get("bytes")
+                if frame is None:
+                    frame = message.get("text")
+                stats.received += 1
+
+                if frame is None or len(frame) > MAX_FRAME_SIZE:
+                    stats.oversized += 1
+                    close_code = 1009  # message too big
+                    break
+
+                if not bucket.consume():
+                    stats.throttled += 1
+                    if disconnect:
+                        close_code = 1008  # policy violation
+                        break
+                    continue
+
+                # rejected events reach the game loop as errors, it answers them
+                # and asks for the move again
+                try:
+                    event = decode_event(frame)
+                except InvalidStructureException as e:
+                    stats.invalid += 1
+                    event = error_event(str(e))
+                else:
+                    if event.type_ not in CLIENT_EVENTS:
+                        stats.invalid += 1
+                        event = error_event(f"{event.type_} events can't be sent")
+                if event.type_ == EventType.RESYNC:
+                    # answered right away, the game loop may be waiting on the
+                    # other player
+                    snapshot = self._snapshots.get(room_id)
+                    if snapshot is not None:
+                        await self.send_event(snapshot(), websocket)
+                    continue
+                if player.binary and event.type_ == EventType.MOVE:
+                    # binary moves don't carry a marker
+                    event.data["move"]["marker"] = player.name
+
+                queue = _queue(player)
+                if queue.full() and disconnect:
+                    stats.dropped += 1
+                    close_code = 1008
+                    break
+                if _put_dropping_oldest(queue, event):
+                    stats.dropped += 1
+                player.events_queued += 1
         except Exception:
             # Any receive error means the connection is gone.
+            pass
+
+        if close_code is not None:
             try:
-                await queue.put(None)
-            except Exception:
-                return
+                await websocket.close(code=close_code)
+            except RuntimeError:
+                pass
+
+        self.connection_lost(room_id, websocket)
+
+    def connection_lost(self, room_id: str, websocket: WebSocket):
+        """Marks the player on `websocket` as disconnected, they keep their seat
+        until the game loop gives up waiting for them to reconnect."""
+        player = self.__find_player_by_websocket(room_id, websocket)
+        if player is not None:
+            player.connected = False
+            _put_dropping_oldest(_queue(player), None)
 
-    async def receive_event(self, room_id: str, websocket: WebSocket) -> Event | None:
-        queue = self._incoming_events.get(room_id, {}).get(id(websocket))
-        if queue is None:
+    def drop_stale_events(self, room_id: str, websocket: WebSocket):
+        """Throws away events sent by a client before it was asked for a move.
+
+        Events queued after the client was last sent an error, see `send_error`,
+        answer the error and are kept. Disconnects and expiries stay in the queue.
+        """
+        player = self.__find_player_by_websocket(room_id, websocket)
+        if player is None:
+            return
+        rejected_at, player.rejected_at = player.rejected_at, None
+        if player.queue is None or player.queue.empty():
+            return
+
+        queue = player.queue
+        # overflowing events are dropped oldest first, so the ones sent after the
+        # error are the newest in the queue
+        answers = 0 if rejected_at is None else player.events_queued - rejected_at
+        items = []
+        while not queue.empty():
+            items.append(queue.get_nowait())
+        events = sum(isinstance(item, Event) for item in items)
+        dropped = max(events - answers, 0)
+
+        kept = []
+        stale = dropped
+        for item in items:
+            if isinstance(item, Event) and stale:
+                stale -= 1
+            else:
+                kept.append(item)
+        for item in kept:
+            queue.put_nowait(item)
+        if dropped:
+            self.room_stats.setdefault(room_id, RoomStats()).dropped += dropped
+
+    async def receive_event(
+        self, room_id: str, websocket: WebSocket
+    ) -> Event | Expiry | None:
+        player = self.__find_player_by_websocket(room_id, websocket)
+        if player is None:
             return None
-        return await queue.get()
+        return await _queue(player).get()
+
+    def expire_player(self, room_id: str, player_name: str, expiry: Expiry):
+        """Wakes up the game loop waiting on `player_name` with an `Expiry`.
+
+        Called from `TimerWheel` callbacks, so it must not block.
+        """
+        player = self.find_player_by_name(room_id, player_name)
+        if player is not None:
+            _put_dropping_oldest(_queue(player), expiry)
+
+    def expire_room(self, room_id: str, expiry: Expiry):
+        """Puts an `Expiry` in the incoming queue of every player in the room."""
+        for player in self.active_connections.get(room_id, []):
+            _put_dropping_oldest(_queue(player), expiry)
+
+    async def send_error(self, room_id: str, websocket: WebSocket, message: str):
+        """Tells a client its last event was rejected. Only clients speaking a v2
+        subprotocol know `ERROR` events, others get a `MESSAGE`."""
+        player = self.__find_player_by_websocket(room_id, websocket)
+        if player is not None:
+            player.rejected_at = player.events_queued
+        if player is not None and player.deltas:
+            await self.send_event(error_event(message), websocket)
+        else:
+            await self.send_event(message_event(message), websocket)
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
         await websocket.send_text(message)
 
     async def send_event(self, event: Event, websocket: WebSocket):
+        if id(websocket) in self._binary_sockets:
+            await self.send_frame(event.encode_binary(), websocket)
+        else:
+            await self.send_frame(event.encode(), websocket)
+
+    async def send_frame(self, frame: str | bytes, websocket: WebSocket):
         # Starlette raises RuntimeError if you try to send after a close.
         # This can legitimately happen during disconnect races.
         try:
@@ -136,10 +450,37 @@ class ConnectionManager:
                 or websocket.client_state != WebSocketState.CONNECTED
             ):
                 return
-            await websocket.send_json(event.asdict())
+            if isinstance(frame, bytes):
+                await websocket.send_bytes(frame)
+            else:
+                await websocket.send_text(frame)
         except RuntimeError:
             return
 
+    def stats(self) -> dict:
+        """Totals since startup and per-room frame counters of the live rooms, rooms
+        without any trouble are left out of the per-room listing."""
+        totals = RoomStats()
+        _add_stats(totals, self._finished_stats)
+        rooms = {}
+        for room_id, stats in self.room_stats.items():
+            _add_stats(totals, stats)
+            if stats.dropped or stats.throttled or stats.oversized or stats.invalid:
+                rooms[room_id] = asdict(stats)
+
+        return {
+            "rooms": len(self.active_connections),
+            "connections": sum(len(c) for c in self.active_connections.values()),
+            "spectators": self.spectators.count(),
+            "frames": asdict(totals),
+            "troubled_rooms": rooms,
+        }
+
+    def open_sockets(self) -> int:
+        """Websockets of players and spectators."""
+        players = sum(len(c) for c in self.active_connections.values())
+        return players + self.spectators.count()
+
     def is_room_ready(self, room: str):
         conns = self.__find_all_conn_by_room(room)
         if conns is None:
@@ -154,11 +495,37 @@ class ConnectionManager:
         for conn in connections:
             await conn.ws.send_text(message)
 
-    async def broadcast_event(self, room: str, event: Event):
+    async def broadcast_event(
+        self,
+        room: str,
+        event: Event,
+        fallback: Callable[[], Event] | None = None,
+    ):
+        """Sends `event` to everyone in the room.
+
+        `fallback` builds the event sent instead to clients whose subprotocol
+        doesn't support `DELTA` updates, and to spectators. It's only called if
+        there are any. Spectators are only handed the event, their own writer
+        tasks send it.
+        """
         connections = self.__find_all_conn_by_room(room)
         if connections is None:
             return
-        await asyncio.gather(
-            *(self.send_event(event, conn.ws) for conn in connections),
-            return_exceptions=True
-        )
+
+        watched = self.spectators.watching(room)
+        legacy_event = event
+        if fallback is not None and (
+            watched or not all(conn.deltas for conn in connections)
+        ):
+            legacy_event = fallback()
+        if watched:
+            # spectators always get whole boards, so they can skip updates
+            self.spectators.publish(room, legacy_event)
+
+        # events cache their encodings, so each format is serialized only once
+        sends = []
+        for conn in connections:
+            e = event if conn.deltas else legacy_event
+            frame = e.encode_binary() if conn.binary else e.encode()
+            sends.append(self.send_frame(frame, conn.ws))
+        await asyncio.gather(*sends, return_exceptions=True)
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import multiprocessing
+import random
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+
+from common.tic_tac_toe import Cell, Difficulty, TicTacToe
+
+# name of the computer's seat in a room
+COMPUTER_NAME = "computer"
+
+
+def _empty_positions(board: list[list[int]]) -> list[int]:
+    grid_size = len(board)
+    return [
+        row * grid_size + col + 1
+        for row in range(grid_size)
+        for col in range(grid_size)
+        if board[row][col] == Cell.EMPTY.value
+    ]
+
+
+def choose_move(board: list[list[int]], difficulty: str) -> int:
+    """
+    Returns the position the computer plays on `board`, where it is the player
+    marked `Cell.COMPUTER`. Runs in the worker processes of `ComputerPlayer`.
+    """
+    grid_size = len(board)
+    # skips `TicTacToe.__init__`, which sets up log files and starts a thread
+    game = TicTacToe.__new__(TicTacToe)
+    game.difficulty = Difficulty(difficulty)
+    game.grid_size = grid_size
+    game.board = [[Cell(value) for value in row] for row in board]
+    game.position_to_coordinates = {
+        row * grid_size + col + 1: (row, col)
+        for row in range(grid_size)
+        for col in range(grid_size)
+    }
+    game.coordinates_to_position = {
+        v: k for k, v in game.position_to_coordinates.items()
+    }
+    game.moves = []
+    game.fill_computer_cell()
+    return game.moves[-1].pos
+
+
+@dataclass(slots=True)
+class ComputerStats:
+    """
+    Counters of the moves asked of the computer.
+    """
+
+    requested: int = 0
+    # moves computed by the engine in time
+    computed: int = 0
+    # moves that ran out of time, waiting for a free job slot or in the engine
+    timed_out: int = 0
+    # moves the engine failed to compute
+    failed: int = 0
+    # moves waiting for a job slot and moves being computed right now
+    waiting: int = 0
+    running: int = 0
+    # total and worst time spent computing moves, in seconds
+    think_time: float = 0.0
+    max_think_time: float = 0.0
+
+
+class ComputerPlayer:
+    """
+    Plays the computer's seat in rooms against the computer.
+
+    Moves are computed in a shared process pool so a slow search never blocks
+    the event loop. At most `max_jobs` moves are in the pool at once, others
+    wait for a slot. A move that isn't ready within `move_timeout` seconds,
+    waiting included, is replaced by a random one.
+    """
+
+    def __init__(self, workers: int, max_jobs: int, move_timeout: float) -> None:
+        self.workers = workers
+        self.move_timeout = move_timeout
+        self.counters = ComputerStats()
+        self._slots = asyncio.Semaphore(max_jobs)
+        self._executor: Executor | None = None
+
+    def start(self) -> None:
+        """Starts the worker processes, so the first moves don't wait for them."""
+        pool = self._pool()
+        empty = [[Cell.EMPTY.value] * 3 for _ in range(3)]
+        for _ in range(self.workers):
+            pool.submit(choose_move, empty, Difficulty.EASY.value)
+
+    def _pool(self) -> Executor:
+        if self._executor is None:
+            # spawned, forking a process running an event loop and threads is unsafe
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def choose_move(self, board: list[list[int]], difficulty: Difficulty) -> int:
+        stats = self.counters
+        stats.requested += 1
+        asked = time.perf_counter()
+        stats.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.move_timeout)
+        except TimeoutError:
+            stats.timed_out += 1
+            return random.choice(_empty_positions(board))
+        finally:
+            stats.waiting -= 1
+
+        loop = asyncio.get_running_loop()
+        stats.running += 1
+        start = time.perf_counter()
+        try:
+            job = loop.run_in_executor(
+                self._pool(), choose_move, board, difficulty.value
+            )
+        except Exception as e:
+            stats.running -= 1
+            self._slots.release()
+            logging.exception(e)
+            stats.failed += 1
+            return random.choice(_empty_positions(board))
+
+        def _done(_: asyncio.Future) -> None:
+            # the slot is held until the engine is really done, even after timing out
+            stats.running -= 1
+            self._slots.release()
+            elapsed = time.perf_counter() - start
+            stats.think_time += elapsed
+            stats.max_think_time = max(stats.max_think_time, elapsed)
+
+        job.add_done_callback(_done)
+        remaining = self.move_timeout - (time.perf_counter() - asked)
+        try:
+            pos = await asyncio.wait_for(asyncio.shield(job), max(remaining, 0))
+        except TimeoutError:
+            stats.timed_out += 1
+            return random.choice(_empty_positions(board))
+        except Exception as e:
+            logging.exception(e)
+            stats.failed += 1
+            return random.choice(_empty_positions(board))
+
+        stats.computed += 1
+        return pos
+
+    def stats(self) -> dict:
+        return asdict(self.counters)
@@ -0,0 +1,44 @@
+import heapq
+
+
+class ExpiryHeap:
+    """
+    The rooms held in memory by when they expire, soonest first.
+
+    A room's expiry can be moved or dropped at any time; the entries it leaves
+    behind in the heap are skipped when they come up, and the heap is rebuilt
+    once they make up most of it.
+    """
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[float, str]] = []
+        self._expiry: dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+    def __contains__(self, room_id: str) -> bool:
+        return room_id in self._expiry
+
+    def push(self, room_id: str, expires_at: float) -> None:
+        """Sets when `room_id` expires, replacing any earlier expiry."""
+        self._expiry[room_id] = expires_at
+        heapq.heappush(self._heap, (expires_at, room_id))
+        if len(self._heap) > 2 * len(self._expiry) + 64:
+            self._heap = [(at, room) for room, at in self._expiry.items()]
+            heapq.heapify(self._heap)
+
+    def discard(self, room_id: str) -> None:
+        self._expiry.pop(room_id, None)
+
+    def pop_due(self, until: float) -> list[tuple[str, float]]:
+        """Removes and returns the rooms expiring by `until`, with their expiry."""
+        due = []
+        while self._heap and self._heap[0][0] <= until:
+            expires_at, room_id = heapq.heappop(self._heap)
+            if self._expiry.get(room_id) != expires_at:
+                # moved or dropped since
+                continue
+            del self._expiry[room_id]
+            due.append((room_id, expires_at))
+        return due
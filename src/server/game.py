@@ -0,0 +1,106 @@
+from functools import cache
+
+from common.tic_tac_toe import Cell, CheckWinResult, GameplayError
+
+# `Cell`s indexed by their value
+_CELLS = tuple(Cell)
+
+
+class Grid:
+    """
+    The winning lines through each cell of a grid size. Built once per size and
+    shared by every room playing on it.
+
+    Cells are indexed from 0 in row major order, positions are cell indexes + 1.
+    """
+
+    __slots__ = ("size", "cells", "lines")
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.cells = size * size
+
+        lines = [tuple(range(row * size, row * size + size)) for row in range(size)]
+        lines += [tuple(range(col, self.cells, size)) for col in range(size)]
+        lines.append(tuple(i * size + i for i in range(size)))
+        lines.append(tuple(i * size + size - 1 - i for i in range(size)))
+        self.lines = tuple(
+            tuple(line for line in lines if i in line) for i in range(self.cells)
+        )
+
+
+@cache
+def get_grid(size: int) -> Grid:
+    return Grid(size)
+
+
+class RoomGame:
+    """
+    A game between two players in a room, kept small since a server holds many.
+
+    The board is a bytearray of `Cell` values and the moves a bytearray of the
+    positions played, in order, the players taking turns. The first player marks
+    `Cell.COMPUTER` and the second `Cell.PLAYER`, like `LMPTicTacToe`.
+    """
+
+    __slots__ = ("player1", "player2", "grid", "cells", "moves")
+
+    def __init__(self, player1: str, player2: str, grid_size: int) -> None:
+        self.player1 = player1
+        self.player2 = player2
+        self.grid = get_grid(grid_size)
+        self.cells = bytearray(self.grid.cells)
+        self.moves = bytearray()
+
+    def on_board(self, pos: int) -> bool:
+        return 1 <= pos <= self.grid.cells
+
+    def is_taken(self, pos: int) -> bool:
+        return self.cells[pos - 1] != Cell.EMPTY.value
+
+    def fill_player_cell(self, player: str, pos: int) -> Cell:
+        """
+        Marks `pos` for `player`, who must be free to play it. Returns the mark.
+        """
+        if player == self.player1:
+            mark = Cell.COMPUTER
+        elif player == self.player2:
+            mark = Cell.PLAYER
+        else:
+            raise GameplayError(f"Unknown player {player}!")
+
+        self.cells[pos - 1] = mark.value
+        self.moves.append(pos)
+        return mark
+
+    @property
+    def board(self) -> list[list[Cell]]:
+        """The board as rows of `Cell`s, the way events take it."""
+        size = self.grid.size
+        cells = [_CELLS[value] for value in self.cells]
+        return [cells[i : i + size] for i in range(0, len(cells), size)]
+
+    def values(self) -> list[list[int]]:
+        """The board as rows of `Cell` values."""
+        size = self.grid.size
+        return [list(self.cells[i : i + size]) for i in range(0, len(self.cells), size)]
+
+    def game_outcome(self) -> tuple[bool, CheckWinResult | None]:
+        """
+        Whether the game is over and who won it. Only the lines through the last
+        move can have been completed by it.
+        """
+        if not self.moves:
+            return False, None
+
+        cells = self.cells
+        last = self.moves[-1] - 1
+        value = cells[last]
+        for line in self.grid.lines[last]:
+            if all(cells[i] == value for i in line):
+                winner = self.player1 if value == Cell.COMPUTER.value else self.player2
+                return True, CheckWinResult(True, winner)
+
+        if len(self.moves) == len(cells):
+            return True, None
+        return False, None
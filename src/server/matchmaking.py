@@ -0,0 +1,56 @@
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from fastapi import WebSocket
+
+from common.events import Event, Subprotocol
+
+
+@dataclass(slots=True, eq=False)
+class Ticket:
+    """
+    A quick-play player waiting for an opponent.
+    """
+
+    name: str
+    websocket: WebSocket
+    subprotocol: Subprotocol | None
+    # resolved with the `MATCHED` event once an opponent shows up
+    matched: asyncio.Future[Event] = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
+
+
+class Matchmaker:
+    """
+    In-memory queue of quick-play players, bucketed by grid size.
+
+    Players are paired first come first served. Both pairing and leaving the
+    queue are O(1).
+    """
+
+    def __init__(self) -> None:
+        self._waiting: dict[int, OrderedDict[int, Ticket]] = {}
+
+    def pair(self, grid_size: int, ticket: Ticket) -> Ticket | None:
+        """
+        Returns the longest waiting ticket for `grid_size`, or queues `ticket`
+        if there is none.
+        """
+        bucket = self._waiting.setdefault(grid_size, OrderedDict())
+        if bucket:
+            _, opponent = bucket.popitem(last=False)
+            return opponent
+
+        bucket[id(ticket)] = ticket
+        return None
+
+    def cancel(self, grid_size: int, ticket: Ticket) -> None:
+        bucket = self._waiting.get(grid_size)
+        if bucket is not None:
+            bucket.pop(id(ticket), None)
+
+    def stats(self) -> dict[int, int]:
+        """Number of players waiting per grid size."""
+        return {grid: len(bucket) for grid, bucket in self._waiting.items() if bucket}
@@ -1,11 +1,105 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from datetime import datetime
-from typing import Iterator
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Iterator, TypeVar
 
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
+from server.config import (
+    CLEANUP_BATCH_SIZE,
+    CLEANUP_INTERVAL,
+    CLEANUP_MAX_DURATION,
+    RATING_K,
+    RATING_START,
+    ROOM_CACHE_SIZE,
+    ROOM_CACHE_TTL,
+    ROOM_LIFETIME,
+)
+from server.engine import COMPUTER_NAME
+from server.ratings import PlayerRating, elo
+
+from . import database
+from .cache import TTLCache
 from .database import SessionLocal
-from .dbmodels import GameStatus, Room
+from .dbmodels import GameStatus, RatedPlayer, RatingCount, Room, room_expiry
+
+T = TypeVar("T")
+
+# runs the database work of coroutines, one thread per pooled connection so queries
+# queue up here instead of waiting on the pool inside a thread; created on first
+# use, once `init_db` picked the backend
+_db_executor: ThreadPoolExecutor | None = None
+# database work handed to the threads and not done yet, see `db_backlog`
+_db_pending = 0
+_db_pending_lock = threading.Lock()
+
+# characters of the cells in a packed board state, indexed by `Cell` value
+_BOARD_STATE_CHARS = "-12"
+
+
+def empty_board_state(grid_size: int) -> str:
+    return _BOARD_STATE_CHARS[0] * grid_size * grid_size
+
+
+def pack_board_state(board: list[list[Any]]) -> str:
+    """
+    Packs a board of `Cell`s into the `Room.board_state` column.
+    """
+    return "".join(_BOARD_STATE_CHARS[cell.value] for row in board for cell in row)
+
+
+_PACK_CELLS = bytes.maketrans(b"\x00\x01\x02", _BOARD_STATE_CHARS.encode())
+_UNPACK_CELLS = bytes.maketrans(_BOARD_STATE_CHARS.encode(), b"\x00\x01\x02")
+
+
+def pack_cells(cells: bytes) -> str:
+    """
+    Packs the `Cell` values of a board, in row major order, like `pack_board_state`.
+    """
+    return cells.translate(_PACK_CELLS).decode()
+
+
+def unpack_cells(board_state: str) -> bytes:
+    """The `Cell` values of a packed board state, in row major order."""
+    return board_state.encode().translate(_UNPACK_CELLS)
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(
+            max_workers=database.db_threads, thread_name_prefix="db"
+        )
+    return _db_executor
+
+
+def _work_done(_) -> None:
+    global _db_pending
+    with _db_pending_lock:
+        _db_pending -= 1
+
+
+def db_backlog() -> float:
+    """
+    Database work waiting for a free database thread, per thread. Over 0 once
+    every thread is busy and work queues up behind them.
+    """
+    threads = database.db_threads
+    return max(_db_pending - threads, 0) / threads
+
+
+def shutdown_db_threads() -> None:
+    """Waits for the database work already handed to the threads, and stops them."""
+    global _db_executor
+    if _db_executor is not None:
+        _db_executor.shutdown(wait=True)
+        _db_executor = None
 
 
 def get_db():
@@ -21,109 +115,337 @@ def db_session() -> Iterator[Session]:
         db.close()
 
 
-def get_room_by_id(room_id: str, db: Session) -> Room | None:
-    return (db).query(Room).filter_by(room_id=room_id).first()
+async def run_in_session(work: Callable[[Session], T]) -> T:
+    """
+    Runs `work` with a session of its own on a database thread, so the event loop
+    carries on while it waits for the database. Returned rows are detached, with
+    the columns loaded before the session closed.
+    """
+
+    def run() -> T:
+        with db_session() as db:
+            return work(db)
 
+    global _db_pending
+    with _db_pending_lock:
+        _db_pending += 1
+    future = _executor().submit(run)
+    # called once the work is over or was cancelled before starting
+    future.add_done_callback(_work_done)
+    return await asyncio.wrap_future(future)
 
-def add_player_to_room(
-    room_id: str, player_name: str, token: str, db: Session
-) -> tuple[bool, str]:
+
+@dataclass(slots=True, frozen=True)
+class RoomRecord:
+    """
+    The columns of a `Room` the server looks up, as kept in `room_cache`.
+    """
+
+    room_id: str
+    player1: str
+    player2: str
+    is_active: bool
+    grid_size: int
+    # difficulty of the computer sitting as player1, empty for two human players
+    computer: str
+    # unix time of `Room.expires_on`
+    expires_at: float
+
+    @classmethod
+    def of(cls, room: Room) -> "RoomRecord":
+        return cls(
+            str(room.room_id),
+            room.player1 or "",
+            room.player2 or "",
+            bool(room.is_active),
+            room.grid_size or 3,
+            room.computer or "",
+            _unix_time(room.expires_on),
+        )
+
+
+def _unix_time(utc: datetime | None) -> float:
+    return utc.replace(tzinfo=timezone.utc).timestamp() if utc else 0.0
+
+
+# rooms read lately, every write to a room updates or drops its entry
+room_cache: TTLCache[str, RoomRecord] = TTLCache(ROOM_CACHE_SIZE, ROOM_CACHE_TTL)
+
+
+def get_room_by_id(room_id: str, db: Session) -> RoomRecord | None:
+    room = room_cache.get(room_id)
+    if room is not None:
+        return room
+
+    row = db.query(Room).filter_by(room_id=room_id).first()
+    if row is None:
+        # rooms that don't exist aren't cached, they may be created any time
+        return None
+    room = RoomRecord.of(row)
+    room_cache.put(room_id, room)
+    return room
+
+
+def _get_room_row(room_id: str, db: Session) -> Room | None:
+    """The row of a room to write to, never cached."""
+    return db.query(Room).filter_by(room_id=room_id).first()
+
+
+def add_player_to_room(room_id: str, player_name: str, db: Session) -> tuple[bool, str]:
     """
     Adds `player_name` to the room with given `room_id`.
 
     Returns boolean value of whether player was added to the room (by checking room capacity.)
-    """
-    room: Room = db.query(Room).filter(Room.room_id == room_id).first()
 
+    The seat is taken with an update conditional on it still being empty, so the
+    room is read from the cache and only read again if it was stale.
+    """
     if "," in player_name:
         return (
             False,
             "Invalid name. Player name can't contain any symbols. Only letters and numbers are allowed.",
         )
+    if player_name == COMPUTER_NAME:
+        return False, f"`{COMPUTER_NAME}` is taken by the computer, pick another name."
 
-    if room.player1 == "":
-        if player_name == room.player2:
+    room = get_room_by_id(room_id, db)
+    for _ in range(2):
+        if room is None:
+            return False, f"Room with room id `{room_id}` doesn't exist."
+
+        if room.player1 == "":
+            seat, other = Room.player1, room.player2
+            values = {Room.player1: player_name, Room.is_active: True}
+            joined = replace(room, player1=player_name, is_active=True)
+        elif room.player2 == "":
+            seat, other = Room.player2, room.player1
+            values = {Room.player2: player_name}
+            joined = replace(room, player2=player_name)
+            # Both players joined, start the game
+            if room.player1:
+                values[Room.game_status] = GameStatus.PLAYING
+                values[Room.current_turn] = room.player1
+                values[Room.board_state] = empty_board_state(room.grid_size)
+                values[Room.winner] = ""
+        else:
+            return False, "This room is already full."
+
+        if player_name == other:
             return (
                 False,
                 "A player with the same name already exists in the room. Try again with a different name.",
             )
 
-        room.player1 = player_name
-        room.token1 = token
-        room.is_active = True
+        updated = (
+            db.query(Room)
+            .filter(Room.room_id == room_id, seat == "")
+            .update(values, synchronize_session=False)
+        )
         db.commit()
-        return True, ""
+        if updated:
+            room_cache.put(room_id, joined)
+            return True, ""
 
-    elif room.player2 == "":
-        if player_name == room.player1:
-            return (
-                False,
-                "A player with the same name already exists in the room. Try again with a different name.",
-            )
+        # the cached room was stale, someone else took the seat
+        room_cache.invalidate(room_id)
+        room = get_room_by_id(room_id, db)
 
-        room.player2 = player_name
-        room.token2 = token
+    return False, "This room is already full."
 
-        # Both players joined, start the game
-        if room.player1 and room.player2:
-            room.game_status = GameStatus.PLAYING
-            room.current_turn = room.player1
-            room.board_state = "---------"
-            room.winner = ""
 
-        db.commit()
-        return True, ""
+def get_active_rooms(db: Session):
+    return db.query(Room).filter(Room.is_active)
 
-    else:
-        return False, "This room is already full."
 
+def create_room(room_id: str, db: Session, computer: str = "", grid_size: int = 3):
+    """
+    Creates an empty room. With `computer` set to a difficulty, the computer
+    takes the first seat. Raises `IntegrityError` if `room_id` is taken.
+    """
+    player1 = COMPUTER_NAME if computer else ""
+    expires_on = room_expiry()
+    room = Room(
+        room_id=room_id,
+        player1=player1,
+        player2="",
+        is_active=True,
+        computer=computer,
+        grid_size=grid_size,
+        board_state=empty_board_state(grid_size),
+        expires_on=expires_on,
+    )
+    db.add(room)
+    try:
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    record = RoomRecord(
+        room_id, player1, "", True, grid_size, computer, _unix_time(expires_on)
+    )
+    room_cache.put(room_id, record)
+    return record
 
-def verify_player(room_id: str, token: str, db: Session) -> tuple[bool, str]:
-    room = get_room_by_id(room_id, db)
-    if not room:
-        print("no room found")
-        return False, ""
-    if room.token1 == token:
-        return True, room.player1
-    elif room.token2 == token:
-        return True, room.player2
-    else:
-        return False, ""
+
+def create_matched_room(
+    room_id: str,
+    players: tuple[str, str],
+    db: Session,
+    grid_size: int = 3,
+) -> RoomRecord:
+    """
+    Creates a room with both players already in it, in a single write. Raises
+    `IntegrityError` if `room_id` is taken.
+    """
+    return create_matched_rooms([(room_id, players)], db, grid_size)[0]
 
 
-def get_active_rooms(db: Session):
-    return db.query(Room).filter(Room.is_active)
+def create_matched_rooms(
+    rooms: list[tuple[str, tuple[str, str]]],
+    db: Session,
+    grid_size: int = 3,
+) -> list[RoomRecord]:
+    """
+    Creates every `(room_id, players)` room in a single transaction. Raises
+    `IntegrityError`, creating none of them, if any of the room ids is taken.
+    """
+    expires_on = room_expiry()
+    created = [
+        Room(
+            room_id=room_id,
+            player1=player1,
+            player2=player2,
+            is_active=True,
+            grid_size=grid_size,
+            board_state=empty_board_state(grid_size),
+            expires_on=expires_on,
+        )
+        for room_id, (player1, player2) in rooms
+    ]
+    db.add_all(created)
+    try:
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    records = [
+        RoomRecord(
+            room_id, player1, player2, True, grid_size, "", _unix_time(expires_on)
+        )
+        for room_id, (player1, player2) in rooms
+    ]
+    for record in records:
+        room_cache.put(record.room_id, record)
+    return records
 
 
-def create_room(room_id: str, db: Session):
-    room = Room(room_id=room_id)
-    db.add(room)
+def delete_expired_rooms(
+    db: Session,
+    extend: list[str],
+    batch_size: int = CLEANUP_BATCH_SIZE,
+    max_duration: float = CLEANUP_MAX_DURATION,
+) -> list[str]:
+    """
+    Pushes the expiry of the `extend` rooms back by `ROOM_LIFETIME`, then deletes
+    the expired rooms, oldest first, in batches of `batch_size` off the
+    `expires_on` index. Stops after the batch that runs past `max_duration`
+    seconds, leaving the rest to the next call. Returns the ids of the deleted
+    rooms.
+    """
+    deadline = time.monotonic() + max_duration
+    now = datetime.utcnow()
+    for i in range(0, len(extend), batch_size):
+        db.query(Room).filter(Room.room_id.in_(extend[i : i + batch_size])).update(
+            {Room.expires_on: now + timedelta(seconds=ROOM_LIFETIME)},
+            synchronize_session=False,
+        )
     db.commit()
-    db.refresh(room)
-    return room
+    for room_id in extend:
+        room_cache.invalidate(room_id)
+
+    deleted: list[str] = []
+    while time.monotonic() < deadline:
+        batch = [
+            room_id
+            for (room_id,) in db.query(Room.room_id)
+            .filter(Room.expires_on < now)
+            .order_by(Room.expires_on)
+            .limit(batch_size)
+        ]
+        if batch:
+            db.query(Room).filter(Room.room_id.in_(batch)).delete(
+                synchronize_session=False
+            )
+            db.commit()
+            for room_id in batch:
+                room_cache.invalidate(room_id)
+            deleted += batch
+        if len(batch) < batch_size:
+            break
+    return deleted
 
 
-async def update_active_rooms(conn_manager, db: Session):
-    print("updating active rooms")
-    active_rooms = get_active_rooms(db)
+@dataclass(slots=True)
+class CleanupPass:
+    """What a single run of `update_active_rooms` did."""
 
-    for room in active_rooms:
-        if room.created_on is None:
-            continue
+    # rows deleted from the database, and rooms closed in memory
+    deleted: int = 0
+    closed: int = 0
+    # rooms kept alive by their connected players
+    extended: int = 0
+    seconds: float = 0.0
 
-        # Guard: never drop rooms that currently have connected players.
-        # (Active games / waiting rooms should not be cleaned up.)
-        room_id = str(room.room_id)
-        active_conns = getattr(conn_manager, "active_connections", {}).get(room_id)
-        if active_conns is not None and len(active_conns) > 0:
-            continue
 
-        age_seconds = (datetime.utcnow() - room.created_on).total_seconds()
-        if age_seconds > 60 * 60 * 2:
-            db.delete(room)
+async def update_active_rooms(conn_manager) -> CleanupPass:
+    """
+    Drops expired rooms. The rooms this worker holds in memory come off its
+    `room_expiry` heap a couple of passes early, and the ones with players
+    connected have their expiry pushed back, so no worker's pass deletes them.
+    """
+    started = time.perf_counter()
+    result = CleanupPass()
+    now = time.time()
+    extend = []
+    for room_id, expires_at in conn_manager.room_expiry.pop_due(
+        now + 2 * CLEANUP_INTERVAL
+    ):
+        if conn_manager.active_connections.get(room_id):
+            extend.append(room_id)
+            conn_manager.room_expiry.push(room_id, now + ROOM_LIFETIME)
+        elif expires_at <= now:
+            result.closed += 1
+            await conn_manager.delete_room(room_id)
+        else:
+            conn_manager.room_expiry.push(room_id, expires_at)
+    result.extended = len(extend)
+
+    deleted = await run_in_session(lambda db: delete_expired_rooms(db, extend))
+    result.deleted = len(deleted)
+    for room_id in deleted:
+        # held in memory with a later expiry, after being read from another worker
+        if (
+            room_id in conn_manager.active_connections
+            and not (conn_manager.active_connections[room_id])
+        ):
+            result.closed += 1
             await conn_manager.delete_room(room_id)
 
-    db.commit()
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+@dataclass(slots=True, frozen=True)
+class GameState:
+    """
+    The columns of a `Room` the game loop keeps up to date. `board_state` is
+    `None` to leave the board as it is.
+    """
+
+    board_state: str | None
+    current_turn: str
+    game_status: GameStatus
+    winner: str = ""
 
 
 def update_room_game_state(
@@ -134,27 +456,200 @@ def update_room_game_state(
     winner: str,
     db: Session,
 ):
-    room = get_room_by_id(room_id, db)
-    if room:
-        room.board_state = board_state
-        room.current_turn = current_turn
-        room.game_status = game_status
-        room.winner = winner
-        db.commit()
+    update_room_game_states(
+        {room_id: GameState(board_state, current_turn, game_status, winner)}, db
+    )
+
+
+def update_room_game_states(states: dict[str, GameState], db: Session) -> None:
+    """
+    Writes the state of every room in `states` in a single transaction. The
+    cached rooms stay as they are, none of their columns change.
+    """
+    rows = []
+    for room_id, state in states.items():
+        row = {
+            "room_id": room_id,
+            "current_turn": state.current_turn,
+            "game_status": state.game_status,
+            "winner": state.winner,
+        }
+        if state.board_state is not None:
+            row["board_state"] = state.board_state
+        rows.append(row)
+    db.bulk_update_mappings(Room, rows)
+    db.commit()
+
+
+def get_playing_rooms(db: Session, owns: Callable[[str], bool]) -> list[Room]:
+    """The unexpired rooms `owns` is true for with a game still in progress."""
+    return [
+        room
+        for room in db.query(Room).filter(
+            Room.game_status == GameStatus.PLAYING,
+            Room.expires_on > datetime.utcnow(),
+        )
+        if owns(str(room.room_id))
+    ]
+
+
+def _player_rating(row: RatedPlayer, rank: int = 0) -> PlayerRating:
+    return PlayerRating(
+        str(row.name), row.rating, row.games, row.wins, row.draws, row.losses, rank
+    )
+
+
+def rate_game(
+    players: tuple[str, str], winner: str, db: Session
+) -> list[tuple[int, PlayerRating]]:
+    """
+    Rates a game between `players`, won by `winner` or drawn if it's empty, in a
+    single transaction. Players rated for the first time start at `RATING_START`.
+    Returns the rating each player had before the game along with their new one.
+    """
+    for attempt in range(3):
+        try:
+            return _rate_game(players, winner, db)
+        except IntegrityError:
+            # another game rated one of them for the first time at once
+            db.rollback()
+            if attempt == 2:
+                raise
+    raise AssertionError("unreachable")
+
+
+def _rate_game(
+    players: tuple[str, str], winner: str, db: Session
+) -> list[tuple[int, PlayerRating]]:
+    rows = {
+        row.name: row
+        for row in db.query(RatedPlayer)
+        .filter(RatedPlayer.name.in_(players))
+        .with_for_update()
+    }
+    # players gained and lost by every rating
+    counts: dict[int, int] = {}
+    for name in players:
+        if name not in rows:
+            rows[name] = RatedPlayer(
+                name=name, rating=RATING_START, games=0, wins=0, draws=0, losses=0
+            )
+            db.add(rows[name])
+            counts[RATING_START] = counts.get(RATING_START, 0) + 1
+
+    player1, player2 = rows[players[0]], rows[players[1]]
+    old = [player1.rating, player2.rating]
+    score1 = 1.0 if winner == players[0] else 0.0 if winner == players[1] else 0.5
+    new = elo(old[0], old[1], score1, RATING_K)
+    for row, old_rating, new_rating, score in zip(
+        (player1, player2), old, new, (score1, 1 - score1)
+    ):
+        row.games += 1
+        if score == 1:
+            row.wins += 1
+        elif score == 0:
+            row.losses += 1
+        else:
+            row.draws += 1
+        if new_rating != old_rating:
+            counts[old_rating] = counts.get(old_rating, 0) - 1
+            counts[new_rating] = counts.get(new_rating, 0) + 1
+            row.rating = new_rating
+
+    for rating, change in counts.items():
+        if not change:
+            continue
+        updated = (
+            db.query(RatingCount)
+            .filter(RatingCount.rating == rating)
+            .update(
+                {RatingCount.players: RatingCount.players + change},
+                synchronize_session=False,
+            )
+        )
+        if not updated:
+            db.add(RatingCount(rating=rating, players=change))
+    # read before the commit expires the rows
+    rated = [
+        (old_rating, _player_rating(row))
+        for old_rating, row in zip(old, (player1, player2))
+    ]
+    db.commit()
+    return rated
+
 
+def rank_of(rating: int, db: Session) -> int:
+    """The rank of a player rated `rating`, read off the rating counts."""
+    higher = (
+        db.query(func.sum(RatingCount.players))
+        .filter(RatingCount.rating > rating)
+        .scalar()
+    )
+    return 1 + (higher or 0)
 
-def get_room_with_players(room_id: str, db: Session) -> Room | None:
-    return db.query(Room).filter(Room.room_id == room_id).first()
+
+def get_player_rating(name: str, db: Session) -> PlayerRating | None:
+    row = db.get(RatedPlayer, name)
+    if row is None:
+        return None
+    return _player_rating(row, rank_of(row.rating, db))
+
+
+def leaderboard_page(
+    db: Session, limit: int, after: tuple[int, str] | None = None
+) -> list[PlayerRating]:
+    """
+    The `limit` players ranked right after `after`, the `(rating, name)` of a
+    player, or from the top without it. Read off the rating index, so a page
+    takes as long wherever it is.
+    """
+    query = db.query(RatedPlayer)
+    if after is not None:
+        rating, name = after
+        # the first condition bounds the index range, the second cuts it at `after`
+        query = query.filter(
+            RatedPlayer.rating <= rating,
+            or_(RatedPlayer.rating < rating, RatedPlayer.name < name),
+        )
+    rows = (
+        query.order_by(RatedPlayer.rating.desc(), RatedPlayer.name.desc())
+        .limit(limit)
+        .all()
+    )
+    if not rows:
+        return []
+
+    # players rated above each one on the page: those above the first, plus the
+    # ratings between them
+    higher = rank_of(rows[0].rating, db) - 1
+    between = (
+        db.query(RatingCount.rating, RatingCount.players)
+        .filter(
+            RatingCount.rating > rows[-1].rating,
+            RatingCount.rating <= rows[0].rating,
+        )
+        .order_by(RatingCount.rating.desc())
+        .all()
+    )
+    page = []
+    i = 0
+    for row in rows:
+        while i < len(between) and between[i].rating > row.rating:
+            higher += between[i].players
+            i += 1
+        page.append(_player_rating(row, higher + 1))
+    return page
 
 
 def reset_game_after_rematch(room_id: str, db: Session):
-    room = get_room_by_id(room_id, db)
+    room = _get_room_row(room_id, db)
     if room:
-        room.board_state = "---------"
+        room.board_state = empty_board_state(room.grid_size or 3)
         room.winner = ""
         room.game_status = GameStatus.PLAYING
         room.current_turn = room.player1  # Player 1 always starts
         db.commit()
+        room_cache.invalidate(room_id)
 
 
 def get_rematch_votes(room_id: str, db: Session) -> dict[str, bool]:
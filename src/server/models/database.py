@@ -1,33 +1,97 @@
 import os
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from server.config import DB_BACKEND, DB_POOL_RECYCLE, DB_POOL_SIZE, SQLITE_PATH
 
 load_dotenv()
 
-MYSQL_USERNAME = os.environ["MYSQL_USERNAME"]
-MYSQL_PASSWORD = os.environ["MYSQL_PASSWORD"]
-MYSQL_HOST = os.environ["MYSQL_HOST"]
-MYSQL_PORT = os.environ["MYSQL_PORT"]
-DB_NAME = os.environ["DB_NAME"]
-DB_POOL_SIZE = int(os.environ["DB_POOL_SIZE"])
-DB_POOL_RECYCLE = int(os.environ["DB_POOL_RECYCLE"])
-
-DB_CONNECTION_URI = f"mysql+pymysql://{MYSQL_USERNAME}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{DB_NAME}"
-engine = create_engine(
-    DB_CONNECTION_URI,
-    pool_size=DB_POOL_SIZE,
-    pool_recycle=DB_POOL_RECYCLE,
-    pool_pre_ping=True,
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def backend_threads(backend: str) -> int:
+    """
+    Threads the database work runs on, see `crud.run_in_session`; sqlite takes a
+    single writer at a time, so its work runs on a single connection, one at a time.
+    """
+    return 1 if backend == "sqlite" else DB_POOL_SIZE
+
+
+# set by `init_db` for the backend it connects to
+db_threads = backend_threads(DB_BACKEND)
+
+# created by `init_db`, importing the server doesn't connect to anything
+engine: Engine | None = None
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
 Base = declarative_base()
 
 
-def init_db():
+def mysql_engine() -> Engine:
+    uri = (
+        f"mysql+pymysql://{os.environ['MYSQL_USERNAME']}:{os.environ['MYSQL_PASSWORD']}"
+        f"@{os.environ['MYSQL_HOST']}:{os.environ['MYSQL_PORT']}/{os.environ['DB_NAME']}"
+    )
+    return create_engine(
+        uri,
+        pool_size=DB_POOL_SIZE,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+
+def sqlite_engine(path: str) -> Engine:
+    """
+    An embedded database in `path`, or in memory for ":memory:". Files are in
+    WAL mode, so readers in other workers don't wait on the writer.
+    """
+    sqlite = create_engine(
+        f"sqlite:///{path}",
+        # the one connection is used by a single database thread at a time
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+
+    @event.listens_for(sqlite, "connect")
+    def _configure(connection, _) -> None:
+        cursor = connection.cursor()
+        if path != ":memory:":
+            cursor.execute("PRAGMA journal_mode=WAL")
+            # skips a sync per commit, a power cut may lose the last ones but can't
+            # corrupt the file
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        # other workers writing to the same file make a write wait, not fail
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+    return sqlite
+
+
+def init_db(backend: str = DB_BACKEND) -> Engine:
+    """Connects to the database of `backend` and creates the missing tables."""
+    global engine, db_threads
     from . import dbmodels  # noqa: F401
 
+    if backend == "mysql":
+        engine = mysql_engine()
+    elif backend == "sqlite":
+        engine = sqlite_engine(SQLITE_PATH)
+    else:
+        raise ValueError(f"unknown DB_BACKEND {backend!r}, use mysql or sqlite")
+    db_threads = backend_threads(backend)
+
+    SessionLocal.configure(bind=engine)
     Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def close_db() -> None:
+    """Disposes of the engine, once nothing runs queries anymore, see
+    `crud.shutdown_db_threads`."""
+    global engine
+    if engine is not None:
+        engine.dispose()
+        engine = None
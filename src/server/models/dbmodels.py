@@ -1,11 +1,17 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum as PyEnum
 
-from sqlalchemy import DATETIME, Boolean, Column, Enum, String
+from sqlalchemy import DATETIME, Boolean, Column, Enum, Index, Integer, String
+
+from server.config import RATING_START, ROOM_LIFETIME
 
 from .database import Base
 
 
+def room_expiry() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=ROOM_LIFETIME)
+
+
 class GameStatus(str, PyEnum):
     WAITING = "waiting"
     PLAYING = "playing"
@@ -19,12 +25,44 @@ class Room(Base):
     room_id = Column(String(6), primary_key=True, index=True, unique=True)
     player1 = Column(String(50), default="")
     player2 = Column(String(50), default="")
-    token1 = Column(String(43), default="")
-    token2 = Column(String(43), default="")
     # Use Python UTC time to avoid timezone skew between DB server time and app local time.
     created_on = Column(DATETIME, default=datetime.utcnow)
+    # rooms past it get deleted, see `crud.delete_expired_rooms`
+    expires_on = Column(DATETIME, default=room_expiry, index=True)
     is_active = Column(Boolean, default=True)
     game_status = Column(Enum(GameStatus), default=GameStatus.WAITING)
     winner = Column(String(50), default="")
-    board_state = Column(String(200), default="---------")
+    grid_size = Column(Integer, default=3)
+    # one character per cell in row major order, see `crud.pack_board_state`
+    board_state = Column(String(25), default="---------")
     current_turn = Column(String(50), default="")
+    # difficulty of the computer sitting as player1, empty for two human players
+    computer = Column(String(10), default="")
+
+
+class RatedPlayer(Base):
+    """A player's rating, kept under their name across games."""
+
+    __tablename__ = "players"
+
+    name = Column(String(50), primary_key=True)
+    rating = Column(Integer, default=RATING_START, nullable=False)
+    games = Column(Integer, default=0, nullable=False)
+    wins = Column(Integer, default=0, nullable=False)
+    draws = Column(Integer, default=0, nullable=False)
+    losses = Column(Integer, default=0, nullable=False)
+
+    # the leaderboard is read off it, best first, see `crud.leaderboard_page`
+    __table_args__ = (Index("ix_players_rating_name", "rating", "name"),)
+
+
+class RatingCount(Base):
+    """
+    How many players have each rating, kept up to date along with their
+    ratings, so a player's rank takes no count over the players.
+    """
+
+    __tablename__ = "rating_counts"
+
+    rating = Column(Integer, primary_key=True)
+    players = Column(Integer, default=0, nullable=False)
@@ -1,4 +1,18 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from common.events import MAX_GRID_SIZE
+from common.tic_tac_toe import Difficulty
+from server.config import MAX_TOURNAMENT_PLAYERS
+from server.tournaments import TournamentFormat
+
+# grid sizes the game can be played on, up to `MAX_GRID_SIZE`
+MIN_GRID_SIZE = 3
+
+
+class CreateRoomRequest(BaseModel):
+    grid_size: int = Field(3, ge=MIN_GRID_SIZE, le=MAX_GRID_SIZE)
+    # makes the other seat the computer, playing at this difficulty
+    computer: Difficulty | None = None
 
 
 class JoinRoomRequest(BaseModel):
@@ -6,6 +20,13 @@ class JoinRoomRequest(BaseModel):
     room_id: str
 
 
+class CreateTournamentRequest(BaseModel):
+    format: TournamentFormat = TournamentFormat.SINGLE_ELIMINATION
+    # names of the players, best seed first
+    players: list[str] = Field(min_length=2, max_length=MAX_TOURNAMENT_PLAYERS)
+    grid_size: int = Field(3, ge=MIN_GRID_SIZE, le=MAX_GRID_SIZE)
+
+
 class MoveRequest(BaseModel):
     position: int
     player_name: str
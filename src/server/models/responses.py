@@ -14,6 +14,14 @@ class JoinRoomResponse(BaseModel):
     token: str
 
 
+class CreateTournamentResponse(BaseModel):
+    success: bool
+    message: str
+    tournament_id: str
+    # token of every player, to ask for the room of their next game with
+    tokens: dict[str, str]
+
+
 class RoomStatusResponse(BaseModel):
     success: bool
     message: str
@@ -28,3 +36,19 @@ class RematchVoteResponse(BaseModel):
     message: str
     votes: dict[str, bool]
     all_voted: bool
+
+
+class PlayerRatingResponse(BaseModel):
+    rank: int
+    name: str
+    rating: int
+    games: int
+    wins: int
+    draws: int
+    losses: int
+
+
+class LeaderboardResponse(BaseModel):
+    players: list[PlayerRatingResponse]
+    # pass as `after` for the next page, empty on the last one
+    next: str
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from contextlib import suppress
+from dataclasses import replace
+from functools import partial
+
+from server.models import crud
+from server.models.crud import GameState
+from server.models.dbmodels import GameStatus
+
+
+class GameStateWriter:
+    """
+    Writes the state of the games in progress to the database behind the game
+    loops, so a crash loses at most the last `interval` seconds of moves.
+
+    Only the latest state of a room is kept until the next flush, however many
+    moves it made since, and every flush writes all the rooms in a single
+    transaction. Once `max_backlog` rooms are waiting, putting the state of
+    another room waits for the flush; a room already waiting never does.
+    """
+
+    def __init__(self, interval: float, max_backlog: int) -> None:
+        self.interval = interval
+        self.max_backlog = max(max_backlog, 1)
+        self.flushes = 0
+        self.written = 0
+        self.coalesced = 0
+        self.failed = 0
+        self._pending: dict[str, GameState] = {}
+        # last state of every room whose game is in progress
+        self._live: dict[str, GameState] = {}
+        self._flushed = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops flushing on its own, after writing whatever is waiting."""
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        await self.flush()
+
+    async def put(self, room_id: str, state: GameState) -> None:
+        while room_id not in self._pending and len(self._pending) >= self.max_backlog:
+            self._flushed.clear()
+            await self._flushed.wait()
+
+        if room_id in self._pending:
+            self.coalesced += 1
+        self._pending[room_id] = state
+        if state.game_status == GameStatus.PLAYING:
+            self._live[room_id] = state
+        else:
+            self._live.pop(room_id, None)
+
+    async def finish(self, room_id: str, winner: str | None) -> None:
+        """
+        Marks the game of `room_id` finished, if it was written as in progress.
+        A `winner` of `None` means the game ended without a result.
+        """
+        state = self._live.get(room_id)
+        if state is not None:
+            status = GameStatus.FINISHED
+            await self.put(
+                room_id, replace(state, game_status=status, winner=winner or "")
+            )
+
+    async def flush(self) -> None:
+        states, self._pending = self._pending, {}
+        if states:
+            try:
+                await crud.run_in_session(partial(crud.update_room_game_states, states))
+            except asyncio.CancelledError:
+                # stopped mid write, written again by the last flush
+                self._pending = states | self._pending
+                raise
+            except Exception as e:
+                logging.exception(e)
+                self.failed += 1
+                # newer states put during the write win over the failed ones
+                self._pending = states | self._pending
+            else:
+                self.flushes += 1
+                self.written += len(states)
+        self._flushed.set()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "written": self.written,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+        }
@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """
+    Allows `rate` operations per second on average, with bursts of up to
+    `capacity` operations.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, tokens: float = 1) -> bool:
+        """
+        Takes `tokens` out of the bucket, returns False if there aren't enough.
+        """
+        self._refill(time.monotonic())
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+    def retry_after(self, tokens: float = 1) -> float:
+        """
+        Seconds until `tokens` can be consumed.
+        """
+        self._refill(time.monotonic())
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """
+    A `TokenBucket` per key, like a client's address.
+
+    Only the `max_keys` most recently seen keys are tracked, and a forgotten key
+    starts over with a full bucket. That lets nothing extra through for a client
+    idle long enough for its bucket to fill up again, but a busy client whose key
+    is pushed out by `max_keys` other keys seen since gets a fresh burst. Keep
+    `max_keys` well above the keys seen within the time a bucket takes to fill.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.limited = 0
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def hit(self, key: str) -> float:
+        """
+        Counts a request by `key`. Returns 0 if it's allowed, or else the seconds
+        until it would be.
+
+        Not thread safe, call it from the event loop.
+        """
+        buckets = self._buckets
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(buckets) > self.max_keys:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+
+        if bucket.consume():
+            return 0.0
+        self.limited += 1
+        return bucket.retry_after()
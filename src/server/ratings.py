@@ -0,0 +1,96 @@
+import time
+from dataclasses import dataclass
+
+
+@dataclass(slots=True, frozen=True)
+class PlayerRating:
+    name: str
+    rating: int
+    games: int
+    wins: int
+    draws: int
+    losses: int
+    # one more than the players rated higher, players rated the same share it
+    rank: int = 0
+
+    @property
+    def key(self) -> tuple[int, str]:
+        """Where the player sits on the leaderboard, best first in descending order."""
+        return (self.rating, self.name)
+
+
+def elo(rating1: int, rating2: int, score1: float, k: float) -> tuple[int, int]:
+    """
+    The ratings of two players after a game in which the first scored `score1`:
+    1 for a win, 0.5 for a draw, 0 for a loss.
+    """
+    expected1 = 1 / (1 + 10 ** ((rating2 - rating1) / 400))
+    change = round(k * (score1 - expected1))
+    return rating1 + change, rating2 - change
+
+
+class Leaderboard:
+    """
+    The `size` best rated players, ranked, so the first pages of the leaderboard
+    are served from memory. It's reloaded whenever a game changes the ratings of
+    players on it, and once older than `ttl`, which is as long as games finished
+    on other workers may go unseen.
+    """
+
+    def __init__(self, size: int, ttl: float) -> None:
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._top: list[PlayerRating] = []
+        self._position: dict[tuple[int, str], int] = {}
+        self._loaded_at = float("-inf")
+
+    def __len__(self) -> int:
+        return len(self._top)
+
+    @property
+    def stale(self) -> bool:
+        return time.monotonic() - self._loaded_at > self.ttl
+
+    def load(self, top: list[PlayerRating]) -> None:
+        self._top = top
+        self._position = {player.key: i for i, player in enumerate(top)}
+        self._loaded_at = time.monotonic()
+
+    def affected_by(self, changes: list[tuple[int, PlayerRating]]) -> bool:
+        """
+        Whether ratings changing from the old rating to the rated player of each
+        of `changes` reorders the players kept here.
+        """
+        if len(self._top) < self.size:
+            return True
+        cutoff = self._top[-1].rating
+        return any(old >= cutoff or new.rating >= cutoff for old, new in changes)
+
+    def page(
+        self, limit: int, after: tuple[int, str] | None
+    ) -> list[PlayerRating] | None:
+        """
+        The `limit` players ranked right after `after`, from the start without it,
+        or `None` if they aren't all kept here.
+        """
+        if self.stale:
+            return None
+
+        start = 0
+        if after is not None:
+            position = self._position.get(after)
+            if position is None:
+                self.misses += 1
+                return None
+            start = position + 1
+        # with fewer players than it could keep, every player is here
+        if start + limit > len(self._top) and len(self._top) >= self.size:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._top[start : start + limit]
+
+    def stats(self) -> dict:
+        return {"cached": len(self), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,117 @@
+import asyncio
+import secrets
+import string
+import threading
+from collections import deque
+from typing import Callable, TypeVar
+
+from sqlalchemy.exc import IntegrityError
+
+T = TypeVar("T")
+
+ROOM_ID_LENGTH = 6
+_ALPHABET = (string.ascii_letters + string.digits).encode()
+# random bytes past the last whole multiple of the alphabet are thrown away, so every
+# character is as likely as the others
+_USABLE = 256 - 256 % len(_ALPHABET)
+_TO_ALPHABET = bytes(_ALPHABET[b % len(_ALPHABET)] for b in range(256))
+_UNUSABLE = bytes(range(_USABLE, 256))
+
+
+def _random_ids(count: int) -> list[str]:
+    """`count` random room ids, drawn from a single read of random bytes."""
+    needed = count * ROOM_ID_LENGTH
+    chars = b""
+    while len(chars) < needed:
+        extra = needed - len(chars)
+        data = secrets.token_bytes(extra + extra // 16 + 8)
+        chars += data.translate(_TO_ALPHABET, _UNUSABLE)
+    text = chars[:needed].decode()
+    return [text[i : i + ROOM_ID_LENGTH] for i in range(0, needed, ROOM_ID_LENGTH)]
+
+
+class RoomIdPool:
+    """
+    Random room ids, made ahead of time in batches of `size`.
+
+    Ids aren't checked against the database. A room is inserted under an id
+    straight away, and a taken one fails the insert on the primary key, see
+    `insert`. Taking ids when fewer than a quarter of `size` are left refills
+    the pool on the event loop passed to `start`, after the request taking them
+    is served, even when they're taken on a database thread.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = max(size, 1)
+        self.collisions = 0
+        self._ids: deque[str] = deque(_random_ids(self.size))
+        self._lock = threading.Lock()
+        self._refilling = False
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def start(self) -> None:
+        """Refills the pool on the running event loop from now on."""
+        self._loop = asyncio.get_running_loop()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def refill(self) -> None:
+        ids = _random_ids(self.size - len(self._ids))
+        with self._lock:
+            self._ids.extend(ids)
+            self._refilling = False
+
+    def take(self, count: int = 1) -> list[str]:
+        """Reserves `count` ids, which are never handed out again."""
+        with self._lock:
+            if len(self._ids) < count:
+                self._ids.extend(_random_ids(self.size + count - len(self._ids)))
+            ids = [self._ids.popleft() for _ in range(count)]
+            low = len(self._ids) < self.size // 4 and not self._refilling
+            if low:
+                self._refilling = True
+
+        if low:
+            loop = self._loop
+            if loop is not None and not loop.is_closed():
+                # `take` mostly runs on a database thread, see `crud.run_in_session`
+                loop.call_soon_threadsafe(self.refill)
+            else:
+                self.refill()
+        return ids
+
+    def take_where(self, count: int, accept: Callable[[str], bool]) -> list[str]:
+        """Reserves `count` ids `accept` is true for, the others are thrown away."""
+        ids: list[str] = []
+        while len(ids) < count:
+            ids += [id for id in self.take(count - len(ids)) if accept(id)]
+        return ids
+
+    def insert(
+        self,
+        write: Callable[[list[str]], T],
+        count: int = 1,
+        accept: Callable[[str], bool] | None = None,
+        attempts: int = 5,
+    ) -> T:
+        """
+        Calls `write` with `count` fresh ids until it doesn't raise
+        `IntegrityError`, which it must after rolling back if an id is taken.
+        `accept` filters the ids, like in `take_where`.
+        """
+        for attempt in range(attempts):
+            if accept is None:
+                ids = self.take(count)
+            else:
+                ids = self.take_where(count, accept)
+            try:
+                return write(ids)
+            except IntegrityError:
+                self.collisions += 1
+                if attempt == attempts - 1:
+                    raise
+        raise ValueError("attempts must be at least 1")
+
+    def stats(self) -> dict:
+        return {"pooled": len(self), "collisions": self.collisions}
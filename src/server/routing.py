@@ -0,0 +1,337 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import json
+import logging
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from fastapi import WebSocket, WebSocketDisconnect
+from fastapi.websockets import WebSocketState
+
+from common.events import negotiate_subprotocol
+from server.broker import Broker
+from server.config import INBOUND_BURST, INBOUND_OVERFLOW
+
+SessionHandler = Callable[[Any, str, str], Awaitable[None]]
+
+
+@dataclass
+class ProxiedClose:
+    """Closes a proxied websocket with the code the owning worker closed it with."""
+
+    code: int = 1000
+    reason: str = ""
+
+
+# frames to send to a proxied websocket, as `(binary, payload)`
+ProxiedQueue = asyncio.Queue[tuple[bool, bytes] | ProxiedClose]
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest())
+
+
+def _worker_channel(worker_id: str) -> str:
+    return f"ttt.worker.{worker_id}"
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping room ids to worker ids.
+
+    Each worker is placed on the ring `replicas` times so rooms spread evenly, and
+    adding or removing a worker only moves the rooms adjacent to its points.
+    """
+
+    def __init__(self, nodes: list[str], replicas: int = 100) -> None:
+        if not nodes:
+            raise ValueError("a hash ring needs at least one node")
+
+        points = sorted(
+            (_hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas)
+        )
+        self.nodes = sorted(set(nodes))
+        self._keys = [key for key, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str) -> str:
+        if len(self.nodes) == 1:
+            return self.nodes[0]
+        i = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[i]
+
+
+class RemoteWebSocket:
+    """
+    Stands in for a `WebSocket` that is connected to another worker.
+
+    The owning worker runs the usual gameplay handler against this object.
+    Whatever is sent to it gets published back to the worker holding the real
+    socket, and frames that worker receives are fed into `receive`.
+    """
+
+    def __init__(
+        self,
+        router: "RoomRouter",
+        conn_id: str,
+        reply_channel: str,
+        subprotocols: list[str],
+    ):
+        self.application_state = WebSocketState.CONNECTING
+        self.client_state = WebSocketState.CONNECTED
+        self.scope = {"type": "websocket", "subprotocols": subprotocols}
+        self._router = router
+        self._conn_id = conn_id
+        self._reply_channel = reply_channel
+        # frames the handler hasn't read yet, the rate limit only lets a burst
+        # of them through anyway, see `ConnectionManager.read_events`
+        self._inbox: asyncio.Queue[tuple[bool, bytes] | None] = asyncio.Queue(
+            maxsize=INBOUND_BURST
+        )
+
+    def __repr__(self) -> str:
+        return f"RemoteWebSocket({self._conn_id})"
+
+    async def _reply(
+        self, op: str, payload: bytes = b"", binary: bool = False, **header: Any
+    ):
+        await self._router.publish(
+            self._reply_channel,
+            {"op": op, "conn": self._conn_id, "binary": binary, **header},
+            payload,
+        )
+
+    def _feed(self, binary: bool, payload: bytes) -> bool:
+        """Queues a frame for `receive`, returns whether there was room for it."""
+        try:
+            self._inbox.put_nowait((binary, payload))
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def _gone(self) -> None:
+        """Makes `receive` report a disconnect once the queued frames are read,
+        dropping the oldest one if there's no room left."""
+        if self._inbox.full():
+            self._inbox.get_nowait()
+        self._inbox.put_nowait(None)
+
+    async def accept(self, subprotocol: str | None = None) -> None:
+        self.application_state = WebSocketState.CONNECTED
+
+    async def close(self, code: int = 1000, reason: str | None = None) -> None:
+        if self.application_state == WebSocketState.DISCONNECTED:
+            return
+        self.application_state = WebSocketState.DISCONNECTED
+        # the proxy closes the client's socket with the same code, so clients told
+        # to back off (1013) or dropped for a bad frame (1008, 1009) can tell
+        await self._reply("close", (reason or "").encode(), code=code)
+
+    async def send_text(self, data: str) -> None:
+        if self.application_state != WebSocketState.CONNECTED:
+            raise RuntimeError("cannot send on a closed remote websocket")
+        await self._reply("send", data.encode())
+
+    async def send_bytes(self, data: bytes) -> None:
+        if self.application_state != WebSocketState.CONNECTED:
+            raise RuntimeError("cannot send on a closed remote websocket")
+        await self._reply("send", data, binary=True)
+
+    async def send_json(self, data: Any) -> None:
+        await self.send_text(json.dumps(data, separators=(",", ":")))
+
+    async def receive(self) -> dict[str, Any]:
+        item = await self._inbox.get()
+        if item is None:
+            self.client_state = WebSocketState.DISCONNECTED
+            return {"type": "websocket.disconnect", "code": 1000}
+        binary, payload = item
+        if binary:
+            return {"type": "websocket.receive", "bytes": payload}
+        return {"type": "websocket.receive", "text": payload.decode()}
+
+
+class RoomRouter:
+    """
+    Routes every room to the single worker that owns its game loop.
+
+    Ownership is decided by consistent hashing of the room id over the configured
+    workers. A player whose websocket lands on any other worker is proxied: frames
+    travel over the `Broker` to the owner, which sees a `RemoteWebSocket`.
+    With a single worker every room is local and nothing goes through the broker.
+    """
+
+    def __init__(self, worker_id: str, workers: list[str], broker: Broker) -> None:
+        if worker_id not in workers:
+            workers = [*workers, worker_id]
+        self.worker_id = worker_id
+        self.ring = HashRing(workers)
+        self.broker = broker
+        self._conn_ids = itertools.count()
+        # outgoing frame queues of websockets connected here but owned elsewhere
+        self._proxied: dict[str, ProxiedQueue] = {}
+        # stand-ins of websockets connected elsewhere for rooms owned here
+        self._remote: dict[str, RemoteWebSocket] = {}
+        self._sessions: set[asyncio.Task[None]] = set()
+        self._session_handlers: dict[str, SessionHandler] = {}
+        # frames of remote websockets thrown away for arriving faster than read
+        self.dropped_frames = 0
+
+    def owner(self, room_id: str) -> str:
+        return self.ring.owner(room_id)
+
+    def is_local(self, room_id: str) -> bool:
+        return self.ring.owner(room_id) == self.worker_id
+
+    async def start(self, session_handlers: dict[str, SessionHandler]) -> None:
+        """
+        `session_handlers` maps the routes which may be proxied to their handlers,
+        called as `(websocket, room_id, token)` for every remote connection to a
+        room owned by this worker.
+        """
+        self._session_handlers = session_handlers
+        await self.broker.start()
+        await self.broker.subscribe(_worker_channel(self.worker_id), self._on_message)
+
+    async def stop(self) -> None:
+        for task in list(self._sessions):
+            task.cancel()
+        await self.broker.close()
+
+    async def publish(self, channel: str, header: dict[str, Any], payload=b""):
+        await self.broker.publish(
+            channel, json.dumps(header).encode() + b"\n" + payload
+        )
+
+    async def proxy(
+        self, websocket: WebSocket, room_id: str, token: str, route: str = "game"
+    ) -> None:
+        """
+        Relays a websocket connected to this worker to the owner of `room_id`,
+        where it's handled by the session handler of `route`.
+        Returns once either side closes the connection.
+        """
+        conn_id = f"{self.worker_id}:{next(self._conn_ids)}"
+        owner_channel = _worker_channel(self.owner(room_id))
+        outgoing: ProxiedQueue = asyncio.Queue()
+        self._proxied[conn_id] = outgoing
+
+        # the owner negotiates the same subprotocol from the same offer
+        offered = websocket.scope.get("subprotocols", [])
+        await websocket.accept(subprotocol=negotiate_subprotocol(offered))
+        writer_task = asyncio.create_task(self._write_proxied(websocket, outgoing))
+        try:
+            await self.publish(
+                owner_channel,
+                {
+                    "op": "open",
+                    "conn": conn_id,
+                    "room": room_id,
+                    "token": token,
+                    "route": route,
+                    "reply": _worker_channel(self.worker_id),
+                    "subprotocols": offered,
+                },
+            )
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("text") is not None:
+                    header = {"op": "frame", "conn": conn_id, "binary": False}
+                    await self.publish(owner_channel, header, message["text"].encode())
+                elif message.get("bytes") is not None:
+                    header = {"op": "frame", "conn": conn_id, "binary": True}
+                    await self.publish(owner_channel, header, message["bytes"])
+
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+
+        finally:
+            self._proxied.pop(conn_id, None)
+            writer_task.cancel()
+            with suppress(Exception):
+                await self.publish(owner_channel, {"op": "gone", "conn": conn_id})
+
+    async def _write_proxied(
+        self,
+        websocket: WebSocket,
+        outgoing: ProxiedQueue,
+    ) -> None:
+        try:
+            while True:
+                item = await outgoing.get()
+                if isinstance(item, ProxiedClose):
+                    await websocket.close(code=item.code, reason=item.reason or None)
+                    return
+                binary, payload = item
+                if binary:
+                    await websocket.send_bytes(payload)
+                else:
+                    await websocket.send_text(payload.decode())
+        except RuntimeError:
+            # socket already closed
+            return
+
+    async def _run_remote(
+        self, websocket: RemoteWebSocket, route: str, room_id: str, token: str
+    ):
+        try:
+            await self._session_handlers[route](websocket, room_id, token)
+        except Exception as e:
+            logging.exception(e)
+        finally:
+            self._remote.pop(websocket._conn_id, None)
+            with suppress(Exception):
+                await websocket.close()
+
+    async def _on_message(self, message: bytes) -> None:
+        header, _, payload = message.partition(b"\n")
+        header = json.loads(header)
+        conn_id = header["conn"]
+
+        match header["op"]:
+            # owner side
+            case "open":
+                websocket = RemoteWebSocket(
+                    self, conn_id, header["reply"], header["subprotocols"]
+                )
+                self._remote[conn_id] = websocket
+                task = asyncio.create_task(
+                    self._run_remote(
+                        websocket, header["route"], header["room"], header["token"]
+                    )
+                )
+                self._sessions.add(task)
+                task.add_done_callback(self._sessions.discard)
+
+            case "frame":
+                websocket = self._remote.get(conn_id)
+                if websocket is None or websocket._feed(header["binary"], payload):
+                    return
+                self.dropped_frames += 1
+                if INBOUND_OVERFLOW == "disconnect":
+                    self._remote.pop(conn_id, None)
+                    await websocket.close(code=1008)  # policy violation
+                    websocket._gone()
+
+            case "gone":
+                websocket = self._remote.pop(conn_id, None)
+                if websocket is not None:
+                    websocket._gone()
+
+            # proxy side
+            case "send":
+                outgoing = self._proxied.get(conn_id)
+                if outgoing is not None:
+                    outgoing.put_nowait((header["binary"], payload))
+
+            case "close":
+                outgoing = self._proxied.get(conn_id)
+                if outgoing is not None:
+                    outgoing.put_nowait(
+                        ProxiedClose(header.get("code", 1000), payload.decode())
+                    )
@@ -0,0 +1,179 @@
+import asyncio
+from collections import deque
+
+from fastapi import WebSocket, WebSocketDisconnect
+from fastapi.websockets import WebSocketState
+
+from common.events import Event, EventType, negotiate_subprotocol
+
+
+def _has_board(event: Event) -> bool:
+    return event.type_ == EventType.BOARD or (
+        event.type_ == EventType.RESULT and "board" in event.data
+    )
+
+
+class RoomFeed:
+    """
+    The events of a room as seen by its spectators.
+
+    Every spectator reads from the same bounded log through its own cursor, so
+    publishing is O(1) however many are watching and each event is encoded once
+    per wire format. A spectator which falls behind by more than the log holds
+    skips ahead to the latest board.
+    """
+
+    __slots__ = ("log", "version", "board", "changed", "closed", "watchers")
+
+    def __init__(self, size: int) -> None:
+        self.log: deque[tuple[int, Event]] = deque(maxlen=size)
+        self.version = 0
+        # latest event carrying the whole board
+        self.board: Event | None = None
+        self.changed = asyncio.Event()
+        self.closed = False
+        self.watchers = 0
+
+    def publish(self, event: Event) -> None:
+        self.version += 1
+        self.log.append((self.version, event))
+        if _has_board(event):
+            self.board = event
+        self._wake()
+
+    def close(self) -> None:
+        self.closed = True
+        self._wake()
+
+    def _wake(self) -> None:
+        # waiters hold on to the event they waited on, so swapping in a fresh
+        # one wakes all of them without clearing
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def pending(self, cursor: int) -> list[Event]:
+        """Events published after `cursor`, with every board but the last one
+        left out."""
+        events = [event for version, event in self.log if version > cursor]
+        skipped = bool(self.log) and self.log[0][0] > cursor + 1
+        if skipped and self.board is not None and not any(map(_has_board, events)):
+            # fell off the log, catch up from the latest board
+            events.insert(0, self.board)
+
+        last_board = -1
+        for i, event in enumerate(events):
+            if _has_board(event):
+                last_board = i
+        return [
+            event
+            for i, event in enumerate(events)
+            if i >= last_board or event.type_ != EventType.BOARD
+        ]
+
+
+class Spectators:
+    """
+    Read-only watchers of rooms.
+
+    Each spectator gets a writer task of its own, so a slow spectator only
+    delays itself and never the players or the game loop publishing events.
+    """
+
+    def __init__(self, log_size: int, per_room: int) -> None:
+        self.log_size = log_size
+        self.per_room = per_room
+        self._feeds: dict[str, RoomFeed] = {}
+
+    def watching(self, room_id: str) -> bool:
+        feed = self._feeds.get(room_id)
+        return feed is not None and feed.watchers > 0
+
+    def count(self) -> int:
+        return sum(feed.watchers for feed in self._feeds.values())
+
+    def publish(self, room_id: str, event: Event) -> None:
+        feed = self._feeds.get(room_id)
+        if feed is not None:
+            feed.publish(event)
+
+    def close_room(self, room_id: str) -> None:
+        feed = self._feeds.pop(room_id, None)
+        if feed is not None:
+            feed.close()
+
+    async def watch(self, room_id: str, websocket: WebSocket, snapshot: Event | None):
+        """
+        Streams the events of `room_id` to `websocket` until either the room or
+        the connection closes. `snapshot` is the board when the spectator joins.
+        """
+        feed = self._feeds.get(room_id)
+        if feed is None:
+            feed = self._feeds[room_id] = RoomFeed(self.log_size)
+        if feed.watchers >= self.per_room:
+            await websocket.close(code=1013)  # try again later
+            return
+
+        subprotocol = negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        binary = subprotocol is not None and subprotocol.binary
+
+        feed.watchers += 1
+        writer_task = asyncio.create_task(
+            self._write(feed, websocket, binary, snapshot)
+        )
+        try:
+            # spectators have nothing to say, this only notices them leaving
+            while not writer_task.done():
+                receive_task = asyncio.ensure_future(websocket.receive())
+                await asyncio.wait(
+                    (receive_task, writer_task), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not receive_task.done():
+                    receive_task.cancel()
+                    break
+                if receive_task.result()["type"] == "websocket.disconnect":
+                    break
+        except Exception:
+            # Any receive error means the connection is gone.
+            pass
+        finally:
+            feed.watchers -= 1
+            if feed.watchers == 0 and self._feeds.get(room_id) is feed:
+                self._feeds.pop(room_id)
+            writer_task.cancel()
+
+    async def _write(
+        self,
+        feed: RoomFeed,
+        websocket: WebSocket,
+        binary: bool,
+        snapshot: Event | None,
+    ) -> None:
+        cursor = feed.version
+        events = [snapshot] if snapshot is not None else []
+        try:
+            while True:
+                for event in events:
+                    # events cache their encodings, spectators share the frames
+                    if binary:
+                        await websocket.send_bytes(event.encode_binary())
+                    else:
+                        await websocket.send_text(event.encode())
+                events = []
+
+                if feed.version == cursor:
+                    if feed.closed:
+                        break
+                    await feed.changed.wait()
+                    continue
+                events = feed.pending(cursor)
+                cursor = feed.version
+        except (RuntimeError, WebSocketDisconnect):
+            # socket already closed
+            return
+
+        if websocket.application_state == WebSocketState.CONNECTED:
+            try:
+                await websocket.close()
+            except RuntimeError:
+                pass
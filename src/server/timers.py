@@ -0,0 +1,118 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from dataclasses import dataclass
+from typing import Callable
+
+
+class Timer:
+    """
+    A handle to a callback scheduled on the `TimerWheel`.
+    """
+
+    __slots__ = ("deadline", "seq", "callback", "cancelled", "fired", "_wheel")
+
+    def __init__(
+        self, deadline: float, seq: int, callback: Callable[[], None], wheel
+    ) -> None:
+        self.deadline = deadline
+        self.seq = seq
+        self.callback = callback
+        self.cancelled = False
+        self.fired = False
+        self._wheel = wheel
+
+    def __lt__(self, other: "Timer") -> bool:
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+    def cancel(self) -> None:
+        if self.cancelled or self.fired:
+            return
+        self.cancelled = True
+        self._wheel._on_cancel()
+
+
+@dataclass(frozen=True, slots=True)
+class Expiry:
+    """
+    Put in a player's incoming event queue when one of the room's deadlines runs out.
+    """
+
+    reason: str
+    timer: Timer
+
+
+class TimerWheel:
+    """
+    A single scheduler shared by every room.
+
+    Deadlines are kept in a min-heap which is drained by one background task, instead
+    of each room wrapping its receives in `asyncio.wait_for`. Cancelled timers are
+    removed lazily and the heap is compacted once they make up most of it.
+    """
+
+    def __init__(self) -> None:
+        self._heap: list[Timer] = []
+        self._seq = itertools.count()
+        self._cancelled = 0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+
+    def __len__(self) -> int:
+        return len(self._heap) - self._cancelled
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> Timer:
+        """
+        Runs `callback` after `delay` seconds. The callback must not block.
+        """
+        deadline = asyncio.get_running_loop().time() + delay
+        timer = Timer(deadline, next(self._seq), callback, self)
+        heapq.heappush(self._heap, timer)
+        if self._heap[0] is timer:
+            self._wakeup.set()
+        return timer
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _on_cancel(self) -> None:
+        self._cancelled += 1
+        if self._cancelled > 64 and self._cancelled * 2 > len(self._heap):
+            self._heap[:] = [t for t in self._heap if not t.cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        heap = self._heap
+        while True:
+            now = loop.time()
+            while heap and heap[0].deadline <= now:
+                timer = heapq.heappop(heap)
+                if timer.cancelled:
+                    self._cancelled -= 1
+                    continue
+                timer.fired = True
+                try:
+                    timer.callback()
+                except Exception as e:
+                    logging.exception(e)
+
+            self._wakeup.clear()
+            timeout = heap[0].deadline - now if heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
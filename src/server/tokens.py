@@ -0,0 +1,86 @@
+import base64
+import hashlib
+import hmac
+import logging
+import secrets
+import time
+
+# bytes of the HMAC-SHA256 kept in a token
+_SIGNATURE_SIZE = 16
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def parse_keys(spec: str) -> dict[str, bytes]:
+    """
+    Parses comma separated `key_id:secret` pairs, the first one signs new tokens.
+    Without any, a random key is made up, which only lasts as long as the process.
+    """
+    keys = {}
+    for pair in spec.split(","):
+        key_id, _, secret = pair.strip().partition(":")
+        if key_id and secret:
+            keys[key_id] = secret.encode()
+    if not keys:
+        logging.warning("TOKEN_KEYS is not set, tokens won't outlive this process")
+        keys["0"] = secrets.token_bytes(32)
+    return keys
+
+
+class TokenSigner:
+    """
+    Issues and verifies the tokens players connect to a room with, so checking
+    them doesn't take a database lookup.
+
+    A token is `key_id.payload.signature`: the payload holds the room id, the
+    expiry and the player name, signed with HMAC-SHA256 under the key `key_id`.
+    The first key signs; keeping retired keys around after it lets tokens
+    issued under them verify until they expire, which is how keys are rotated.
+    """
+
+    def __init__(self, keys: dict[str, bytes], ttl: float) -> None:
+        if not keys:
+            raise ValueError("at least one key is needed")
+        self.keys = keys
+        self.key_id = next(iter(keys))
+        self.ttl = ttl
+
+    def _signature(self, key: bytes, signed: str) -> str:
+        digest = hmac.new(key, signed.encode(), hashlib.sha256).digest()
+        return _encode(digest[:_SIGNATURE_SIZE])
+
+    def sign(self, room_id: str, player_name: str) -> str:
+        expiry = int(time.time() + self.ttl)
+        payload = _encode(f"{room_id},{expiry},{player_name}".encode())
+        signed = f"{self.key_id}.{payload}"
+        return f"{signed}.{self._signature(self.keys[self.key_id], signed)}"
+
+    def verify(self, token: str, room_id: str) -> str | None:
+        """
+        Returns the name of the player `token` was issued to for `room_id`, or
+        `None` if it's forged, expired, signed with an unknown key or meant for
+        another room.
+        """
+        key_id, _, rest = token.partition(".")
+        payload, _, signature = rest.partition(".")
+        key = self.keys.get(key_id)
+        if key is None or not payload or not signature:
+            return None
+        expected = self._signature(key, f"{key_id}.{payload}")
+        if not hmac.compare_digest(signature.encode(), expected.encode()):
+            return None
+
+        try:
+            token_room, expiry, player_name = _decode(payload).decode().split(",", 2)
+            expired = int(expiry) < time.time()
+        except ValueError:
+            return None
+        if expired or token_room != room_id or not player_name:
+            return None
+        return player_name
@@ -0,0 +1,214 @@
+from dataclasses import asdict, dataclass
+from enum import Enum
+
+
+class TournamentFormat(str, Enum):
+    ROUND_ROBIN = "round_robin"
+    SINGLE_ELIMINATION = "single_elimination"
+
+
+@dataclass(slots=True)
+class Standing:
+    wins: int = 0
+    draws: int = 0
+    losses: int = 0
+    # two for a win, one for a draw
+    points: int = 0
+
+
+@dataclass(slots=True, eq=False)
+class Pairing:
+    """
+    A game of a round. `player2` is `None` for a bye, which isn't played.
+    """
+
+    player1: str
+    player2: str | None
+    room_id: str = ""
+    done: bool = False
+    # name of the winner, empty for a draw
+    winner: str = ""
+
+
+class Tournament:
+    """
+    Pairs registered players round after round, keeping the standings as results
+    come in.
+
+    Round robin plays everyone against everyone once, using the circle method,
+    and is won on points. Single elimination pairs the best seeded players left
+    against the worst ones and keeps the winners, a draw or a game that never
+    got played sends the better seed through. With an odd number of players
+    left, one of them sits the round out: in round robin each player in turn, in
+    single elimination the best seed, who goes through.
+    """
+
+    def __init__(
+        self,
+        tournament_id: str,
+        format: TournamentFormat,
+        players: list[str],
+        grid_size: int,
+    ) -> None:
+        if len(players) < 2 or len(set(players)) != len(players):
+            raise ValueError("a tournament needs two or more players, named apart")
+
+        self.tournament_id = tournament_id
+        self.format = format
+        self.players = players
+        self.grid_size = grid_size
+        self.standings = {name: Standing() for name in players}
+        # players left in single elimination, best seed first
+        self.alive = list(players)
+        self.rounds_played = 0
+        self.pairings: list[Pairing] = []
+        self._pending = 0
+        # the current game of every player who has one
+        self._pairing_of: dict[str, Pairing] = {}
+        self.champion = ""
+
+    @property
+    def total_rounds(self) -> int:
+        if self.format == TournamentFormat.ROUND_ROBIN:
+            return len(self.players) - 1 + len(self.players) % 2
+        return (len(self.players) - 1).bit_length()
+
+    @property
+    def finished(self) -> bool:
+        return bool(self.champion)
+
+    def next_round(self) -> list[Pairing]:
+        """
+        Pairs the players for the next round and returns the games to be played.
+        Byes are settled right away.
+        """
+        if self.finished or self._pending:
+            raise RuntimeError("the current round isn't over")
+
+        if self.format == TournamentFormat.ROUND_ROBIN:
+            pairs = self._round_robin_pairs(self.rounds_played)
+        else:
+            pairs = self._elimination_pairs()
+        self.rounds_played += 1
+        self.pairings = [Pairing(player1, player2) for player1, player2 in pairs]
+        self._pairing_of.clear()
+
+        games = []
+        for pairing in self.pairings:
+            if pairing.player2 is None:
+                pairing.done = True
+                pairing.winner = pairing.player1
+                continue
+            self._pairing_of[pairing.player1] = pairing
+            self._pairing_of[pairing.player2] = pairing
+            games.append(pairing)
+        self._pending = len(games)
+        return games
+
+    def _round_robin_pairs(self, round_: int) -> list[tuple[str, str | None]]:
+        seats: list[str | None] = list(self.players)
+        if len(seats) % 2:
+            seats.append(None)
+        # the first seat stays put, the others rotate by one every round
+        rest = seats[1:]
+        shift = round_ % len(rest)
+        order = [seats[0]] + rest[-shift:] + rest[:-shift] if shift else seats
+        pairs = []
+        for i in range(len(order) // 2):
+            player1, player2 = order[i], order[-1 - i]
+            if player1 is None:
+                player1, player2 = player2, None
+            pairs.append((player1, player2))
+        return pairs
+
+    def _elimination_pairs(self) -> list[tuple[str, str | None]]:
+        alive = self.alive
+        pairs: list[tuple[str, str | None]] = []
+        if len(alive) % 2:
+            pairs.append((alive[0], None))
+            alive = alive[1:]
+        for i in range(len(alive) // 2):
+            pairs.append((alive[i], alive[-1 - i]))
+        return pairs
+
+    def pairing_of(self, player_name: str) -> Pairing | None:
+        """The game `player_name` has to play this round, if any is left."""
+        pairing = self._pairing_of.get(player_name)
+        if pairing is None or pairing.done:
+            return None
+        return pairing
+
+    def record(self, pairing: Pairing, winner: str | None) -> bool:
+        """
+        Settles a game of the current round with the name of its winner, an empty
+        string for a draw, or `None` if it never got played, which counts as a
+        draw. Returns whether that was the last game of the round.
+        """
+        if pairing.done or pairing.player2 is None:
+            return False
+
+        pairing.done = True
+        pairing.winner = winner if winner in (pairing.player1, pairing.player2) else ""
+        player1 = self.standings[pairing.player1]
+        player2 = self.standings[pairing.player2]
+        if pairing.winner:
+            won, lost = (
+                (player1, player2)
+                if pairing.winner == pairing.player1
+                else (player2, player1)
+            )
+            won.wins += 1
+            won.points += 2
+            lost.losses += 1
+        else:
+            for standing in (player1, player2):
+                standing.draws += 1
+                standing.points += 1
+
+        if self.format == TournamentFormat.SINGLE_ELIMINATION:
+            # the better seed goes through a draw
+            loser = pairing.player1 if pairing.winner == pairing.player2 else None
+            self.alive.remove(loser or pairing.player2)
+
+        self._pending -= 1
+        if self._pending:
+            return False
+
+        if self.format == TournamentFormat.SINGLE_ELIMINATION:
+            if len(self.alive) == 1:
+                self.champion = self.alive[0]
+        elif self.rounds_played == self.total_rounds:
+            self.champion = self.ranking()[0]
+        return True
+
+    def ranking(self) -> list[str]:
+        """
+        Players by points, then wins, then registration order. Players knocked out
+        of single elimination rank below those still in.
+        """
+        order = {name: i for i, name in enumerate(self.players)}
+        alive = set(self.alive)
+
+        def key(name: str) -> tuple:
+            standing = self.standings[name]
+            knocked_out = (
+                self.format == TournamentFormat.SINGLE_ELIMINATION and name not in alive
+            )
+            return (knocked_out, -standing.points, -standing.wins, order[name])
+
+        return sorted(self.players, key=key)
+
+    def summary(self) -> dict:
+        return {
+            "tournament_id": self.tournament_id,
+            "format": self.format.value,
+            "grid_size": self.grid_size,
+            "round": self.rounds_played,
+            "total_rounds": self.total_rounds,
+            "champion": self.champion,
+            "pairings": [asdict(pairing) for pairing in self.pairings],
+            "standings": [
+                {"name": name, **asdict(self.standings[name])}
+                for name in self.ranking()
+            ],
+        }
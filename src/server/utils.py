@@ -1,41 +1,39 @@
-import secrets
-import string
+import asyncio
 from dataclasses import dataclass
 
 from fastapi import WebSocket
 
-from server.models.crud import db_session, get_room_by_id
 
-
-def generate_room_id() -> str:
-    """
-    Helper function to generate a random room id.
-    """
-    usable = string.ascii_letters + string.digits
-    id = ""
-    for _ in range(6):
-        id += secrets.choice(usable)
-
-    with db_session() as db:
-        while True:
-            if get_room_by_id(id, db):
-                id = ""
-                for _ in range(6):
-                    id += secrets.choice(usable)
-            else:
-                break
-
-    return id
-
-
-def generate_url_token() -> str:
-    """
-    Returns a random url safe token for `JoinRoomResponse`.
-    """
-    return secrets.token_urlsafe()
-
-
-@dataclass
+@dataclass(slots=True)
 class Player:
     name: str
     ws: WebSocket
+    # whether the websocket negotiated a binary subprotocol
+    binary: bool = False
+    # whether the websocket negotiated a subprotocol with `DELTA` board updates
+    deltas: bool = False
+    # false while the player's websocket is gone and they may still reconnect
+    connected: bool = True
+    # incoming events for the game loop, created on first use
+    queue: asyncio.Queue | None = None
+    # events queued from the client so far, and how many were when it was last
+    # told its event was rejected, see `ConnectionManager.drop_stale_events`
+    events_queued: int = 0
+    rejected_at: int | None = None
+
+
+@dataclass(slots=True)
+class RoomStats:
+    """
+    Counters of frames received from the clients of a room.
+    """
+
+    received: int = 0
+    # stale or overflowing events thrown away
+    dropped: int = 0
+    # frames over the client's rate limit
+    throttled: int = 0
+    # frames over `MAX_FRAME_SIZE`
+    oversized: int = 0
+    # malformed events and events clients may not send
+    invalid: int = 0